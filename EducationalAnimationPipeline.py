@@ -1,78 +1,1234 @@
-import os
-import asyncio
-from typing import List, Dict
-
-# Import all the necessary components
-from InterestExplorer import InterestExplorer
-from entity_extraction import EntityExtractor
-from entity_enrichment_prompt import PromptEnricher
-from text_to_image import StabilityImageGenerator
-
-class EducationalAnimationPipeline:
-    def __init__(self, output_base_dir: str = "pipeline_outputs"):
-        self.output_base_dir = output_base_dir
-        self.image_dir = os.path.join(output_base_dir, "generated_images")
-        os.makedirs(self.image_dir, exist_ok=True)
-
-        self.interest_explorer = InterestExplorer()
-        self.entity_extractor = EntityExtractor()
-        self.prompt_enricher = PromptEnricher()
-        self.image_generator = StabilityImageGenerator()
-
-    async def process_entity(self, entity: str, seed: int = 42) -> Dict:
-        """
-        Process a single entity: enrich prompt, generate explanation, and generate image.
-        """
-        try:
-            print(f"\n--- Processing entity: {entity} ---")
-            
-            enriched_prompt = self.prompt_enricher.enrich_prompt(entity)
-            print(f"Image Prompt: {enriched_prompt}")
-
-            explanation = self.interest_explorer.generate_with_focus(
-                interest=entity, 
-                focus_aspect=f"a simple, one-paragraph explanation of what a {entity} is, for a child"
-            )
-            print(f"Explanation: {explanation}")
-
-            # --- THIS IS THE KEY CHANGE: We now pass the 'entity' to the image generator ---
-            image_paths = self.image_generator.generate_images(
-                entity=entity, # Pass the entity for caching and unique naming
-                prompt=enriched_prompt, 
-                seed=seed, 
-                num_images=1, 
-                output_dir=self.image_dir
-            )
-            if not image_paths:
-                raise Exception(f"API image generation failed for {entity}")
-
-            return {
-                "entity": entity,
-                "prompt": enriched_prompt,
-                "image_path": image_paths[0],
-                "explanation": explanation,
-            }
-        except Exception as e:
-            return {"entity": entity, "error": str(e)}
-
-    async def run_pipeline(self, user_topic: str) -> List[Dict]:
-        """
-        Run the complete pipeline by extracting the main subject directly from the user's topic.
-        """
-        try:
-            print("🚀 Starting Educational Pipeline...")
-            
-            print(f"\n--- Extracting main subject directly from user topic: '{user_topic}' ---")
-            entities = self.entity_extractor.extract_concepts(user_topic)
-
-            if not entities or "error" in entities[0]:
-                raise Exception(f"Entity extraction failed: {entities}")
-            
-            print(f"✅ Extracted subject: {entities}")
-
-            tasks = [self.process_entity(entity, seed=42 + i) for i, entity in enumerate(entities)]
-            return await asyncio.gather(*tasks)
-
-        except Exception as e:
-            print(f"❌ A critical pipeline error occurred: {str(e)}")
-            return []
\ No newline at end of file
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Dict, Optional
+
+# Import all the necessary components
+from InterestExplorer import InterestExplorer
+from entity_extraction import EntityExtractor
+from entity_enrichment_prompt import PromptEnricher
+from text_to_image import StabilityImageGenerator
+from lesson_planner import LessonPlanner
+from model_routing import ModelRouter
+from clients import lazy_cerebras_client
+from http_transport import HttpTransport
+from image_cache import ImageCache
+from completion_cache import CompletionCache
+from response_cache import ResponseCache
+from cache_backend import CacheBackend, backend_from_env
+from single_flight import SingleFlight
+from rate_governor import RateGovernor, RateLimited
+from deadline import Deadline
+from image_delivery import ensure_placeholder
+from telemetry import DEGRADED, REGISTRY, span
+
+if TYPE_CHECKING:
+    # NumPy is only imported once the topic index is loaded.
+    from topic_index import TopicIndex
+
+log = logging.getLogger(__name__)
+
+TOPIC_INDEX_SEED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "topic_index_seed.json")
+
+class EducationalAnimationPipeline:
+    # Under a latency budget, the share of the remaining time an entity may spend on its prompt;
+    # the image needs the rest.
+    PROMPT_SHARE = 0.25
+    # Shares of the budget entity extraction and fused lesson planning may use before the
+    # topic itself is served as the only entity, so the entity stages always keep the rest.
+    EXTRACTION_SHARE = 0.25
+    PLAN_SHARE = 0.5
+
+    def __init__(
+        self,
+        output_base_dir: str = "pipeline_outputs",
+        max_workers: int = 16,
+        pool_size: int = 100,
+        llm_concurrency: Optional[int] = None,
+        image_concurrency: Optional[int] = None,
+        image_cache_max_bytes: Optional[int] = None,
+        fused: bool = False,
+        use_topic_index: bool = True,
+        interest_explorer: Optional[InterestExplorer] = None,
+        entity_extractor: Optional[EntityExtractor] = None,
+        prompt_enricher: Optional[PromptEnricher] = None,
+        image_generator: Optional[StabilityImageGenerator] = None,
+        lesson_planner: Optional[LessonPlanner] = None,
+        topic_index: Optional["TopicIndex"] = None,
+        rate_governor: Optional[RateGovernor] = None,
+        cache_backend: Optional[CacheBackend] = None,
+        progressive: Optional[bool] = None,
+        model_router: Optional[ModelRouter] = None,
+    ):
+        self.output_base_dir = output_base_dir
+        self.image_dir = os.path.join(output_base_dir, "generated_images")
+        os.makedirs(self.image_dir, exist_ok=True)
+
+        # Shared by every worker process and host (CACHE_BACKEND), so each image and
+        # completion is generated once fleet-wide. Without one, the caches are per process.
+        self.cache_backend = cache_backend or backend_from_env(output_base_dir)
+        self.image_cache = ImageCache(
+            self.image_dir,
+            max_bytes=image_cache_max_bytes or int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3))),
+            backend=self.cache_backend,
+        )
+
+        self.completion_cache = CompletionCache(
+            os.path.join(output_base_dir, "completion_cache.sqlite3"), backend=self.cache_backend
+        )
+
+        # Whole /generate responses by normalized topic; dropped when one of their images is evicted.
+        self.response_cache = ResponseCache(
+            os.path.join(output_base_dir, "response_cache.sqlite3"),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+        )
+        self.image_cache.eviction_listeners.append(self.response_cache.invalidate_paths)
+
+        # Every Cerebras and Stability call waits its turn under one set of adaptive per-provider limits.
+        self.rate_governor = rate_governor or RateGovernor()
+
+        # One pooled Cerebras client and one completion cache are shared by all the LLM components.
+        # The client (and the SDK) is only built on the first completion, or by warm_up().
+        # The governor re-queues throttled calls, so the SDK's own retries are turned off.
+        self.cerebras_client = lazy_cerebras_client(pool_size, max_retries=0)
+
+        # Each stage's model and max_tokens (MODEL_ROUTING_PROFILE, MODEL_ROUTES): lightweight stages use a small model.
+        self.model_router = model_router or ModelRouter()
+        llm_options = dict(
+            client=self.cerebras_client, cache=self.completion_cache, governor=self.rate_governor, router=self.model_router
+        )
+        self.interest_explorer = interest_explorer or InterestExplorer(**llm_options)
+        self.entity_extractor = entity_extractor or EntityExtractor(**llm_options)
+        self.prompt_enricher = prompt_enricher or PromptEnricher(**llm_options)
+        # Fused mode asks for the entities, prompts and explanations in a single completion.
+        self.fused = fused
+        self.lesson_planner = lesson_planner
+        if fused and lesson_planner is None:
+            self.lesson_planner = LessonPlanner(**llm_options)
+
+        # A pooled keep-alive transport with timeouts and retries for the Stability API.
+        self.stability_transport = HttpTransport(pool_size=pool_size, governor=self.rate_governor)
+        self.image_generator = image_generator or StabilityImageGenerator(
+            transport=self.stability_transport, cache=self.image_cache
+        )
+
+        # The Cerebras SDK and requests are blocking, so every upstream call is
+        # run on this bounded pool instead of directly on the event loop.
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+
+        # Separate caps on in-flight Cerebras and Stability calls, so one stage can't take every worker.
+        self.llm_concurrency = llm_concurrency or max_workers
+        self.image_concurrency = image_concurrency or max_workers
+        self._llm_limit: Optional[asyncio.Semaphore] = None
+        self._image_limit: Optional[asyncio.Semaphore] = None
+
+        # Known phrasings resolve to their entity and prompt locally, skipping extraction and enrichment.
+        # The index is loaded on first use (or by warm_up()), off the event loop.
+        self.topic_index_dir = os.path.join(output_base_dir, "topic_index")
+        self.topic_index = topic_index
+        self.use_topic_index = use_topic_index or topic_index is not None
+        self._topic_index_error: Optional[str] = None
+        self._topic_index_lock = threading.Lock()
+
+        # Identical topics and entities that are already being processed are awaited, not repeated.
+        self._topic_flights = SingleFlight()
+        self._entity_flights = SingleFlight()
+        # Callbacks that want each entity's result of a topic run as soon as it is ready.
+        self._topic_listeners: Dict[str, List[Callable[[Dict], None]]] = {}
+        # Images still generating after their request's deadline passed; clients poll for them.
+        self._background = set()
+
+        # Progressive mode answers with a cheap preview image and renders the full one in the
+        # background (see _render). Full renders in flight by path, so each one runs once.
+        if progressive is None:
+            progressive = os.getenv("PIPELINE_PROGRESSIVE_IMAGES", "").lower() in ("1", "true", "yes")
+        self.progressive = progressive
+        self._upgrades: Dict[str, asyncio.Future] = {}
+
+        # Cache, transport and rate governor counters are exported on /metrics at scrape time.
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def _load_topic_index(self) -> "TopicIndex":
+        from topic_index import TopicIndex
+
+        threshold = float(os.getenv("TOPIC_INDEX_THRESHOLD", "0.8"))
+        if os.path.isdir(self.topic_index_dir):
+            return TopicIndex.load(self.topic_index_dir, threshold=threshold)
+        if os.path.exists(TOPIC_INDEX_SEED_FILE):
+            return TopicIndex.from_seed_file(TOPIC_INDEX_SEED_FILE, threshold=threshold)
+        return TopicIndex(threshold=threshold)
+
+    def _ensure_topic_index(self) -> Optional["TopicIndex"]:
+        """Loads the topic index once. If loading fails, topics are resolved by the LLM instead."""
+        if not self.use_topic_index or self.topic_index is not None or self._topic_index_error:
+            return self.topic_index
+        with self._topic_index_lock:
+            if self.topic_index is None and not self._topic_index_error:
+                try:
+                    self.topic_index = self._load_topic_index()
+                except Exception as e:
+                    self._topic_index_error = f"{type(e).__name__}: {e}"
+                    log.error("❌ Could not load the topic index, resolving topics with the LLM: %s", e)
+        return self.topic_index
+
+    def warm_up(self):
+        """
+        Builds the Cerebras client and the Stability session and loads the topic index
+        ahead of the first request.
+        Meant to run in the background once the server is up; failures are reported by
+        readiness() and retried on first use.
+        """
+        start = time.perf_counter()
+        try:
+            self.cerebras_client.get()
+        except Exception as e:
+            log.error("❌ Could not build the Cerebras client: %s", e)
+        self.stability_transport.warm_up()
+        self._ensure_topic_index()
+        log.info("🔥 Pipeline warmed up in %.2fs", time.perf_counter() - start)
+
+    def readiness(self) -> Dict:
+        """
+        Per-component status: 'ready', 'idle' (built on first use), 'loading', 'disabled'
+        or 'error: ...'. The pipeline is ready when nothing is loading or failed.
+        """
+        if not self.use_topic_index:
+            topic_index = "disabled"
+        elif self.topic_index is not None:
+            topic_index = "ready"
+        elif self._topic_index_error:
+            topic_index = f"error: {self._topic_index_error}"
+        else:
+            topic_index = "loading" if self._topic_index_lock.locked() else "idle"
+        components = {
+            "cerebras": self.cerebras_client.status(),
+            "stability": self.image_generator.status() if hasattr(self.image_generator, "status") else "ready",
+            "topic_index": topic_index,
+            "image_cache": "ready",
+            "completion_cache": "ready",
+        }
+        ready = not any(status == "loading" or status.startswith("error") for status in components.values())
+        return {"ready": ready, "components": components}
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """
+        Runs a blocking client call on the pipeline's executor without stalling the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        # Executor threads don't inherit context variables; copying them keeps spans in the request's trace.
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, lambda: context.run(func, *args, **kwargs))
+
+    async def _run_llm(self, func, *args, **kwargs):
+        """Runs a blocking Cerebras call once a slot under the LLM concurrency limit is free."""
+        if self._llm_limit is None:
+            # Created on first use so it belongs to the loop the pipeline actually runs on.
+            self._llm_limit = asyncio.Semaphore(self.llm_concurrency)
+        async with self._llm_limit:
+            return await self._run_blocking(func, *args, **kwargs)
+
+    async def _run_image(self, func, *args, **kwargs):
+        """Runs a blocking Stability call once a slot under the image concurrency limit is free."""
+        if self._image_limit is None:
+            self._image_limit = asyncio.Semaphore(self.image_concurrency)
+        async with self._image_limit:
+            return await self._run_blocking(func, *args, **kwargs)
+
+    @staticmethod
+    def _flight_key(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    async def process_entity(
+        self, entity: str, seed: int = 42, prompt: Optional[str] = None, deadline: Optional[Deadline] = None
+    ) -> Dict:
+        """
+        Process a single entity: enrich prompt, generate explanation, and generate image.
+        A known prompt skips enrichment. Concurrent calls for the same entity and seed share one run,
+        unless the call has a deadline (its result may be degraded, so it isn't shared).
+        """
+        deadline = deadline or Deadline()
+        with span("entity", entity=entity) as attrs:
+            if deadline.expires is None:
+                result = await self._entity_flights.do(
+                    (self._flight_key(entity), seed), lambda: self._process_entity(entity, seed, prompt)
+                )
+            else:
+                result = await self._process_entity(entity, seed, prompt, deadline)
+            if "error" in result:
+                attrs["error"] = result["error"]
+        return dict(result, entity=entity)
+
+    async def _enrich(self, entity: str, prompt: Optional[str]) -> str:
+        if prompt:
+            return prompt
+        return await self._run_llm(self.prompt_enricher.enrich_prompt, entity)
+
+    @staticmethod
+    def _focus_aspect(entity: str) -> str:
+        return f"a simple, one-paragraph explanation of what a {entity} is, for a child"
+
+    async def _generate_image(self, entity: str, prompt: str, seed: int, preset: Optional[str] = None) -> str:
+        # Only progressive mode asks for a preset, so generators without presets keep working.
+        options = {"preset": preset} if preset else {}
+        image_paths = await self._run_image(
+            self.image_generator.generate_images,
+            entity=entity, # Pass the entity for caching and unique naming
+            prompt=prompt,
+            seed=seed,
+            num_images=1,
+            output_dir=self.image_dir,
+            **options
+        )
+        if not image_paths:
+            raise Exception(f"API image generation failed for {entity}")
+        return image_paths[0]
+
+    async def _render(self, entity: str, prompt: str, seed: int) -> Dict[str, str]:
+        """
+        The image fields of a result. In progressive mode a cheap preview is generated and
+        returned first, and the full image renders in the background: "full_image_path" is
+        where it will appear (a separate cache entry, so the URL changes once it's ready).
+        A full image that is already cached is returned directly.
+        """
+        if not self.progressive:
+            return {"image_path": await self._generate_image(entity, prompt, seed)}
+        full_key = self.image_generator.image_key(prompt, seed)
+        full_path = await self._run_blocking(self.image_cache.get, full_key)
+        if full_path:
+            return {"image_path": full_path}
+        preview_path = await self._generate_image(entity, prompt, seed, preset="preview")
+        self._upgrade(entity, prompt, seed)
+        return {"image_path": preview_path, "full_image_path": self.image_generator.expected_path(prompt, seed, self.image_dir)}
+
+    def _upgrade(self, entity: str, prompt: str, seed: int) -> asyncio.Future:
+        """Starts, or joins, the background render of the full image that replaces a preview."""
+        path = self.image_generator.expected_path(prompt, seed, self.image_dir)
+        task = self._upgrades.get(path)
+        if task is None:
+            task = self._spawn(self._generate_image(entity, prompt, seed, preset="full"))
+            self._upgrades[path] = task
+            task.add_done_callback(lambda _: self._upgrades.pop(path, None))
+        return task
+
+    async def _process_entity(
+        self, entity: str, seed: int, prompt: Optional[str] = None, deadline: Optional[Deadline] = None
+    ) -> Dict:
+        """
+        The explanation is independent of the prompt and the image, so it runs alongside them.
+        Parts that aren't ready by the deadline are replaced by their fallbacks and listed
+        under "degraded": the template or generic prompt, a short explanation, and a similar
+        cached image or a placeholder. A failed explanation is replaced by the short one too;
+        other failures are reported as without a deadline.
+        """
+        deadline = deadline or Deadline()
+        degraded: Dict[str, str] = {}
+        try:
+            log.debug("--- Processing entity: %s ---", entity)
+
+            explanation_task = asyncio.ensure_future(self._run_llm(
+                self.interest_explorer.generate_with_focus,
+                interest=entity,
+                focus_aspect=self._focus_aspect(entity),
+            ))
+            prompt_task = asyncio.ensure_future(self._enrich(entity, prompt))
+            try:
+                try:
+                    enriched_prompt = await self._settle(prompt_task, deadline.remaining(self.PROMPT_SHARE))
+                except asyncio.TimeoutError:
+                    enriched_prompt = self.prompt_enricher.fallback_prompt(entity)
+                    self._degrade(degraded, entity, "prompt", "template", "timed out")
+                log.debug("Image Prompt: %s", enriched_prompt)
+                image = await self._image_with_fallback(entity, enriched_prompt, seed, deadline, degraded)
+                explanation = await self._explanation_with_fallback(
+                    entity, enriched_prompt, explanation_task, deadline, degraded
+                )
+                log.debug("Explanation: %s", explanation)
+            finally:
+                explanation_task.cancel()
+                prompt_task.cancel()
+
+            result = {"entity": entity, "prompt": enriched_prompt, **image, "explanation": explanation}
+            if degraded:
+                result["degraded"] = degraded
+            return result
+        except Exception as e:
+            return {"entity": entity, "error": str(e)}
+
+    async def _process_planned_entity(self, item: Dict[str, str], seed: int, deadline: Optional[Deadline] = None) -> Dict:
+        """
+        Finishes an entity from a fused lesson plan, which already carries its prompt and explanation.
+        """
+        entity = item["entity"]
+        degraded: Dict[str, str] = {}
+        try:
+            image = await self._image_with_fallback(entity, item["prompt"], seed, deadline or Deadline(), degraded)
+            result = {"entity": entity, "prompt": item["prompt"], **image, "explanation": item["explanation"]}
+            if degraded:
+                result["degraded"] = degraded
+            return result
+        except Exception as e:
+            return {"entity": entity, "error": str(e)}
+
+    # --- LATENCY BUDGET FALLBACKS ---
+    async def _bounded(self, coro, deadline: Deadline, share: float = 1.0):
+        """
+        Awaits coro for at most deadline.remaining(share) seconds. Raises asyncio.TimeoutError
+        when it runs late, and lets it finish in the background so its completions are cached.
+        """
+        task = self._spawn(coro)
+        try:
+            return await self._settle(task, deadline.remaining(share))
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    @staticmethod
+    async def _settle(task: asyncio.Future, timeout: Optional[float]):
+        """
+        Returns task's result once it is done, waiting at most timeout seconds (None waits
+        indefinitely). Raises asyncio.TimeoutError if it isn't done by then, without cancelling it.
+        """
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        if not done:
+            raise asyncio.TimeoutError
+        return task.result()
+
+    def _spawn(self, coro) -> asyncio.Future:
+        """Starts work that may outlive the request that started it."""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+        return task
+
+    def _background_done(self, task: asyncio.Future):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.debug("Background work failed: %s", task.exception())
+
+    @staticmethod
+    def _degrade(degraded: Dict[str, str], entity: str, part: str, fallback: str, reason: str):
+        log.warning("⚠️ The %s for '%s' %s; serving the %s fallback.", part, entity, reason, fallback)
+        DEGRADED.inc(part=part, fallback=fallback)
+        degraded[part] = fallback
+
+    async def _image_with_fallback(
+        self, entity: str, prompt: str, seed: int, deadline: Deadline, degraded: Dict[str, str]
+    ) -> Dict[str, str]:
+        """
+        Waits for the image until the deadline. If it is late, the most similar cached image
+        stands in, or else a placeholder plus "pending_image_path", where the real image (in
+        progressive mode, the preview) appears once it is done. A failed generation raises.
+        Late images keep generating in the background, so they are cached for next time.
+        """
+        try:
+            return await self._bounded(self._render(entity, prompt, seed), deadline)
+        except asyncio.TimeoutError:
+            pass
+
+        similar = await self._run_blocking(self.image_cache.find_similar, f"{entity} {prompt}")
+        if similar:
+            self._degrade(degraded, entity, "image", "similar", "timed out")
+            return {"image_path": similar}
+        self._degrade(degraded, entity, "image", "placeholder", "timed out")
+        if not self.progressive:
+            return {
+                "image_path": ensure_placeholder(self.image_dir),
+                "pending_image_path": self.image_generator.expected_path(prompt, seed, self.image_dir),
+            }
+        return {
+            "image_path": ensure_placeholder(self.image_dir),
+            "pending_image_path": self.image_generator.expected_path(prompt, seed, self.image_dir, preset="preview"),
+            "full_image_path": self.image_generator.expected_path(prompt, seed, self.image_dir),
+        }
+
+    async def _explanation_with_fallback(
+        self, entity: str, prompt: str, task: asyncio.Future, deadline: Deadline, degraded: Dict[str, str]
+    ) -> str:
+        """
+        Waits for the explanation until the deadline. Cached explanations are answered from the
+        completion cache right away; a late or failed one is replaced by a short explanation.
+        """
+        try:
+            explanation = await self._settle(task, deadline.remaining())
+        except asyncio.TimeoutError:
+            self._degrade(degraded, entity, "explanation", "short", "timed out")
+            return self._short_explanation(entity, prompt)
+        if InterestExplorer.is_error(explanation):
+            self._degrade(degraded, entity, "explanation", "short", "failed")
+            return self._short_explanation(entity, prompt)
+        return explanation
+
+    @staticmethod
+    def _short_explanation(entity: str, prompt: str) -> str:
+        # Image prompts read "a ... photograph of <subject>"; the subject makes a one-line caption.
+        subject = prompt.split(" of ", 1)[1] if " of " in prompt else entity
+        return f"This is {entity}: {subject}. A longer explanation isn't available right now."
+
+    async def _stream_entity(
+        self, entity: str, seed: int, emit: Callable[[Dict], None], prompt: Optional[str] = None
+    ) -> Dict:
+        """
+        Like _process_entity, but emits explanation tokens and the image as soon as they exist.
+        In progressive mode the preview is emitted first and a second "image" event carries
+        the full image once it is rendered; the result then shows the full image. A failed
+        explanation is streamed as the short one, as in _process_entity.
+        """
+        loop = asyncio.get_running_loop()
+        degraded: Dict[str, str] = {}
+
+        def explain() -> str:
+            pieces = []
+            for piece in self.interest_explorer.stream_with_focus(entity, self._focus_aspect(entity)):
+                if InterestExplorer.is_error(piece):
+                    # The error message is not a token; the short explanation replaces it below.
+                    return piece
+                pieces.append(piece)
+                loop.call_soon_threadsafe(emit, {"event": "token", "entity": entity, "text": piece})
+            return "".join(pieces).strip()
+
+        try:
+            explanation_task = asyncio.ensure_future(self._run_llm(explain))
+            try:
+                enriched_prompt = await self._enrich(entity, prompt)
+                image = await self._render(entity, enriched_prompt, seed)
+                quality = "preview" if "full_image_path" in image else "full"
+                emit({"event": "image", "entity": entity, "quality": quality, **image})
+                explanation = await explanation_task
+                if InterestExplorer.is_error(explanation):
+                    self._degrade(degraded, entity, "explanation", "short", "failed")
+                    explanation = self._short_explanation(entity, enriched_prompt)
+                    emit({"event": "token", "entity": entity, "text": explanation})
+                if quality == "preview":
+                    try:
+                        full_path = await asyncio.shield(self._upgrade(entity, enriched_prompt, seed))
+                        image = {"image_path": full_path}
+                        emit({"event": "image", "entity": entity, "quality": "full", "image_path": full_path})
+                    except Exception as e:
+                        log.warning("⚠️ The full image for '%s' failed; keeping the preview: %s", entity, e)
+            finally:
+                explanation_task.cancel()
+
+            result = {
+                "entity": entity,
+                "prompt": enriched_prompt,
+                **image,
+                "explanation": explanation,
+            }
+            if degraded:
+                result["degraded"] = degraded
+            return result
+        except Exception as e:
+            return {"entity": entity, "error": str(e)}
+
+    async def run_pipeline(
+        self,
+        user_topic: str,
+        on_entity: Optional[Callable[[Dict], None]] = None,
+        budget: Optional[float] = None,
+    ) -> List[Dict]:
+        """
+        Run the complete pipeline by extracting the main subject directly from the user's topic.
+        Concurrent requests for the same topic (and budget) share one run. on_entity, if given,
+        is called on the event loop with each entity's result as it finishes (results that
+        finished before a call joined a shared run are only in the returned list).
+        budget, in seconds, bounds the response time: extraction (or fused planning) may use a
+        share of it before the topic itself is served as the only entity, each later stage gets
+        what is left, and parts that aren't ready in time are served degraded (see _process_entity).
+        """
+        deadline = Deadline(budget)
+        key = self._flight_key(user_topic)
+        if budget is not None:
+            key = f"{key}@{budget}"
+        if on_entity:
+            self._topic_listeners.setdefault(key, []).append(on_entity)
+        try:
+            with span("pipeline", topic=user_topic) as attrs:
+                results = await self._topic_flights.do(key, lambda: self._run_pipeline(user_topic, key, deadline))
+                attrs["entities"] = len(results)
+                if not results:
+                    attrs["error"] = "no results"
+        finally:
+            if on_entity:
+                listeners = self._topic_listeners[key]
+                listeners.remove(on_entity)
+                if not listeners:
+                    del self._topic_listeners[key]
+        return [dict(result) for result in results]
+
+    def _report_entity(self, key: str, result: Dict) -> Dict:
+        for listener in list(self._topic_listeners.get(key, ())):
+            try:
+                listener(dict(result))
+            except Exception as e:
+                log.warning("⚠️ Entity listener failed: %s", e)
+        return result
+
+    async def _run_pipeline(self, user_topic: str, key: str, deadline: Deadline) -> List[Dict]:
+        # Set when extraction or planning ran out of its share (or extraction was throttled)
+        # and the topic stands in for the entities.
+        degraded: Dict[str, str] = {}
+
+        async def reported(work) -> Dict:
+            result = await work
+            if degraded and "error" not in result:
+                result = dict(result, degraded=dict(result.get("degraded", {}), **degraded))
+            return self._report_entity(key, result)
+
+        try:
+            log.info("🚀 Starting Educational Pipeline for '%s'", user_topic)
+
+            if self.fused:
+                log.debug("--- Planning the lesson for '%s' in a single completion ---", user_topic)
+                try:
+                    plan = await self._bounded(
+                        self._run_llm(self.lesson_planner.plan_lesson, user_topic), deadline, self.PLAN_SHARE
+                    )
+                except asyncio.TimeoutError:
+                    plan = None
+                    self._degrade(degraded, user_topic, "entities", "topic", "timed out")
+                if plan:
+                    tasks = [
+                        reported(self._process_planned_entity(item, seed=42 + i, deadline=deadline))
+                        for i, item in enumerate(plan)
+                    ]
+                    return await asyncio.gather(*tasks)
+                if not degraded:
+                    log.warning("⚠️ Fused lesson plan failed; falling back to the staged pipeline.")
+
+            if not degraded:
+                try:
+                    entities, prompts = await self._resolve_entities(user_topic, deadline)
+                except asyncio.TimeoutError:
+                    self._degrade(degraded, user_topic, "entities", "topic", "timed out")
+                except RateLimited:
+                    self._degrade(degraded, user_topic, "entities", "topic", "hit the rate limit")
+            if degraded:
+                entities, prompts = [user_topic.strip()], {}
+            tasks = [
+                reported(self.process_entity(entity, seed=42 + i, prompt=prompts.get(entity), deadline=deadline))
+                for i, entity in enumerate(entities)
+            ]
+            results = await asyncio.gather(*tasks)
+            await self._remember(user_topic, results, from_index=bool(prompts))
+            return results
+
+        except Exception as e:
+            log.error("❌ A critical pipeline error occurred: %s", e)
+            return []
+
+    async def stream_pipeline(self, user_topic: str) -> AsyncIterator[Dict]:
+        """
+        Runs the pipeline and yields events as soon as each part is ready: the extracted
+        entities, explanation tokens, each image, and finally a "result" event carrying
+        exactly what run_pipeline would have returned.
+        """
+        try:
+            entities, prompts = await self._resolve_entities(user_topic)
+        except Exception as e:
+            yield {"event": "error", "error": str(e)}
+            yield {"event": "result", "results": []}
+            return
+        yield {"event": "entities", "entities": entities}
+
+        queue: asyncio.Queue = asyncio.Queue()
+        runner = asyncio.gather(*[
+            self._stream_entity(entity, 42 + i, queue.put_nowait, prompt=prompts.get(entity))
+            for i, entity in enumerate(entities)
+        ])
+
+        def finished(done: asyncio.Future):
+            queue.put_nowait(None)
+            if not done.cancelled():
+                done.exception() # Marks the outcome as retrieved when the stream was abandoned.
+
+        runner.add_done_callback(finished)
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+            results = runner.result()
+        finally:
+            # Stops the remaining work if the client goes away mid-stream.
+            runner.cancel()
+
+        await self._remember(user_topic, results, from_index=bool(prompts))
+        yield {"event": "result", "results": list(results)}
+
+    async def run_batch(self, topics: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Runs many topics at once and returns each topic's results, as run_pipeline would.
+        See stream_batch for how the work is shared and scheduled.
+        """
+        results = {}
+        async for item in self.stream_batch(topics):
+            results[item["topic"]] = item["results"]
+        return results
+
+    async def stream_batch(self, topics: List[str]) -> AsyncIterator[Dict]:
+        """
+        Runs many topics at once and yields {"topic", "results"} for each one as soon as it
+        completes. Repeated topics run once, and an entity that shows up under several topics
+        is enriched, explained and drawn once for the whole batch (with the seed of its first
+        occurrence). Cerebras and Stability calls are bounded by the pipeline's per-stage
+        concurrency limits, not by the number of topics.
+        """
+        unique: Dict[str, List[str]] = {}
+        for topic in topics:
+            unique.setdefault(self._flight_key(topic), []).append(topic)
+
+        entity_tasks: Dict[str, asyncio.Future] = {}
+
+        def entity_task(entity: str, make) -> asyncio.Future:
+            key = self._flight_key(entity)
+            if key not in entity_tasks:
+                entity_tasks[key] = asyncio.ensure_future(make())
+            return entity_tasks[key]
+
+        async def run_topic(key: str) -> tuple:
+            user_topic = unique[key][0]
+            try:
+                if self.fused:
+                    plan = await self._run_llm(self.lesson_planner.plan_lesson, user_topic)
+                    if plan:
+                        tasks = [
+                            entity_task(item["entity"], lambda i=i, item=item: self._process_planned_entity(item, 42 + i))
+                            for i, item in enumerate(plan)
+                        ]
+                        results = await asyncio.gather(*tasks)
+                        return key, [dict(r, entity=item["entity"]) for r, item in zip(results, plan)]
+                    log.warning("⚠️ Fused lesson plan failed for '%s'; falling back to the staged pipeline.", user_topic)
+
+                entities, prompts = await self._resolve_entities(user_topic)
+                tasks = [
+                    entity_task(entity, lambda i=i, entity=entity: self.process_entity(
+                        entity, seed=42 + i, prompt=prompts.get(entity)
+                    ))
+                    for i, entity in enumerate(entities)
+                ]
+                results = [dict(r, entity=entity) for r, entity in zip(await asyncio.gather(*tasks), entities)]
+                await self._remember(user_topic, results, from_index=bool(prompts))
+                return key, results
+            except Exception as e:
+                log.error("❌ Batch topic '%s' failed: %s", user_topic, e)
+                return key, []
+
+        log.info("🚀 Starting batch of %d topics (%d unique)...", len(topics), len(unique))
+        pending = [asyncio.ensure_future(run_topic(key)) for key in unique]
+        try:
+            for next_done in asyncio.as_completed(pending):
+                key, results = await next_done
+                for topic in unique[key]:
+                    yield {"topic": topic, "results": [dict(result) for result in results]}
+        finally:
+            # Stops the remaining work if the consumer goes away mid-batch.
+            for task in pending + list(entity_tasks.values()):
+                task.cancel()
+
+    async def _resolve_entities(self, user_topic: str, deadline: Optional[Deadline] = None):
+        """
+        Returns the entities for a topic and any prompts already known for them. A close
+        enough match in the topic index answers locally; otherwise the LLM extracts them,
+        within EXTRACTION_SHARE of the deadline (asyncio.TimeoutError past it, RateLimited
+        when the governor gave up on a throttled call).
+        """
+        topic_index = self.topic_index
+        if topic_index is None and self.use_topic_index:
+            topic_index = await self._run_blocking(self._ensure_topic_index)
+        if topic_index is not None:
+            with span("topic_index") as attrs:
+                # Lock-free and sub-millisecond, even while the index compacts; no executor round trip.
+                match = topic_index.lookup(user_topic)
+                attrs["hit"] = bool(match)
+            if match:
+                log.info("✅ Topic index match for '%s' (score %.2f): %s", user_topic, match["score"], match["query"])
+                entities = [item["entity"] for item in match["entities"]]
+                prompts = {item["entity"]: item["prompt"] for item in match["entities"] if item.get("prompt")}
+                return entities, prompts
+
+        log.debug("--- Extracting main subject directly from user topic: '%s' ---", user_topic)
+        entities = await self._bounded(
+            self._run_llm(self.entity_extractor.extract_concepts, user_topic), deadline or Deadline(), self.EXTRACTION_SHARE
+        )
+
+        if not entities or "error" in entities[0]:
+            raise Exception(f"Entity extraction failed: {entities}")
+
+        log.info("✅ Extracted subject: %s", entities)
+        return entities, {}
+
+    async def related_entities(self, user_topic: str, results: List[Dict]) -> List[str]:
+        """
+        Names of entities a student is likely to ask about after user_topic, picked by the
+        LLM from the served explanations (see InterestExplorer.potential_entities).
+        """
+        served = {self._flight_key(result["entity"]) for result in results if "entity" in result}
+        text = "\n\n".join(result["explanation"] for result in results if result.get("explanation"))
+        entities = await self._run_llm(self.interest_explorer.potential_entities, text or user_topic, user_topic)
+        names = []
+        for item in entities:
+            name = (item.get("name") or "").strip()
+            if name and self._flight_key(name) not in served and name not in names:
+                names.append(name)
+        return names
+
+    async def prefetch_entity(self, entity: str, seed: int = 42) -> Dict:
+        """
+        Processes an entity before anyone asks for it, so its prompt, explanation and image
+        are cached, and records it in the topic index so a question naming it resolves locally.
+        """
+        result = await self.process_entity(entity, seed=seed)
+        await self._remember(entity, [result], from_index=False)
+        return result
+
+    async def _remember(self, user_topic: str, results: List[Dict], from_index: bool):
+        """Adds a fully successful run to the topic index so the next phrasing resolves locally."""
+        if self.topic_index is None or from_index or not results:
+            return
+        if any("error" in result or "degraded" in result for result in results):
+            return
+        entities = [{"entity": result["entity"], "prompt": result["prompt"]} for result in results]
+        # Inserting can wait on the index lock while a finished compaction swaps its postings in.
+        await self._run_blocking(self.topic_index.insert, user_topic, entities)
+
+    def stats(self) -> Dict:
+        """Counters from the caches, the Stability transport, the rate governor and the model router."""
+        stats = {
+            "image_cache": self.image_cache.stats(),
+            "completion_cache": self.completion_cache.stats(),
+            "response_cache": self.response_cache.stats(),
+            "stability_transport": self.stability_transport.stats(),
+            "rate_governor": self.rate_governor.stats(),
+            "rate_governor_providers": self.rate_governor.provider_stats(),
+            "model_routing": self.model_router.stats(),
+        }
+        if self.cache_backend is not None:
+            stats["cache_backend"] = self.cache_backend.stats()
+        return stats
+
+    def collect_metrics(self):
+        """Turns stats() into Prometheus metric families for the telemetry registry."""
+        stats = self.stats()
+        shared = [("image", stats["image_cache"]), ("completion", stats["completion_cache"])]
+        caches = shared + [("response", stats["response_cache"])]
+        yield "cache_hits_total", "counter", "Cache lookups that hit.", [
+            ({"cache": name}, s["hits"]) for name, s in caches
+        ]
+        yield "cache_misses_total", "counter", "Cache lookups that missed.", [
+            ({"cache": name}, s["misses"]) for name, s in caches
+        ]
+        yield "cache_hit_ratio", "gauge", "Hits over lookups since start.", [
+            ({"cache": name}, s["hits"] / (s["hits"] + s["misses"]) if s["hits"] + s["misses"] else 0.0)
+            for name, s in caches
+        ]
+        yield "cache_shared_hits_total", "counter", "Local misses answered by the shared cache backend.", [
+            ({"cache": name}, s["shared_hits"]) for name, s in shared
+        ]
+        yield "cache_evictions_total", "counter", "Entries evicted from each cache.", [
+            ({"cache": name}, s["evictions"]) for name, s in caches
+        ]
+        yield "cache_entries", "gauge", "Entries in each cache.", [
+            ({"cache": name}, s["entries"]) for name, s in caches
+        ]
+        yield "response_cache_invalidations_total", "counter", "Responses dropped because an image they show was evicted.", [
+            ({}, stats["response_cache"]["invalidations"])
+        ]
+        yield "image_cache_bytes", "gauge", "Bytes on disk in the image cache.", [
+            ({}, stats["image_cache"]["bytes"])
+        ]
+        transport = stats["stability_transport"]
+        yield "upstream_retries_total", "counter", "Upstream attempts that were retried.", [
+            ({"provider": "stability"}, transport["retries"])
+        ]
+        yield "upstream_failures_total", "counter", "Upstream calls that failed after every retry.", [
+            ({"provider": "stability"}, transport["failures"])
+        ]
+        limits = list(stats["rate_governor"].items()) + list(stats["rate_governor_providers"].items())
+        for name, field, kind, documentation in (
+            ("rate_governor_queued", "queued", "gauge", "Callers waiting for a rate limit slot."),
+            ("rate_governor_in_flight", "in_flight", "gauge", "Upstream calls holding a slot."),
+            ("rate_governor_window", "window", "gauge", "Current AIMD concurrency window."),
+            ("rate_governor_throttled_total", "throttled", "counter", "Calls the provider throttled."),
+            ("rate_governor_wait_seconds_avg", "wait_avg_ms", "gauge", "Average wait for a slot."),
+        ):
+            scale = 0.001 if field == "wait_avg_ms" else 1
+            # Provider-wide buckets only report the token fields (queued, wait).
+            yield name, kind, documentation, [({"limit": key}, s[field] * scale) for key, s in limits if field in s]
+
+    def close(self):
+        """Saves the topic index and releases the worker threads used for blocking client calls."""
+        REGISTRY.remove_collector(self.collect_metrics)
+        if self.topic_index is not None:
+            self.topic_index.save(self.topic_index_dir)
+        if self.cache_backend is not None:
+            self.cache_backend.close()
+        self._executor.shutdown(wait=False)
+
+def test_pipeline_concurrency():
+    """
+    Runs the pipeline against slow local stubs and checks that the stages overlap:
+    the wall time should be close to the slowest path, not the sum of every call.
+    """
+    delay = 0.5
+
+    class SlowExtractor:
+        def extract_concepts(self, text):
+            time.sleep(delay)
+            return ["Sun", "Moon", "Earth"]
+
+    class SlowEnricher:
+        def enrich_prompt(self, entity):
+            time.sleep(delay)
+            return f"a high-quality photograph of {entity}"
+
+    class SlowExplorer:
+        def generate_with_focus(self, interest, focus_aspect):
+            time.sleep(delay)
+            return f"{interest} is fascinating."
+
+    class SlowImageGenerator:
+        def generate_images(self, entity, prompt, seed, num_images, output_dir):
+            time.sleep(delay)
+            return [os.path.join(output_dir, f"{entity.lower()}.png")]
+
+    print("\n--- Running EducationalAnimationPipeline Concurrency Test (with local stubs) ---")
+    pipeline = EducationalAnimationPipeline(
+        interest_explorer=SlowExplorer(),
+        entity_extractor=SlowExtractor(),
+        prompt_enricher=SlowEnricher(),
+        image_generator=SlowImageGenerator(),
+    )
+    try:
+        start = time.perf_counter()
+        results = asyncio.run(pipeline.run_pipeline("Tell me about the solar system"))
+        elapsed = time.perf_counter() - start
+    finally:
+        pipeline.close()
+
+    # extract -> (enrich | explain) -> image is three stages deep; run serially it would be 10 calls.
+    serial = delay * (1 + 3 * 3)
+    critical_path = delay * 3
+    print(f"Wall time: {elapsed:.2f}s (critical path {critical_path:.2f}s, serial {serial:.2f}s)")
+
+    ok = len(results) == 3 and all("error" not in r for r in results) and elapsed < critical_path + delay
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+    return ok
+
+def test_batch_scheduler():
+    """
+    Runs a batch with overlapping topics and entities against local stubs and checks that
+    shared entities are processed once and that each stage stays under its concurrency limit.
+    """
+    delay = 0.2
+    lock = threading.Lock()
+    calls = {"extract": 0, "enrich": 0, "explain": 0, "image": 0}
+    active = {"llm": 0, "image": 0}
+    peak = {"llm": 0, "image": 0}
+
+    def track(stage, kind):
+        with lock:
+            calls[stage] += 1
+            active[kind] += 1
+            peak[kind] = max(peak[kind], active[kind])
+        time.sleep(delay)
+        with lock:
+            active[kind] -= 1
+
+    topic_entities = {
+        "the solar system": ["Sun", "Moon", "Earth"],
+        "eclipses": ["Sun", "Moon"],
+        "tides": ["Moon", "Ocean"],
+        "volcanoes": ["Volcano", "Earth"],
+    }
+
+    class StubExtractor:
+        def extract_concepts(self, text):
+            track("extract", "llm")
+            return topic_entities[text.lower().strip()]
+
+    class StubEnricher:
+        def enrich_prompt(self, entity):
+            track("enrich", "llm")
+            return f"a high-quality photograph of {entity}"
+
+    class StubExplorer:
+        def generate_with_focus(self, interest, focus_aspect):
+            track("explain", "llm")
+            return f"{interest} is fascinating."
+
+    class StubImageGenerator:
+        def generate_images(self, entity, prompt, seed, num_images, output_dir):
+            track("image", "image")
+            return [os.path.join(output_dir, f"{entity.lower()}.png")]
+
+    print("\n--- Running EducationalAnimationPipeline Batch Test (with local stubs) ---")
+    pipeline = EducationalAnimationPipeline(
+        llm_concurrency=3,
+        image_concurrency=2,
+        use_topic_index=False,
+        interest_explorer=StubExplorer(),
+        entity_extractor=StubExtractor(),
+        prompt_enricher=StubEnricher(),
+        image_generator=StubImageGenerator(),
+    )
+    topics = list(topic_entities) + ["The Solar System", "eclipses"]
+    try:
+        start = time.perf_counter()
+        results = asyncio.run(pipeline.run_batch(topics))
+        elapsed = time.perf_counter() - start
+    finally:
+        pipeline.close()
+
+    unique_entities = {e for entities in topic_entities.values() for e in entities}
+    print(f"Wall time: {elapsed:.2f}s, calls: {calls}, peak concurrency: {peak}")
+
+    ok = (
+        set(results) == set(topics)
+        and [r["entity"] for r in results["tides"]] == ["Moon", "Ocean"]
+        and calls["extract"] == len(topic_entities)
+        and calls["enrich"] == calls["explain"] == calls["image"] == len(unique_entities)
+        and peak["llm"] <= 3 and peak["image"] <= 2
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+    return ok
+
+def test_latency_budget():
+    """
+    Runs a budgeted request against local stubs with one slow image, one slow explanation
+    and one slow image that has a similar image cached, and checks that the response arrives
+    within the budget with each of those parts degraded, and that the slow image still lands.
+    Then checks that a slow extraction serves the topic itself within the budget without
+    degrading the fast stages, that a throttled extraction serves the topic too, and that
+    without a budget a failed image is an error, not a fallback. A failed explanation is
+    served as the short one and marked degraded, with or without a budget and when streamed.
+    """
+    import tempfile
+    from image_delivery import placeholder_png
+    budget, slow = 0.4, 1.0
+
+    class StubExtractor:
+        def extract_concepts(self, text):
+            if "slowly" in text:
+                time.sleep(1.5)
+            if "broken" in text:
+                return ["Geyser"]
+            if "throttled" in text:
+                raise RateLimited("cerebras kept throttling the extraction")
+            if "silent" in text:
+                return ["Quasar"]
+            return ["Comet", "Nebula", "Volcano"]
+
+    class StubEnricher:
+        def enrich_prompt(self, entity):
+            return f"a high-quality photograph of a {entity.lower()}"
+
+        def fallback_prompt(self, entity):
+            return f"a high-quality photograph of {entity}"
+
+    class StubExplorer:
+        def generate_with_focus(self, interest, focus_aspect):
+            if interest == "Nebula":
+                time.sleep(slow)
+            if interest == "Quasar":
+                return f"{InterestExplorer.ERROR_PREFIX}upstream 400: bad request"
+            return f"{interest} is fascinating."
+
+        def stream_with_focus(self, interest, focus_aspect):
+            yield self.generate_with_focus(interest, focus_aspect)
+
+    class StubImageGenerator:
+        def expected_path(self, prompt, seed, output_dir):
+            return os.path.join(output_dir, f"{prompt.split()[-1]}_{seed}.png")
+
+        def generate_images(self, entity, prompt, seed, num_images, output_dir):
+            if entity == "Geyser":
+                raise Exception("upstream unavailable")
+            time.sleep(slow if entity in ("Comet", "Volcano") else 0.05)
+            path = self.expected_path(prompt, seed, output_dir)
+            with open(path, "wb") as f:
+                f.write(placeholder_png())
+            return [path]
+
+    print("\n--- Running EducationalAnimationPipeline Latency Budget Test (with local stubs) ---")
+    pipeline = EducationalAnimationPipeline(
+        output_base_dir=tempfile.mkdtemp(prefix="budget-"),
+        use_topic_index=False,
+        interest_explorer=StubExplorer(),
+        entity_extractor=StubExtractor(),
+        prompt_enricher=StubEnricher(),
+        image_generator=StubImageGenerator(),
+    )
+    similar = pipeline.image_cache.put(
+        "ab" * 32, placeholder_png(), label="Volcano a high-quality photograph of an erupting volcano"
+    )
+    pipeline.image_cache.put("cd" * 32, placeholder_png(), label="Geyser a high-quality photograph of a geyser")
+
+    async def timed(topic, budget):
+        start = time.perf_counter()
+        results = await pipeline.run_pipeline(topic, budget=budget)
+        return results, time.perf_counter() - start
+
+    async def run():
+        results, elapsed = await timed("Tell me about space and volcanoes", budget)
+        # The late image keeps generating and appears where the response said it would.
+        pending = results[0].get("pending_image_path", "")
+        for _ in range(40):
+            if os.path.exists(pending):
+                break
+            await asyncio.sleep(0.1)
+        slow_extraction = await timed("Tell me slowly about the aurora", 0.3)
+        failed_image = await timed("Tell me about broken geysers", None)
+        throttled_extraction = await timed("Tell me about throttled comets", None)
+        failed_explanations = [(await timed("Tell me about silent quasars", b))[0][0] for b in (budget, None)]
+        events = [event async for event in pipeline.stream_pipeline("Tell me about silent quasars")]
+        return (
+            results, elapsed, os.path.exists(pending), slow_extraction, failed_image, throttled_extraction,
+            failed_explanations, events,
+        )
+
+    try:
+        (
+            results, elapsed, landed, (fallback, fallback_elapsed), (failed, _), (throttled, _),
+            failed_explanations, events,
+        ) = asyncio.run(run())
+    finally:
+        pipeline.close()
+
+    comet, nebula, volcano = results
+    print(f"Wall time: {elapsed:.2f}s (budget {budget:.2f}s)")
+    for result in results:
+        print(f"  {result['entity']}: degraded={result.get('degraded', {})}")
+    print(f"Slow extraction: {fallback_elapsed:.2f}s (budget 0.30s) -> {[(r['entity'], r.get('degraded')) for r in fallback]}")
+    print(f"Failed image without a budget: {failed}")
+    print(f"Throttled extraction: {[(r['entity'], r.get('degraded')) for r in throttled]}")
+    tokens = "".join(event["text"] for event in events if event["event"] == "token")
+    streamed = events[-1]["results"][0]
+    print(f"Failed explanation: {[(r['explanation'], r.get('degraded')) for r in failed_explanations + [streamed]]}")
+
+    ok = (
+        elapsed < budget + 0.2
+        and comet.get("degraded") == {"image": "placeholder"} and landed
+        and os.path.basename(comet["image_path"]) == "placeholder.png"
+        and nebula.get("degraded") == {"explanation": "short"}
+        and volcano.get("degraded") == {"image": "similar"} and volcano["image_path"] == similar
+        and fallback_elapsed < 0.3 + 0.1 and len(fallback) == 1
+        and fallback[0]["entity"] == "Tell me slowly about the aurora"
+        and fallback[0].get("degraded") == {"entities": "topic"}
+        and len(failed) == 1 and "error" in failed[0] and "upstream unavailable" in failed[0]["error"]
+        and len(throttled) == 1 and throttled[0]["entity"] == "Tell me about throttled comets"
+        and throttled[0].get("degraded") == {"entities": "topic"}
+        and all(
+            r.get("degraded") == {"explanation": "short"} and not InterestExplorer.is_error(r["explanation"])
+            for r in failed_explanations + [streamed]
+        )
+        and tokens == streamed["explanation"]
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+    return ok
+
+def test_progressive_images():
+    """
+    Runs the pipeline in progressive mode against a stub generator whose full renders are
+    slow, and checks that the response arrives with the preview, that the full image lands
+    where the response said and is served directly afterwards, that the stream emits the
+    preview and then the full image, and that each preset has its own cache key.
+    """
+    import tempfile
+    from image_delivery import placeholder_png
+    render_seconds = {"preview": 0.1, "full": 0.6}
+
+    class StubExtractor:
+        def extract_concepts(self, text):
+            return [text.split()[-1].title()]
+
+    class StubEnricher:
+        def enrich_prompt(self, entity):
+            return f"a high-quality photograph of a {entity.lower()}"
+
+    class StubExplorer:
+        def generate_with_focus(self, interest, focus_aspect):
+            return f"{interest} is fascinating."
+
+        def stream_with_focus(self, interest, focus_aspect):
+            yield f"{interest} is fascinating."
+
+    class StubImageGenerator:
+        def __init__(self, cache):
+            self.cache = cache
+            self.renders = []
+
+        def image_key(self, prompt, seed, preset="full"):
+            return ImageCache.make_key(preset, prompt, seed, 0, 0, 0, 0)
+
+        def expected_path(self, prompt, seed, output_dir, preset="full"):
+            return self.cache.path_for(self.image_key(prompt, seed, preset))
+
+        def generate_images(self, entity, prompt, seed, num_images, output_dir, preset="full"):
+            key = self.image_key(prompt, seed, preset)
+            cached = self.cache.get(key)
+            if cached:
+                return [cached]
+            time.sleep(render_seconds[preset])
+            self.renders.append(preset)
+            return [self.cache.put(key, placeholder_png(), label=f"{entity} {prompt}")]
+
+    print("\n--- Running EducationalAnimationPipeline Progressive Images Test (with local stubs) ---")
+    pipeline = EducationalAnimationPipeline(
+        output_base_dir=tempfile.mkdtemp(prefix="progressive-"),
+        use_topic_index=False,
+        progressive=True,
+        interest_explorer=StubExplorer(),
+        entity_extractor=StubExtractor(),
+        prompt_enricher=StubEnricher(),
+    )
+    generator = pipeline.image_generator = StubImageGenerator(pipeline.image_cache)
+
+    async def run():
+        start = time.perf_counter()
+        first = (await pipeline.run_pipeline("comets"))[0]
+        elapsed = time.perf_counter() - start
+        for _ in range(40):
+            if os.path.exists(first.get("full_image_path", "")):
+                break
+            await asyncio.sleep(0.05)
+        again = (await pipeline.run_pipeline("comets"))[0]
+        events = [event async for event in pipeline.stream_pipeline("nebulas")]
+        return first, elapsed, again, events
+
+    try:
+        first, elapsed, again, events = asyncio.run(run())
+    finally:
+        pipeline.close()
+
+    images = [event for event in events if event["event"] == "image"]
+    streamed = events[-1]["results"][0]
+    print(f"Preview answered in {elapsed:.2f}s (full render {render_seconds['full']:.2f}s), renders: {generator.renders}")
+    print(f"  stream image events: {[event['quality'] for event in images]}")
+
+    # The default full preset keeps the cache keys images were stored under before presets existed.
+    stability = StabilityImageGenerator(presets={"preview": {"steps": 8}})
+    keys = {preset: stability.image_key("a comet", 1, preset) for preset in ("preview", "full")}
+    ok = (
+        elapsed < render_seconds["full"]
+        and first["image_path"] == generator.expected_path(first["prompt"], 42, pipeline.image_dir, "preview")
+        and os.path.exists(first["full_image_path"])
+        and again["image_path"] == first["full_image_path"] and "full_image_path" not in again
+        and generator.renders == ["preview", "full", "preview", "full"]
+        and [event["quality"] for event in images] == ["preview", "full"]
+        and streamed["image_path"] == images[1]["image_path"] and "full_image_path" not in streamed
+        and keys["full"] == ImageCache.make_key("stable-diffusion-xl-1024-v1-0", "a comet", 1, 1024, 1024, 30, 7)
+        and keys["preview"] != keys["full"] and stability.presets["preview"]["steps"] == 8
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+    return ok
+
+if __name__ == "__main__":
+    tests = (test_pipeline_concurrency, test_batch_scheduler, test_latency_budget, test_progressive_images)
+    sys.exit(0 if all([test() for test in tests]) else 1)
@@ -1,20 +1,39 @@
 import os
 import json
-from dotenv import load_dotenv
-from cerebras.cloud.sdk import Cerebras
-from typing import Optional, List, Dict
+from typing import TYPE_CHECKING, Optional, List, Dict, Iterator
 
-# Load environment variables for the standalone test block
-load_dotenv()
+from clients import lazy_cerebras_client
+from rate_governor import RateGovernor, RateLimited
+from completion_cache import CompletionCache, stream_completion
+from model_routing import ModelRouter
+from telemetry import span
+
+if TYPE_CHECKING:
+    from cerebras.cloud.sdk import Cerebras
 
 class InterestExplorer:
-    def __init__(self):
+    # Failed generations come back as text starting with this, in place of the explanation.
+    ERROR_PREFIX = "Error generating content: "
+
+    def __init__(
+        self,
+        client: Optional["Cerebras"] = None,
+        cache: Optional[CompletionCache] = None,
+        governor: Optional[RateGovernor] = None,
+        router: Optional[ModelRouter] = None,
+    ):
         """
         Initialize the InterestExplorer with the Cerebras client.
-        The client will automatically find the CEREBRAS_API_KEY in your .env file.
+        The default client is built on the first call and reads CEREBRAS_API_KEY from the environment.
+        Pass an existing client to share one connection pool between components,
+        and a CompletionCache to reuse completions across calls and restarts.
+        A shared RateGovernor keeps the calls under the Cerebras rate limits, and the
+        ModelRouter picks the model and max_tokens for each call.
         """
-        self.client = Cerebras()
-        self.model = "qwen-3-235b-a22b-instruct-2507" # The model you suggested
+        self.client = client or lazy_cerebras_client()
+        self.cache = cache
+        self.governor = governor
+        self.router = router or ModelRouter()
 
     def generate_exploration(self, interest: str, time_to_read: Optional[int] = 1) -> str:
         """
@@ -30,14 +49,16 @@ class InterestExplorer:
         - Highlight what makes {interest} fascinating
         """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False
+            # max_tokens is sized from the requested length rather than left open.
+            response_text = self.router.complete(
+                self.client, "exploration", prompt, cache=self.cache, governor=self.governor, words=word_count
             )
-            return response.choices[0].message.content.strip()
+            return response_text.strip()
+        except RateLimited:
+            # Throttling is reported as an error, not returned as if it were the explanation.
+            raise
         except Exception as e:
-            return f"Error generating content: {str(e)}"
+            return f"{self.ERROR_PREFIX}{str(e)}"
 
     def generate_with_focus(self, interest: str, focus_aspect: str) -> str:
         """
@@ -46,23 +67,56 @@ class InterestExplorer:
         if focus_aspect.lower() in ["no", "none", ""]:
             return "No problem! Feel free to ask for a focused exploration anytime."
 
+        prompt = self._focus_prompt(interest, focus_aspect)
+        with span("explanation", entity=interest) as attrs:
+            try:
+                response_text = self.router.complete(
+                    self.client, "explanation", prompt, cache=self.cache, governor=self.governor
+                )
+                return response_text.strip()
+            except RateLimited:
+                # Throttling is reported as an error, not returned as if it were the explanation.
+                raise
+            except Exception as e:
+                attrs["error"] = str(e)
+                return f"{self.ERROR_PREFIX}{str(e)}"
+
+    def stream_with_focus(self, interest: str, focus_aspect: str) -> Iterator[str]:
+        """
+        Same as generate_with_focus, but yields the text piece by piece as the model streams it.
+        """
+        if focus_aspect.lower() in ["no", "none", ""]:
+            yield "No problem! Feel free to ask for a focused exploration anytime."
+            return
+
+        prompt = self._focus_prompt(interest, focus_aspect)
+        with span("explanation", entity=interest, stream=True) as attrs:
+            try:
+                yield from stream_completion(
+                    self.client, self.router.model("explanation"), prompt, stage="explanation",
+                    cache=self.cache, governor=self.governor, **self.router.params("explanation")
+                )
+            except RateLimited:
+                raise
+            except Exception as e:
+                attrs["error"] = str(e)
+                yield f"{self.ERROR_PREFIX}{str(e)}"
+
+    @classmethod
+    def is_error(cls, text: str) -> bool:
+        """True when text is the error message of a failed generation rather than an explanation."""
+        return text.startswith(cls.ERROR_PREFIX)
+
+    @staticmethod
+    def _focus_prompt(interest: str, focus_aspect: str) -> str:
         # THIS IS THE KEY FIX: A stricter, more direct prompt to remove commentary.
-        prompt = f"""
+        return f"""
         Your task is to follow the user's instruction precisely and nothing more.
         Do not add any commentary, analysis, or self-reflection about your own response.
         Just provide the educational text that is requested.
 
         User's instruction: "{focus_aspect}" for the topic "{interest}".
         """
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            return f"Error generating content: {str(e)}"
 
     def potential_entities(self, text: str, interest: str) -> List[Dict[str, str]]:
         """
@@ -78,13 +132,11 @@ class InterestExplorer:
         - "relevance": Why this entity is important to understanding {interest}
         """
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False
+            response_text = self.router.complete(
+                self.client, "entities", prompt, cache=self.cache, governor=self.governor,
+                validate=lambda text: "{" in text and "}" in text,
             )
             
-            response_text = response.choices[0].message.content
             json_match = response_text[response_text.find('{'):response_text.rfind('}')+1]
             
             content = json.loads(json_match)
@@ -96,6 +148,9 @@ class InterestExplorer:
             return [{"error": f"Error extracting entities: {str(e)}"}]
 
 if __name__ == "__main__":
+    # Load environment variables for the standalone test block
+    from dotenv import load_dotenv
+    load_dotenv()
     # This block allows you to test this file directly
     print("--- Running InterestExplorer Standalone Test (with Cerebras) ---")
     
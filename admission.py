@@ -0,0 +1,256 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from telemetry import REGISTRY, Counter, Histogram
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    "admission_queue_wait_seconds", "Time admitted requests waited for a pipeline slot, by priority.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20),
+))
+ADMISSION_REQUESTS = REGISTRY.register(Counter(
+    "admission_requests_total", "Requests asking for a pipeline slot, by priority and outcome."))
+
+class Overloaded(Exception):
+    """
+    Raised when a request is turned away: the wait queue is full, it waited too long, or a
+    higher-priority request took its place. Answer it with 503 and a Retry-After header.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+class _Waiter:
+    __slots__ = ("rank", "seq", "priority", "future")
+
+    def __init__(self, rank: int, seq: int, priority: str, future: asyncio.Future):
+        self.rank = rank
+        self.seq = seq
+        self.priority = priority
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+class AdmissionController:
+    """
+    Admission control for the front door: at most max_concurrency pipeline runs at once,
+    and at most max_queue requests waiting for one, so a spike is answered with fast 503s
+    instead of slowing every request down until they all time out.
+
+    Waiting requests are admitted by priority class (interactive before batch before
+    prefetch), first come first served within a class. When the queue is full, a new
+    request takes the place of the lowest-priority waiter below its class, or is turned
+    away itself. A request that waits longer than max_wait is turned away too. Every
+    rejection carries a Retry-After estimated from the queue and the recent run times.
+
+    Must be used from the event loop the pipeline runs on.
+    """
+
+    PRIORITIES = ("interactive", "batch", "prefetch")
+
+    def __init__(self, max_concurrency: int = 32, max_queue: int = 64, max_wait: float = 10.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._active = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Moving average of how long a slot is held, for Retry-After.
+        self._hold_avg = 1.0
+
+        self.counts = {
+            priority: {"admitted": 0, "rejected": 0, "timed_out": 0, "shed": 0} for priority in self.PRIORITIES
+        }
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def queued(self, priority: Optional[str] = None) -> int:
+        if priority is None:
+            return len(self._waiters)
+        return sum(1 for waiter in self._waiters if waiter.priority == priority)
+
+    def retry_after(self) -> int:
+        """Whole seconds until a slot is likely to free up for a request joining the queue now."""
+        slots = max(1, self.max_concurrency)
+        return max(1, min(60, math.ceil(self._hold_avg * (len(self._waiters) + 1) / slots)))
+
+    async def acquire(self, priority: str = "interactive", wait: bool = True, timeout: Optional[float] = -1) -> float:
+        """
+        Waits for a slot and returns the time it was granted (pass it to release()). Raises
+        Overloaded when turned away; with wait=False, whenever no slot is free right now.
+        timeout defaults to max_wait; None waits as long as it takes.
+        """
+        rank = self.PRIORITIES.index(priority)
+        start = time.monotonic()
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            return self._admitted(priority, start)
+        if not wait:
+            raise self._reject(priority, "rejected", "no free slot")
+        if len(self._waiters) >= self.max_queue:
+            lowest = max(self._waiters) if self._waiters else None
+            if lowest is None or lowest.rank <= rank:
+                raise self._reject(priority, "rejected", "queue full")
+            self._waiters.remove(lowest)
+            heapq.heapify(self._waiters)
+            lowest.future.set_exception(self._reject(lowest.priority, "shed", f"displaced by {priority} request"))
+
+        waiter = _Waiter(rank, next(self._seq), priority, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait if timeout == -1 else timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            raise self._reject(priority, "timed_out", f"waited more than {self.max_wait}s")
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        return self._admitted(priority, start)
+
+    def release(self, granted: float):
+        """Frees the slot granted at `granted`, handing it to the next waiter if there is one."""
+        self._hold_avg = 0.8 * self._hold_avg + 0.2 * (time.monotonic() - granted)
+        while self._waiters:
+            waiter = heapq.heappop(self._waiters)
+            if not waiter.future.done():
+                # The slot passes straight to the waiter, so the active count is unchanged.
+                waiter.future.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive", wait: bool = True, timeout: Optional[float] = -1):
+        granted = await self.acquire(priority, wait, timeout)
+        try:
+            yield
+        finally:
+            self.release(granted)
+
+    async def run(self, priority: str, work: Callable[[], Awaitable[T]], timeout: Optional[float] = -1) -> T:
+        """Runs work() once admitted. The coroutine is only created then, so a rejection leaves nothing unawaited."""
+        async with self.slot(priority, timeout=timeout):
+            return await work()
+
+    def _admitted(self, priority: str, start: float) -> float:
+        now = time.monotonic()
+        ADMISSION_WAIT.observe(now - start, priority=priority)
+        ADMISSION_REQUESTS.inc(priority=priority, outcome="admitted")
+        self.counts[priority]["admitted"] += 1
+        return now
+
+    def _abandon(self, waiter: _Waiter):
+        """Cleans up after a waiter that stopped waiting; a slot granted meanwhile is passed on."""
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+        elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+            self.release(time.monotonic())
+
+    def _reject(self, priority: str, outcome: str, reason: str) -> Overloaded:
+        ADMISSION_REQUESTS.inc(priority=priority, outcome=outcome)
+        self.counts[priority][outcome] += 1
+        log.warning("🚦 Turned away a %s request: %s (%d running, %d waiting)", priority, reason, self._active, len(self._waiters))
+        return Overloaded(reason, self.retry_after())
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queued": {priority: self.queued(priority) for priority in self.PRIORITIES},
+            "max_queue": self.max_queue,
+            "retry_after": self.retry_after(),
+            "requests": {priority: dict(counts) for priority, counts in self.counts.items()},
+        }
+
+    def close(self):
+        REGISTRY.remove_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        yield "admission_running", "gauge", "Pipeline runs holding an admission slot.", [({}, self._active)]
+        yield "admission_queue_depth", "gauge", "Requests waiting for a pipeline slot, by priority.", [
+            ({"priority": priority}, self.queued(priority)) for priority in self.PRIORITIES
+        ]
+
+def test_admission_controller():
+    """
+    Floods a controller with slow requests and checks that no more than max_concurrency
+    run at once, that the excess is turned away fast with a Retry-After, that queued
+    interactive requests go before batch ones, and that prefetches are shed first.
+    """
+    print("\n--- Running AdmissionController Test ---")
+    work_seconds = 0.2
+    controller = AdmissionController(max_concurrency=4, max_queue=8, max_wait=2.0)
+    order: List[str] = []
+    peak = [0]
+    failures = []
+
+    async def request(priority: str, name: str):
+        start = time.perf_counter()
+        try:
+            async with controller.slot(priority):
+                peak[0] = max(peak[0], controller._active)
+                order.append(name)
+                await asyncio.sleep(work_seconds)
+            return "ok", time.perf_counter() - start, None
+        except Overloaded as e:
+            return "overloaded", time.perf_counter() - start, e
+
+    async def run():
+        # Four fill the slots and prefetches and batches queue behind them. Six interactive
+        # requests then arrive: two fill the queue and four displace the prefetches.
+        tasks = [asyncio.ensure_future(request("interactive", f"first{i}")) for i in range(4)]
+        await asyncio.sleep(0.01)
+        tasks += [asyncio.ensure_future(request("prefetch", f"prefetch{i}")) for i in range(4)]
+        tasks += [asyncio.ensure_future(request("batch", f"batch{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+        tasks += [asyncio.ensure_future(request("interactive", f"late{i}")) for i in range(6)]
+        first = await asyncio.gather(*tasks)
+        # A spike of interactive requests only: twelve are running or queued, the rest are turned away.
+        spike = await asyncio.gather(*[request("interactive", f"spike{i}") for i in range(20)])
+        return first, spike
+
+    try:
+        first, spike = asyncio.run(run())
+    finally:
+        controller.close()
+
+    rejected = [(elapsed, e) for outcome, elapsed, e in first + spike if outcome == "overloaded"]
+    served = [name for name in order if name.startswith(("late", "batch", "prefetch"))]
+    stats = controller.stats()
+    print(f"Served {len(order)}, turned away {len(rejected)}; admission order after the first four: {served}")
+    print(f"Requests: {stats['requests']}")
+
+    if peak[0] > controller.max_concurrency:
+        failures.append(f"{peak[0]} ran at once")
+    full = [(elapsed, e) for elapsed, e in rejected if e.reason == "queue full"]
+    if len(full) != 8 or any(elapsed > 0.05 or e.retry_after < 1 for elapsed, e in full):
+        failures.append(f"{len(full)} of the spike were turned away, not 8 at once with a Retry-After")
+    if stats["requests"]["prefetch"]["shed"] != 4 or any(name.startswith("prefetch") for name in order):
+        failures.append("prefetches were not shed for interactive requests")
+    if served != [f"late{i}" for i in range(6)] + ["batch0", "batch1"]:
+        failures.append("queued requests were not admitted interactive first, then batch")
+    if stats["running"] != 0 or sum(stats["queued"].values()) != 0:
+        failures.append(f"slots leaked: {stats}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("\n✅ Test successful!" if not failures else "\n❌ Test failed.")
+    return not failures
+
+if __name__ == "__main__":
+    test_admission_controller()
@@ -0,0 +1,344 @@
+import os
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from EducationalAnimationPipeline import EducationalAnimationPipeline
+from admission import AdmissionController, Overloaded
+from image_delivery import cache_headers, etag_matches, select_variant
+from response_cache import response_headers
+from job_queue import JobQueue, JobQueueFull
+from prefetcher import Prefetcher
+from telemetry import REGISTRY, configure_logging, trace
+
+# --- INITIAL SETUP ---
+load_dotenv()
+configure_logging()
+log = logging.getLogger(__name__)
+
+IMAGE_DIR = os.path.join("pipeline_outputs", "generated_images")
+
+# The executor bounds how many blocking upstream calls run at once; the pool size
+# bounds how many keep-alive connections each client keeps open.
+MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "256"))
+POOL_SIZE = int(os.getenv("PIPELINE_POOL_SIZE", "256"))
+# Per-stage caps on in-flight Cerebras and Stability calls (default: MAX_WORKERS each).
+LLM_CONCURRENCY = int(os.getenv("PIPELINE_LLM_CONCURRENCY", "0")) or None
+IMAGE_CONCURRENCY = int(os.getenv("PIPELINE_IMAGE_CONCURRENCY", "0")) or None
+# The largest deck /generate/batch accepts in one request.
+MAX_BATCH_TOPICS = int(os.getenv("PIPELINE_MAX_BATCH_TOPICS", "500"))
+# Background workers for POST /jobs, and how many jobs may wait for one.
+JOB_WORKERS = int(os.getenv("PIPELINE_JOB_WORKERS", "8"))
+JOB_QUEUE_DEPTH = int(os.getenv("PIPELINE_JOB_QUEUE_DEPTH", "1000"))
+# The longest GET /jobs/{id}?wait= long-poll, in seconds.
+MAX_JOB_WAIT = 60
+# Related entities prepared at once in the background after /generate (0 turns prefetching off).
+PREFETCH_CONCURRENCY = int(os.getenv("PIPELINE_PREFETCH_CONCURRENCY", "2"))
+# Default latency budget for /generate in seconds (unset: none); a request's "budget" overrides it.
+LATENCY_BUDGET = float(os.getenv("PIPELINE_LATENCY_BUDGET", "0")) or None
+# Pipeline runs admitted at once, requests that may wait for one, and for how long (seconds);
+# beyond that requests are answered 503 with Retry-After straight away.
+MAX_CONCURRENT_RUNS = int(os.getenv("PIPELINE_MAX_CONCURRENT_RUNS", "32"))
+ADMISSION_QUEUE = int(os.getenv("PIPELINE_ADMISSION_QUEUE", "64"))
+ADMISSION_WAIT = float(os.getenv("PIPELINE_ADMISSION_WAIT", "10"))
+# Fused mode plans each lesson in one structured completion instead of three round trips.
+FUSED = os.getenv("PIPELINE_FUSED", "").lower() in ("1", "true", "yes")
+
+async def init_backend(app: Starlette):
+    """
+    Builds the pipeline and starts the job queue. Clients are built lazily, so this is
+    fast and rarely fails; when it does, GET /ready tries again instead of the process
+    staying broken. The Cerebras client and topic index are then warmed in the background.
+    """
+    async with app.state.init_lock:
+        if app.state.pipeline is not None:
+            return
+        pipeline = None
+        try:
+            pipeline = EducationalAnimationPipeline(
+                max_workers=MAX_WORKERS, pool_size=POOL_SIZE, fused=FUSED,
+                llm_concurrency=LLM_CONCURRENCY, image_concurrency=IMAGE_CONCURRENCY,
+            )
+            job_queue = JobQueue(
+                pipeline,
+                os.path.join(pipeline.output_base_dir, "jobs.sqlite3"),
+                workers=JOB_WORKERS,
+                max_depth=JOB_QUEUE_DEPTH,
+                admission=app.state.admission,
+            )
+            await job_queue.start()
+        except Exception as e:
+            if pipeline is not None:
+                pipeline.close()
+            app.state.init_error = f"{type(e).__name__}: {e}"
+            log.critical("❌ CRITICAL ERROR during initialization: %s", e)
+            return
+        app.state.prefetcher = Prefetcher(
+            pipeline, job_queue=job_queue, concurrency=PREFETCH_CONCURRENCY, admission=app.state.admission
+        )
+        app.state.pipeline, app.state.job_queue, app.state.init_error = pipeline, job_queue, None
+        log.info("✅ Backend initialized successfully.")
+        app.state.warm_up = asyncio.get_running_loop().run_in_executor(None, pipeline.warm_up)
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """Builds one pipeline (and its pooled clients) for the lifetime of the process."""
+    log.info("🚀 Initializing ASGI backend...")
+    app.state.pipeline = None
+    app.state.job_queue = None
+    app.state.prefetcher = None
+    app.state.init_error = None
+    app.state.init_lock = asyncio.Lock()
+    # Interactive requests are admitted before batches and jobs, and those before prefetches.
+    app.state.admission = AdmissionController(MAX_CONCURRENT_RUNS, ADMISSION_QUEUE, ADMISSION_WAIT)
+    await init_backend(app)
+    yield
+    if app.state.prefetcher is not None:
+        app.state.prefetcher.cancel()
+        app.state.prefetcher.close()
+    if app.state.job_queue is not None:
+        await app.state.job_queue.stop()
+    if app.state.pipeline is not None:
+        app.state.pipeline.close()
+    app.state.admission.close()
+
+# --- API ENDPOINTS ---
+async def serve_image(request: Request):
+    """
+    Serves generated images to the frontend, as WebP (or a ?w= thumbnail) when the client
+    accepts it, with immutable caching headers and If-None-Match revalidation.
+    """
+    filename = request.path_params["filename"]
+    # Cached images are sharded into subdirectories; the frontend only knows the file name.
+    pipeline = request.app.state.pipeline
+    variant = None
+    if pipeline is not None:
+        width = request.query_params.get("w")
+        variant = select_variant(
+            pipeline.image_cache, filename, request.headers.get("accept", ""),
+            int(width) if width and width.isdigit() else None,
+        )
+    if variant:
+        path, content_type, etag = variant
+        headers = cache_headers(etag)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, media_type=content_type, headers=headers)
+    # Images written before the content-addressed cache still live in the flat directory.
+    if not filename.endswith(".png"):
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    root = os.path.realpath(IMAGE_DIR)
+    path = os.path.realpath(os.path.join(root, filename))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return JSONResponse({"error": "Not found"}, status_code=404)
+    return FileResponse(path)
+
+def overloaded_response(error: Overloaded) -> Response:
+    """503 with Retry-After for a request turned away by admission control."""
+    return JSONResponse({"error": f"Server is busy: {error}"}, status_code=503, headers=error.headers())
+
+def admitted_stream(request: Request, granted: float, lines) -> StreamingResponse:
+    """An NDJSON response that holds its admission slot until the stream ends or is abandoned."""
+    async def body():
+        try:
+            async for line in lines:
+                yield line
+        finally:
+            request.app.state.admission.release(granted)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+def cached_json_response(request: Request, body: bytes, etag: str) -> Response:
+    """A JSON body with its ETag, or 304 when the client already has it (If-None-Match)."""
+    headers = response_headers(etag)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+async def generate_animation_endpoint(request: Request):
+    """Main endpoint that the frontend calls to start the pipeline."""
+    pipeline = request.app.state.pipeline
+    if pipeline is None:
+        return JSONResponse({"error": "Pipeline not initialized due to a server startup error."}, status_code=500)
+
+    data = await request.json()
+    topic = data.get("topic")
+    if not topic:
+        return JSONResponse({"error": "No topic provided"}, status_code=400)
+    budget = data.get("budget", LATENCY_BUDGET)
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0):
+        return JSONResponse({"error": "budget must be a positive number of seconds"}, status_code=400)
+
+    # Repeated topics are answered from the response cache without running the pipeline.
+    cached = pipeline.response_cache.get(topic)
+    if cached:
+        return cached_json_response(request, *cached)
+
+    try:
+        # ?trace=1 logs this request's spans; TRACE_REQUESTS=1 logs them for every request.
+        with trace("generate", enabled=True if request.query_params.get("trace") else None, topic=topic):
+            results = await request.app.state.admission.run(
+                "interactive", lambda: pipeline.run_pipeline(topic, budget=budget)
+            )
+        # Follow-up entities are prepared in the background while the response goes out.
+        request.app.state.prefetcher.served(topic, results)
+        return cached_json_response(request, *pipeline.response_cache.put(topic, results))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        log.error("❌ Error in pipeline: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def generate_stream_endpoint(request: Request):
+    """
+    Streaming variant of /generate. Responds with newline-delimited JSON events:
+    the entities, explanation tokens, each image as it lands and a final "result" event.
+    """
+    pipeline = request.app.state.pipeline
+    if pipeline is None:
+        return JSONResponse({"error": "Pipeline not initialized due to a server startup error."}, status_code=500)
+
+    data = await request.json()
+    topic = data.get("topic")
+    if not topic:
+        return JSONResponse({"error": "No topic provided"}, status_code=400)
+
+    try:
+        granted = await request.app.state.admission.acquire("interactive")
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    async def ndjson():
+        async for event in pipeline.stream_pipeline(topic):
+            yield json.dumps(event) + "\n"
+
+    return admitted_stream(request, granted, ndjson())
+
+async def generate_batch_endpoint(request: Request):
+    """
+    Runs a whole deck of topics in one request. Body: {"topics": [...], "stream": false}.
+    Returns {topic: results} once everything is done, or with "stream": true, one
+    newline-delimited JSON {"event": "topic", "topic", "results"} line per topic as it completes.
+    """
+    pipeline = request.app.state.pipeline
+    if pipeline is None:
+        return JSONResponse({"error": "Pipeline not initialized due to a server startup error."}, status_code=500)
+
+    data = await request.json()
+    topics = data.get("topics")
+    if not isinstance(topics, list) or not topics or not all(isinstance(t, str) and t.strip() for t in topics):
+        return JSONResponse({"error": "No topics provided"}, status_code=400)
+    if len(topics) > MAX_BATCH_TOPICS:
+        return JSONResponse({"error": f"At most {MAX_BATCH_TOPICS} topics per batch"}, status_code=400)
+
+    admission = request.app.state.admission
+    try:
+        if not data.get("stream"):
+            return JSONResponse(await admission.run("batch", lambda: pipeline.run_batch(topics)))
+        granted = await admission.acquire("batch")
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    async def ndjson():
+        async for item in pipeline.stream_batch(topics):
+            yield json.dumps({"event": "topic", **item}) + "\n"
+
+    return admitted_stream(request, granted, ndjson())
+
+async def submit_job_endpoint(request: Request):
+    """
+    Enqueues a topic as a background job and returns its id straight away (202).
+    Responds 503 with Retry-After when the job queue is full.
+    """
+    job_queue = request.app.state.job_queue
+    if job_queue is None:
+        return JSONResponse({"error": "Pipeline not initialized due to a server startup error."}, status_code=500)
+
+    data = await request.json()
+    topic = data.get("topic")
+    if not topic:
+        return JSONResponse({"error": "No topic provided"}, status_code=400)
+
+    try:
+        job = await job_queue.submit(topic)
+    except JobQueueFull as e:
+        return JSONResponse({"error": f"Job queue is full: {e}"}, status_code=503, headers={"Retry-After": "5"})
+    return JSONResponse(job, status_code=202, headers={"Location": f"/jobs/{job['id']}"})
+
+async def job_status_endpoint(request: Request):
+    """
+    Returns a job's status with its partial per-entity results, or its final results once done.
+    With ?wait=<seconds> (at most MAX_JOB_WAIT), waits for the job to finish before answering.
+    """
+    job_queue = request.app.state.job_queue
+    if job_queue is None:
+        return JSONResponse({"error": "Pipeline not initialized due to a server startup error."}, status_code=500)
+
+    job_id = request.path_params["job_id"]
+    try:
+        wait = min(float(request.query_params.get("wait", 0)), MAX_JOB_WAIT)
+    except ValueError:
+        wait = 0
+    job = await job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    return JSONResponse(job)
+
+async def stats_endpoint(request: Request):
+    """Cache, transport, rate governor and admission counters (queue depth, wait time, current window)."""
+    pipeline = request.app.state.pipeline
+    if pipeline is None:
+        return JSONResponse({"error": "Pipeline not initialized due to a server startup error."}, status_code=500)
+    stats = pipeline.stats()
+    if request.app.state.job_queue is not None:
+        stats["job_queue"] = {"queued": request.app.state.job_queue.depth()}
+    if request.app.state.prefetcher is not None:
+        stats["prefetch"] = request.app.state.prefetcher.stats()
+    stats["admission"] = request.app.state.admission.stats()
+    return JSONResponse(stats)
+
+async def ready_endpoint(request: Request):
+    """Readiness probe: 200 once every component is usable, 503 (with per-component status) until then."""
+    if request.app.state.pipeline is None:
+        await init_backend(request.app)
+    pipeline = request.app.state.pipeline
+    if pipeline is None:
+        return JSONResponse(
+            {"ready": False, "components": {"pipeline": f"error: {request.app.state.init_error}"}}, status_code=503
+        )
+    readiness = pipeline.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+async def metrics_endpoint(request: Request):
+    """Stage latencies, cache hit ratios, upstream outcomes and in-flight gauges in Prometheus text format."""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+app = Starlette(
+    routes=[
+        Route("/pipeline_outputs/generated_images/{filename:path}", serve_image),
+        Route("/generate", generate_animation_endpoint, methods=["POST"]),
+        Route("/generate/stream", generate_stream_endpoint, methods=["POST"]),
+        Route("/generate/batch", generate_batch_endpoint, methods=["POST"]),
+        Route("/jobs", submit_job_endpoint, methods=["POST"]),
+        Route("/jobs/{job_id}", job_status_endpoint, methods=["GET"]),
+        Route("/stats", stats_endpoint, methods=["GET"]),
+        Route("/ready", ready_endpoint, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+# --- RUN THE SERVER ---
+if __name__ == "__main__":
+    import uvicorn
+    log.info("🚀 Starting ASGI server on http://localhost:5000")
+    uvicorn.run(app, host="0.0.0.0", port=5000)
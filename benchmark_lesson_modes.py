@@ -0,0 +1,125 @@
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from dotenv import load_dotenv
+
+from clients import build_cerebras_client
+from entity_extraction import EntityExtractor
+from entity_enrichment_prompt import PromptEnricher
+from InterestExplorer import InterestExplorer
+from lesson_planner import LessonPlanner
+
+DEFAULT_TOPICS = [
+    "Which is the longest river in India?",
+    "Tell me about the Eiffel Tower in Paris.",
+    "How do volcanoes erupt?",
+    "What does a honeybee do all day?",
+]
+
+class UsageRecorder:
+    """Wraps a Cerebras client and records the latency and token usage of every completion."""
+
+    def __init__(self, client):
+        self._client = client
+        self.calls: List[Dict] = []
+        # Mimic the client.chat.completions.create attribute path used by the components.
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        start = time.perf_counter()
+        response = self._client.chat.completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        self.calls.append({
+            "latency_s": time.perf_counter() - start,
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        })
+        return response
+
+    def take(self) -> List[Dict]:
+        calls, self.calls = self.calls, []
+        return calls
+
+def run_staged(topic: str, extractor, enricher, explorer, executor) -> None:
+    """The staged path: extraction, then enrichment and explanation in parallel per entity."""
+    entities = extractor.extract_concepts(topic)
+    futures = []
+    for entity in entities:
+        futures.append(executor.submit(enricher.enrich_prompt, entity))
+        futures.append(executor.submit(
+            explorer.generate_with_focus,
+            entity,
+            f"a simple, one-paragraph explanation of what a {entity} is, for a child",
+        ))
+    for future in futures:
+        future.result()
+
+def summarize(samples: List[Dict]) -> Dict:
+    latencies = [s["latency_s"] for s in samples]
+    return {
+        "runs": len(samples),
+        "latency_p50_s": statistics.median(latencies),
+        "latency_mean_s": statistics.mean(latencies),
+        "calls_per_topic": statistics.mean(s["calls"] for s in samples),
+        "prompt_tokens_per_topic": statistics.mean(s["prompt_tokens"] for s in samples),
+        "completion_tokens_per_topic": statistics.mean(s["completion_tokens"] for s in samples),
+        "fallbacks": sum(s.get("fallback", 0) for s in samples),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fused vs staged lesson generation (LLM stages only).")
+    parser.add_argument("--topics", nargs="*", default=DEFAULT_TOPICS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_lesson_modes.json")
+    args = parser.parse_args()
+
+    load_dotenv()
+    recorder = UsageRecorder(build_cerebras_client())
+    # No completion cache: every run must pay the real round trips.
+    extractor = EntityExtractor(client=recorder)
+    enricher = PromptEnricher(client=recorder)
+    enricher.default_templates = {}
+    explorer = InterestExplorer(client=recorder)
+    planner = LessonPlanner(client=recorder)
+
+    samples = {"staged": [], "fused": []}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(args.repeat):
+            for topic in args.topics:
+                for mode in ("staged", "fused"):
+                    start = time.perf_counter()
+                    fallback = 0
+                    if mode == "staged":
+                        run_staged(topic, extractor, enricher, explorer, executor)
+                    elif planner.plan_lesson(topic) is None:
+                        fallback = 1
+                        run_staged(topic, extractor, enricher, explorer, executor)
+                    elapsed = time.perf_counter() - start
+                    calls = recorder.take()
+                    samples[mode].append({
+                        "topic": topic,
+                        "latency_s": elapsed,
+                        "calls": len(calls),
+                        "prompt_tokens": sum(c["prompt_tokens"] for c in calls),
+                        "completion_tokens": sum(c["completion_tokens"] for c in calls),
+                        "fallback": fallback,
+                    })
+
+    report = {mode: summarize(runs) for mode, runs in samples.items()}
+    report["samples"] = samples
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'mode':<8}{'p50 (s)':>10}{'calls':>8}{'prompt tok':>12}{'compl tok':>12}{'fallbacks':>11}")
+    for mode in ("staged", "fused"):
+        r = report[mode]
+        print(f"{mode:<8}{r['latency_p50_s']:>10.3f}{r['calls_per_topic']:>8.1f}"
+              f"{r['prompt_tokens_per_topic']:>12.0f}{r['completion_tokens_per_topic']:>12.0f}{r['fallbacks']:>11}")
+    print(f"\n✅ Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from event_loop_thread import EventLoopThread
+from stub_servers import StubServer, profile_args, profiles_from_args
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+VOCABULARY = (
+    "volcano glacier comet honeybee octopus cactus lighthouse tornado coral reef pyramid canyon "
+    "satellite dinosaur rainforest waterfall penguin geyser meteor bamboo compass windmill submarine "
+    "tortoise aurora iceberg beehive lava nebula orchid walrus telescope river castle desert pendulum"
+).split()
+
+def make_topics(count: int, distinct: Optional[int], run_id: str) -> List[str]:
+    """
+    Benchmark topics. Every topic is new to the caches and too dissimilar for the topic
+    index to match, unless distinct caps how many different ones there are, which
+    measures the warm path instead.
+    """
+    rng = random.Random(run_id)
+    pool = [
+        f"{' '.join(rng.sample(VOCABULARY, 3))} {rng.getrandbits(40):010x}" for _ in range(distinct or count)
+    ]
+    return [pool[i % len(pool)] for i in range(count)]
+
+def summarize(target: str, concurrency: int, samples: List[Dict], elapsed: float) -> Dict:
+    latencies = sorted(s["latency_s"] for s in samples if s["ok"])
+    return {
+        "target": target,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "ok": len(latencies),
+        "errors": len(samples) - len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_mean_s": round(sum(latencies) / len(latencies), 4) if latencies else None,
+        "latency_p50_s": round(percentile(latencies, 0.50), 4),
+        "latency_p95_s": round(percentile(latencies, 0.95), 4),
+        "latency_p99_s": round(percentile(latencies, 0.99), 4),
+    }
+
+def succeeded(results) -> bool:
+    return isinstance(results, list) and bool(results) and not any("error" in r for r in results)
+
+# --- PEAK MEMORY ---
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """
+    The high-water mark of a process's resident memory: VmHWM from /proc for another
+    process, getrusage for this one. It only ever grows, so each level reports the peak so far.
+    """
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            return None
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+# --- TARGETS ---
+async def drive_pipeline(pipeline, topics: List[str], concurrency: int) -> List[Dict]:
+    """Runs every topic through run_pipeline with at most concurrency topics in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(topic: str) -> Dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = succeeded(await pipeline.run_pipeline(topic))
+            except Exception:
+                ok = False
+            return {"latency_s": time.perf_counter() - start, "ok": ok}
+
+    return await asyncio.gather(*[one(topic) for topic in topics])
+
+def drive_http(url: str, topics: List[str], concurrency: int) -> List[Dict]:
+    """POSTs every topic to /generate from concurrency client threads."""
+    local = threading.local()
+
+    def one(topic: str) -> Dict:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = local.session.post(f"{url}/generate", json={"topic": topic}, timeout=600)
+            ok = response.status_code == 200 and succeeded(response.json())
+        except (requests.RequestException, ValueError):
+            ok = False
+        return {"latency_s": time.perf_counter() - start, "ok": ok}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, topics))
+
+def prefetch_counts(url: str) -> Dict[str, int]:
+    """The server's cumulative prefetch counters from /stats (empty when it has no prefetcher)."""
+    stats = requests.get(f"{url}/stats", timeout=10).json().get("prefetch") or {}
+    return {k: v for k, v in stats.items() if k in ("scheduled", "done", "failed", "cancelled", "skipped", "hits", "lookups")}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(kind: str, env: Dict[str, str], workdir: str, prefetch: bool = False) -> Tuple[subprocess.Popen, str]:
+    """
+    Starts main.py (Flask) or asgi.py (uvicorn) in a fresh working directory, so it
+    begins with empty caches, and waits until it answers /stats. Prefetching is off unless
+    asked for, so the latencies and upstream calls of each level are those of its own
+    requests only; with prefetch the server runs with its production prefetch settings.
+    """
+    port = free_port()
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "main", "run", "--port", str(port), "--with-threads"]
+    server_env = dict(os.environ, **env)
+    server_env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, server_env.get("PYTHONPATH")]))
+    server_env.setdefault("LOG_LEVEL", "WARNING")
+    if not prefetch:
+        server_env["PIPELINE_PREFETCH_CONCURRENCY"] = "0"
+    # Access logs would drown the benchmark's own output; they are kept next to the server's caches.
+    log_path = os.path.join(workdir, "server.log")
+    process = subprocess.Popen(command, cwd=workdir, env=server_env, stdout=open(log_path, "w"), stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {kind} server exited with code {process.returncode} (see {log_path})")
+        try:
+            if requests.get(f"{url}/stats", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"The {kind} server did not come up within 120s (see {log_path})")
+
+# --- REGRESSIONS ---
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Levels whose throughput dropped or whose p95 latency grew by more than tolerance."""
+    previous = {(r["target"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        base = previous.get((r["target"], r["concurrency"]))
+        if base is None:
+            continue
+        if base["throughput_rps"] and r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{r['target']} @ {r['concurrency']}: throughput {r['throughput_rps']:.2f} rps "
+                f"vs {base['throughput_rps']:.2f} rps"
+            )
+        if base["latency_p95_s"] and r["latency_p95_s"] > base["latency_p95_s"] * (1 + tolerance):
+            regressions.append(
+                f"{r['target']} @ {r['concurrency']}: p95 {r['latency_p95_s']:.3f}s vs {base['latency_p95_s']:.3f}s"
+            )
+    return regressions
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test /generate and the pipeline API against local stand-ins for Cerebras and Stability."
+    )
+    parser.add_argument("--targets", default="pipeline,flask,flask+prefetch",
+                        help="Comma-separated: pipeline (in-process run_pipeline), flask (main.py), asgi (asgi.py). "
+                             "A server target with +prefetch (e.g. asgi+prefetch) keeps prefetching on.")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated concurrency levels, run in order.")
+    parser.add_argument("--requests", type=int, default=None, help="Requests per level (default: max(10, 4 x concurrency)).")
+    parser.add_argument("--distinct-topics", type=int, default=None,
+                        help="Cycle through this many topics to measure cache hits (default: every topic is new).")
+    parser.add_argument("--url", default=None, help="Drive an already running server instead of starting one.")
+    parser.add_argument("--live", action="store_true", help="Call the real APIs instead of starting the stubs.")
+    parser.add_argument("--output", default="bench_load.json", help="Where to write the machine-readable results.")
+    parser.add_argument("--baseline", default=None, help="An earlier results file to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed throughput drop / p95 growth against the baseline (default: 0.2).")
+    parser.add_argument("--governor-limits", default=None,
+                        help="RATE_GOVERNOR_LIMITS JSON for the code under test (default: the production limits).")
+    profile_args(parser)
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.governor_limits:
+        os.environ["RATE_GOVERNOR_LIMITS"] = args.governor_limits
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    run_id = uuid.uuid4().hex[:8]
+
+    stub = None
+    env: Dict[str, str] = {}
+    if not args.live and not args.url:
+        # The stubs run on threads of this process (so the pipeline target's peak memory includes
+        # their few MB); the servers under test get processes of their own.
+        stub = StubServer(profiles=profiles_from_args(args), record=args.record, replay=args.replay, seed=args.seed).start()
+        env = stub.env()
+        print(f"🧪 Stub APIs ({stub.mode}) on {stub.url}")
+    os.environ.update(env)
+
+    results: List[Dict] = []
+    problems: List[str] = []
+    # The pipeline target keeps one event loop across levels, as the servers do.
+    loop_thread = EventLoopThread()
+    try:
+        for target in targets:
+            kind, _, variant = target.partition("+")
+            prefetch = variant == "prefetch"
+            workdir = tempfile.mkdtemp(prefix=f"bench-{kind}-{variant or 'default'}-")
+            process, url, pipeline = None, args.url, None
+            if kind == "pipeline":
+                from EducationalAnimationPipeline import EducationalAnimationPipeline
+                pipeline = EducationalAnimationPipeline(
+                    output_base_dir=os.path.join(workdir, "pipeline_outputs"), max_workers=max(levels) * 4
+                )
+            elif url is None:
+                process, url = start_server(kind, env, workdir, prefetch=prefetch)
+            try:
+                for concurrency in levels:
+                    count = args.requests or max(10, 4 * concurrency)
+                    # With --seed every run (and target) sends the same topics, so recordings can be replayed.
+                    topic_seed = f"{args.seed}-{concurrency}" if args.seed is not None else f"{run_id}-{target}-{concurrency}"
+                    topics = make_topics(count, args.distinct_topics, topic_seed)
+                    before = stub.stats() if stub else None
+                    prefetched = prefetch_counts(url) if prefetch else None
+                    start = time.perf_counter()
+                    if pipeline is not None:
+                        samples = loop_thread.run(drive_pipeline(pipeline, topics, concurrency))
+                    else:
+                        samples = drive_http(url, topics, concurrency)
+                    result = summarize(target, concurrency, samples, time.perf_counter() - start)
+                    if process is not None:
+                        result["peak_rss_mb"] = peak_rss_mb(process.pid)
+                    else:
+                        # A server started elsewhere can't be measured from here.
+                        result["peak_rss_mb"] = peak_rss_mb() if pipeline is not None else None
+                    if stub:
+                        after = stub.stats()
+                        result["upstream"] = {
+                            service: {k: after[service][k] - before[service][k] for k in after[service] if k != "peak_active"}
+                            for service in after
+                        }
+                    if prefetch:
+                        after = prefetch_counts(url)
+                        result["prefetch"] = {k: after[k] - prefetched.get(k, 0) for k in after}
+                        # Served topics that neither started nor skipped a prefetch mean prefetching is broken.
+                        if result["ok"] and not (result["prefetch"].get("scheduled") or result["prefetch"].get("skipped")):
+                            problems.append(f"{target} @ {concurrency}: nothing was prefetched ({result['prefetch']})")
+                    results.append(result)
+                    print(
+                        f"{target:<9}c={concurrency:<4}{result['ok']:>4}/{result['requests']:<4} ok "
+                        f"{result['throughput_rps']:>8.2f} rps  p50 {result['latency_p50_s']:.3f}s  "
+                        f"p95 {result['latency_p95_s']:.3f}s  p99 {result['latency_p99_s']:.3f}s  "
+                        f"peak {result['peak_rss_mb'] or 0:.0f} MB",
+                        flush=True,
+                    )
+            finally:
+                if pipeline is not None:
+                    pipeline.close()
+                if process is not None:
+                    process.terminate()
+                    process.wait(timeout=30)
+    finally:
+        if stub:
+            stub.stop()
+
+    report = {
+        "meta": {
+            "run_id": run_id,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "upstream": "live" if args.live else "url" if args.url else stub.mode,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
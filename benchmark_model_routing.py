@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import argparse
+import statistics
+from typing import Callable, Dict, List
+from dotenv import load_dotenv
+
+from clients import build_cerebras_client
+from entity_extraction import EntityExtractor
+from entity_enrichment_prompt import PromptEnricher
+from InterestExplorer import InterestExplorer
+from model_routing import ModelRouter, SMALL_MODEL
+from benchmark_load import percentile
+from stub_servers import StubServer, profile_args, profiles_from_args
+
+DEFAULT_TOPICS = [
+    "Which is the longest river in India?",
+    "Tell me about the Eiffel Tower in Paris.",
+    "How do volcanoes erupt?",
+    "What does a honeybee do all day?",
+]
+
+STAGES = ("extraction", "enrichment", "explanation", "entities", "exploration")
+
+def timed(samples: Dict[str, List[float]], stage: str, func: Callable, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    samples[stage].append(time.perf_counter() - start)
+    return result
+
+def run_topic(topic: str, extractor, enricher, explorer, samples: Dict[str, List[float]]):
+    """
+    Runs every LLM stage for one topic, one call at a time, so each stage's latency is its
+    own round trip and not time spent waiting behind the others.
+    """
+    entities = timed(samples, "extraction", extractor.extract_concepts, topic)
+    entity = entities[0] if entities else topic
+    timed(samples, "enrichment", enricher.enrich_prompt, entity)
+    explanation = timed(
+        samples, "explanation", explorer.generate_with_focus,
+        entity, f"a simple, one-paragraph explanation of what a {entity} is, for a child",
+    )
+    timed(samples, "entities", explorer.potential_entities, explanation, entity)
+    timed(samples, "exploration", explorer.generate_exploration, entity)
+
+def summarize(latencies: List[float]) -> Dict:
+    ordered = sorted(latencies)
+    return {
+        "calls": len(ordered),
+        "latency_p50_s": percentile(ordered, 0.5),
+        "latency_p95_s": percentile(ordered, 0.95),
+        "latency_mean_s": statistics.mean(ordered) if ordered else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare per-stage LLM latency under each model routing profile (see model_routing.py)."
+    )
+    parser.add_argument("--profiles", default=",".join(ModelRouter.PROFILES),
+                        help="Comma-separated routing profiles to compare, run in order.")
+    parser.add_argument("--topics", nargs="*", default=DEFAULT_TOPICS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--live", action="store_true", help="Call the real Cerebras API instead of starting the stubs.")
+    parser.add_argument("--output", default="bench_model_routing.json")
+    profile_args(parser)
+    args = parser.parse_args()
+
+    load_dotenv()
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    stub = None
+    if not args.live:
+        # Without per-model latencies the stubs answer every model alike, hiding what routing changes.
+        if not args.model_latency:
+            args.model_latency = [f"{SMALL_MODEL}=lognormal:0.08,0.3"]
+        stub = StubServer(profiles=profiles_from_args(args), record=args.record, replay=args.replay, seed=args.seed).start()
+        os.environ.update(stub.env())
+        print(f"🧪 Stub APIs ({stub.mode}) on {stub.url}")
+
+    report: Dict[str, Dict] = {}
+    try:
+        client = build_cerebras_client()
+        for profile in profiles:
+            router = ModelRouter(routes={}, profile=profile)
+            # No completion cache: every run must pay the real round trips.
+            extractor = EntityExtractor(client=client, router=router)
+            enricher = PromptEnricher(client=client, router=router)
+            enricher.default_templates = {}
+            explorer = InterestExplorer(client=client, router=router)
+
+            samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                for topic in args.topics:
+                    run_topic(topic, extractor, enricher, explorer, samples)
+            routes = router.stats()
+            report[profile] = {
+                "wall_s": time.perf_counter() - start,
+                "stages": {
+                    stage: dict(
+                        summarize(samples[stage]),
+                        model=routes[stage]["model"],
+                        max_tokens=routes[stage]["max_tokens"],
+                        fallbacks=routes[stage]["fallbacks"],
+                    )
+                    for stage in STAGES
+                },
+            }
+    finally:
+        if stub:
+            stub.stop()
+
+    report["meta"] = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "upstream": "live" if args.live else stub.mode,
+        "args": vars(args),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'stage':<13}" + "".join(f"{profile + ' p50 (s)':>20}" for profile in profiles) + f"{'fallbacks':>11}")
+    for stage in STAGES:
+        row = "".join(f"{report[profile]['stages'][stage]['latency_p50_s']:>20.3f}" for profile in profiles)
+        fallbacks = "/".join(str(report[profile]["stages"][stage]["fallbacks"]) for profile in profiles)
+        print(f"{stage:<13}{row}{fallbacks:>11}")
+    print(f"{'total (wall)':<13}" + "".join(f"{report[profile]['wall_s']:>20.3f}" for profile in profiles))
+    print(f"\n✅ Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,654 @@
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import logging
+import argparse
+import itertools
+import tempfile
+import threading
+import contextlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+log = logging.getLogger(__name__)
+
+class CacheBackend:
+    """
+    Storage and locking shared by every worker process (and, over the network, every host)
+    that serves the pipeline. The image and completion caches stay local; on a local miss
+    they look here before calling an upstream API, publish what they generate, and take
+    lock(key) around generation so only one worker fleet-wide pays for a given key.
+
+    Values are bytes under string keys ("image/<key>", "completion/<key>"), optionally
+    with a TTL in seconds. lock() yields True once the lock is held, or False when it
+    couldn't be acquired within the timeout; callers then go ahead without it, since a
+    duplicate upstream call is better than a failed request.
+
+    shares_files is True when every reader is on a file system the writer's files are on,
+    so a cache can publish where a file is rather than its bytes.
+    """
+
+    name = "backend"
+    shares_files = False
+
+    def __init__(self, lock_timeout: float = 120.0):
+        self.lock_timeout = lock_timeout
+        self.counts = {
+            "gets": 0, "hits": 0, "puts": 0, "evictions": 0, "locks": 0, "lock_waits": 0, "lock_timeouts": 0, "errors": 0,
+        }
+        self._counts_lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counts_lock:
+            self.counts[name] += amount
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def put(self, key: str, value: bytes, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def lock(self, key: str, timeout: Optional[float] = None):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        with self._counts_lock:
+            return dict(self.counts, backend=self.name)
+
+    def close(self):
+        pass
+
+# --- LOCAL BACKEND ---
+class LocalCacheBackend(CacheBackend):
+    """
+    A CacheBackend in a directory, for several worker processes on one host (or hosts
+    sharing a file system that supports locking). Values are written to a temp file and
+    renamed into place, so readers never see a partial value; locks are advisory file
+    locks (flock, or msvcrt on Windows), released by the OS if a worker dies.
+
+    The directory is swept every sweep_interval seconds, or sooner once a tenth of
+    max_bytes has been written since the last sweep: expired values are removed, then the
+    least recently read or written ones until the rest fit in max_bytes.
+    """
+
+    name = "local"
+    shares_files = True
+
+    def __init__(
+        self,
+        root_dir: str,
+        lock_timeout: float = 120.0,
+        poll_interval: float = 0.05,
+        max_bytes: int = 256 * 1024 ** 2,
+        sweep_interval: float = 60.0,
+    ):
+        super().__init__(lock_timeout)
+        self.root_dir = root_dir
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._written = 0
+        self._swept = time.monotonic()
+        os.makedirs(os.path.join(root_dir, "locks"), exist_ok=True)
+
+    def _path(self, key: str, kind: str = "data") -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        if kind == "locks":
+            return os.path.join(self.root_dir, "locks", f"{digest}.lock")
+        return os.path.join(self.root_dir, "data", digest[:2], digest)
+
+    def get(self, key: str) -> Optional[bytes]:
+        self._count("gets")
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires = float(f.readline() or 0)
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        if expires and expires <= time.time():
+            return None
+        with contextlib.suppress(OSError):
+            # The modification time doubles as the last access, for the sweep.
+            os.utime(path)
+        self._count("hits")
+        return value
+
+    def put(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self._count("puts")
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The first line holds the expiry (0: never), so a value and its TTL change together.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(f"{time.time() + ttl if ttl else 0}\n".encode("ascii"))
+                f.write(value)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._written += len(value)
+        if self._written * 10 > self.max_bytes or time.monotonic() - self._swept > self.sweep_interval:
+            self.sweep()
+
+    def sweep(self):
+        """Removes expired values, then the least recently used past max_bytes. Skipped while another process sweeps."""
+        self._written, self._swept = 0, time.monotonic()
+        fd = os.open(self._path("__sweep__", "locks"), os.O_RDWR | os.O_CREAT)
+        try:
+            if not self._try_lock(fd):
+                return
+            try:
+                now, total, entries = time.time(), 0, []
+                for directory, _, names in os.walk(os.path.join(self.root_dir, "data")):
+                    for name in names:
+                        path = os.path.join(directory, name)
+                        try:
+                            size = os.path.getsize(path)
+                            with open(path, "rb") as f:
+                                expires = float(f.readline() or 0)
+                            used = os.path.getmtime(path)
+                        except (OSError, ValueError):
+                            continue  # Removed meanwhile, or a temp file still being written.
+                        if expires and expires <= now:
+                            self._remove(path)
+                        else:
+                            entries.append((used, size, path))
+                            total += size
+                for _, size, path in sorted(entries):
+                    if total <= self.max_bytes:
+                        break
+                    self._remove(path)
+                    total -= size
+            finally:
+                self._unlock(fd)
+        finally:
+            os.close(fd)
+
+    def _remove(self, path: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+            self._count("evictions")
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _try_lock(fd: int) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _unlock(fd: int):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    @contextlib.contextmanager
+    def lock(self, key: str, timeout: Optional[float] = None) -> Iterator[bool]:
+        # Every acquisition opens its own descriptor, so threads of one process exclude each other too.
+        fd = os.open(self._path(key, "locks"), os.O_RDWR | os.O_CREAT)
+        try:
+            deadline = time.monotonic() + (self.lock_timeout if timeout is None else timeout)
+            acquired = self._try_lock(fd)
+            if not acquired:
+                self._count("lock_waits")
+            while not acquired and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                acquired = self._try_lock(fd)
+            self._count("locks" if acquired else "lock_timeouts")
+            if not acquired:
+                log.warning("⚠️ Timed out waiting for the cache lock on %s; going ahead without it.", key)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    self._unlock(fd)
+        finally:
+            os.close(fd)
+
+# --- NETWORK BACKEND ---
+class HttpCacheBackend(CacheBackend):
+    """
+    A CacheBackend served over HTTP by a CacheServer (or anything speaking its protocol),
+    shared by every host. Locks are leases: they expire unless renewed, so a worker that
+    dies while holding one only delays the others by lease seconds. A background thread
+    renews the leases this process holds. An unreachable server counts as a cache miss
+    and an unavailable lock, so the pipeline keeps working on its local caches alone.
+    """
+
+    name = "http"
+
+    def __init__(
+        self,
+        base_url: str,
+        lock_timeout: float = 120.0,
+        lease: float = 30.0,
+        poll_interval: float = 0.05,
+        request_timeout: float = 5.0,
+        pool_size: int = 32,
+    ):
+        super().__init__(lock_timeout)
+        self.base_url = base_url.rstrip("/")
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.request_timeout = request_timeout
+        self.pool_size = pool_size
+        # Identifies this process to the server; each acquisition adds a counter to it.
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._acquisitions = itertools.count()
+        self._session = None
+        self._session_lock = threading.Lock()
+        # Lock tokens this process holds, and their keys, for the renewer.
+        self._held: Dict[str, str] = {}
+        self._held_lock = threading.Lock()
+        self._renewer: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+    @property
+    def session(self):
+        # requests is imported when the backend is first used, not when the pipeline starts.
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def _url(self, kind: str, key: str) -> str:
+        return f"{self.base_url}/{kind}/{quote(key, safe='')}"
+
+    def _request(self, method: str, url: str, **kwargs):
+        try:
+            return self.session.request(method, url, timeout=self.request_timeout, **kwargs)
+        except Exception as e:
+            self._count("errors")
+            log.warning("⚠️ Cache backend %s %s failed: %s", method, url, e)
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        self._count("gets")
+        response = self._request("GET", self._url("kv", key))
+        if response is None or response.status_code != 200:
+            return None
+        self._count("hits")
+        return response.content
+
+    def put(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self._count("puts")
+        self._request("PUT", self._url("kv", key), data=value, params={"ttl": ttl} if ttl else None)
+
+    def delete(self, key: str):
+        self._request("DELETE", self._url("kv", key))
+
+    def _try_lock(self, key: str, token: str) -> Optional[bool]:
+        """True when acquired, False when someone else holds it, None when the server can't be reached."""
+        response = self._request("POST", self._url("locks", key), params={"owner": token, "lease": self.lease})
+        if response is None or response.status_code not in (200, 409):
+            return None
+        return response.status_code == 200
+
+    @contextlib.contextmanager
+    def lock(self, key: str, timeout: Optional[float] = None) -> Iterator[bool]:
+        deadline = time.monotonic() + (self.lock_timeout if timeout is None else timeout)
+        # A token per acquisition, so threads of one process exclude each other too.
+        token = f"{self.owner}-{next(self._acquisitions)}"
+        acquired = self._try_lock(key, token)
+        if acquired is False:
+            self._count("lock_waits")
+        delay = self.poll_interval
+        while acquired is False and time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+            acquired = self._try_lock(key, token)
+        acquired = bool(acquired)
+        self._count("locks" if acquired else "lock_timeouts")
+        if not acquired:
+            log.warning("⚠️ Could not get the cache lock on %s; going ahead without it.", key)
+            yield False
+            return
+        with self._held_lock:
+            self._held[token] = key
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew, name="cache-lock-renewer", daemon=True)
+                self._renewer.start()
+        try:
+            yield True
+        finally:
+            with self._held_lock:
+                del self._held[token]
+            self._request("DELETE", self._url("locks", key), params={"owner": token})
+
+    def _renew(self):
+        while not self._closed.wait(self.lease / 3):
+            with self._held_lock:
+                held = list(self._held.items())
+            for token, key in held:
+                self._try_lock(key, token)
+
+    def close(self):
+        self._closed.set()
+        if self._session is not None:
+            self._session.close()
+
+def backend_from_env(default_root: str) -> Optional[CacheBackend]:
+    """
+    The backend named by CACHE_BACKEND: unset for none (one process), "local" or
+    "local:<dir>" for a directory (default <default_root>/shared_cache, bounded by
+    CACHE_BACKEND_MAX_BYTES), or the http(s):// URL of a CacheServer.
+    """
+    spec = os.getenv("CACHE_BACKEND", "").strip()
+    if not spec:
+        return None
+    lock_timeout = float(os.getenv("CACHE_BACKEND_LOCK_TIMEOUT", "120"))
+    if spec.startswith(("http://", "https://")):
+        return HttpCacheBackend(spec, lock_timeout=lock_timeout)
+    kind, _, root = spec.partition(":")
+    if kind != "local":
+        raise ValueError(f"Unknown CACHE_BACKEND: {spec!r}")
+    return LocalCacheBackend(
+        root or os.path.join(default_root, "shared_cache"),
+        lock_timeout=lock_timeout,
+        max_bytes=int(os.getenv("CACHE_BACKEND_MAX_BYTES", str(256 * 1024 ** 2))),
+    )
+
+# --- STAND-IN SERVER ---
+class CacheServer:
+    """
+    A small in-memory key-value and lease-lock server speaking HttpCacheBackend's protocol:
+
+        GET/PUT/DELETE /kv/<key>[?ttl=<seconds>]
+        POST /locks/<key>?owner=<id>&lease=<seconds>    200 acquired or renewed, 409 held
+        DELETE /locks/<key>?owner=<id>
+        GET /__stats
+
+    Values are evicted least recently used past max_bytes. Good enough for tests, a
+    single-host deployment or a staging fleet; production can put the same protocol in
+    front of Redis or memcached.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, max_bytes: int = 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._values: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._locks: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self.counters = {"gets": 0, "hits": 0, "puts": 0, "evictions": 0, "lock_grants": 0, "lock_conflicts": 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "CacheServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters, entries=len(self._values), bytes=self._bytes, locks=len(self._locks))
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            self.counters["gets"] += 1
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[1] and entry[1] <= time.time():
+                self._remove(key)
+                return None
+            self._values.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def put(self, key: str, value: bytes, ttl: Optional[float]):
+        with self._lock:
+            self.counters["puts"] += 1
+            self._remove(key)
+            self._values[key] = (value, time.time() + ttl if ttl else 0)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes and len(self._values) > 1:
+                self._remove(next(iter(self._values)))
+                self.counters["evictions"] += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self._values.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def acquire(self, key: str, owner: str, lease: float) -> bool:
+        """Grants (or renews) the lease when the lock is free, expired or already owner's."""
+        now = time.monotonic()
+        with self._lock:
+            holder = self._locks.get(key)
+            if holder and holder[0] != owner and holder[1] > now:
+                self.counters["lock_conflicts"] += 1
+                return False
+            self._locks[key] = (owner, now + lease)
+            if not holder or holder[0] != owner:
+                self.counters["lock_grants"] += 1
+            return True
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            holder = self._locks.get(key)
+            if holder and holder[0] == owner:
+                del self._locks[key]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: bytes = b"", content_type: str = "application/octet-stream"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _route(self) -> Tuple[str, str, Dict[str, str]]:
+                parts = urlsplit(self.path)
+                kind, _, key = parts.path.lstrip("/").partition("/")
+                params = {name: values[0] for name, values in parse_qs(parts.query).items()}
+                return kind, unquote(key), params
+
+            def do_GET(self):
+                kind, key, _ = self._route()
+                if kind == "__stats":
+                    return self._send(200, json.dumps(server.stats()).encode("utf-8"), "application/json")
+                value = server.get(key) if kind == "kv" else None
+                self._send(200, value) if value is not None else self._send(404)
+
+            def do_PUT(self):
+                kind, key, params = self._route()
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if kind != "kv":
+                    return self._send(404)
+                server.put(key, body, float(params["ttl"]) if params.get("ttl") else None)
+                self._send(204)
+
+            def do_POST(self):
+                kind, key, params = self._route()
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if kind != "locks" or not params.get("owner"):
+                    return self._send(400)
+                acquired = server.acquire(key, params["owner"], float(params.get("lease") or 30))
+                self._send(200 if acquired else 409)
+
+            def do_DELETE(self):
+                kind, key, params = self._route()
+                if kind == "kv":
+                    server.delete(key)
+                elif kind == "locks":
+                    server.release(key, params.get("owner", ""))
+                else:
+                    return self._send(404)
+                self._send(204)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def test_cache_backend():
+    """
+    Checks both backends (the network one against a local CacheServer): values, TTLs and
+    mutual exclusion, that the local backend stays within max_bytes, and that images go
+    into it by path. Then runs two image generators with separate local caches, as on
+    two hosts, against the stub Stability API and checks the image is generated once.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from image_cache import ImageCache
+    from image_delivery import placeholder_png
+    from http_transport import HttpTransport
+    from stub_servers import StubServer, StubProfile
+    from text_to_image import StabilityImageGenerator
+
+    print("\n--- Running Cache Backend Test (with a local cache server) ---")
+    failures = []
+    server = CacheServer().start()
+    backends = [LocalCacheBackend(tempfile.mkdtemp(prefix="cache-backend-")), HttpCacheBackend(server.url, lease=1.0)]
+
+    for backend in backends:
+        backend.put("completion/a", b"value")
+        backend.put("completion/b", b"short-lived", ttl=0.05)
+        time.sleep(0.1)
+        if backend.get("completion/a") != b"value" or backend.get("completion/b") is not None:
+            failures.append(f"{backend.name}: values or TTLs wrong")
+
+        active, peak = [0], [0]
+        counter = threading.Lock()
+
+        def critical_section(_):
+            with backend.lock("image/k") as held:
+                with counter:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with counter:
+                    active[0] -= 1
+                return held
+
+        with ThreadPoolExecutor(8) as pool:
+            held = list(pool.map(critical_section, range(16)))
+        if peak[0] != 1 or not all(held):
+            failures.append(f"{backend.name}: lock let {peak[0]} holders in at once")
+        print(f"{backend.name:<6} {backend.stats()}")
+
+    bounded = LocalCacheBackend(tempfile.mkdtemp(prefix="cache-backend-"), max_bytes=10_000)
+    for i in range(20):
+        bounded.put(f"completion/{i}", b"x" * 1000)
+    bounded.sweep()
+    stored = sum(os.path.getsize(os.path.join(d, n)) for d, _, names in os.walk(bounded.root_dir) for n in names)
+    print(f"Bounded local backend: {stored} bytes stored of 20 x 1000 written, {bounded.stats()['evictions']} evicted")
+    if stored > bounded.max_bytes or bounded.get("completion/19") is None or bounded.get("completion/0") is not None:
+        failures.append(f"local backend kept {stored} bytes past max_bytes={bounded.max_bytes}, or not the newest")
+
+    # Two image caches on one host: the second finds the first's image through a path, not a copy.
+    publisher, reader = (ImageCache(tempfile.mkdtemp(prefix="host-"), backend=bounded) for _ in range(2))
+    publisher.put("ef" * 32, placeholder_png())
+    published = bounded.get(f"image/{'ef' * 32}")
+    copied = reader.get("ef" * 32)
+    if len(published) > 512 or not copied or open(copied, "rb").read() != placeholder_png():
+        failures.append(f"local backend got {len(published)} bytes for an image, or the reader missed it")
+
+    stub = StubServer(profiles={"stability": StubProfile(latency="fixed:0.3")}).start()
+    saved = {name: os.environ.get(name) for name in ("STABILITY_API_HOST", "STABILITY_API_KEY")}
+    os.environ.update(STABILITY_API_HOST=stub.url, STABILITY_API_KEY="stub")
+    try:
+        hosts = []
+        for _ in range(2):
+            shared = HttpCacheBackend(server.url)
+            cache = ImageCache(tempfile.mkdtemp(prefix="host-"), backend=shared)
+            hosts.append((StabilityImageGenerator(transport=HttpTransport(), cache=cache), cache))
+
+        def generate(i):
+            generator, cache = hosts[i % 2]
+            return generator.generate_images("Moon", "a photograph of the Moon", 7, 1, cache.root_dir)
+
+        with ThreadPoolExecutor(8) as pool:
+            paths = list(pool.map(generate, range(8)))
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        stub.stop()
+        server.stop()
+
+    generated = stub.stats()["stability"]["requests"]
+    print(f"Image requests from 2 hosts x 4 callers: {generated} upstream call(s)")
+    if generated != 1 or not all(len(p) == 1 and os.path.exists(p[0]) for p in paths):
+        failures.append(f"{generated} upstream image calls for one key")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("\n✅ Test successful!" if not failures else "\n❌ Test failed.")
+    return not failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the shared cache and lock backend (CACHE_BACKEND=http://...).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--max-bytes", type=int, default=1024 ** 3)
+    parser.add_argument("--test", action="store_true", help="Run the standalone test instead of serving.")
+    args = parser.parse_args()
+    if args.test:
+        return 0 if test_cache_backend() else 1
+
+    server = CacheServer(args.host, args.port, max_bytes=args.max_bytes)
+    print(f"🗄️ Cache backend listening on {server.url}")
+    print(f"   export CACHE_BACKEND={server.url}", flush=True)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
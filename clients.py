@@ -0,0 +1,67 @@
+import threading
+from typing import Any, Callable, Optional
+
+def build_cerebras_client(pool_size: int = 100, max_retries: int = 2):
+    """
+    Builds one Cerebras client whose connection pool is sized for many concurrent requests.
+    The client is thread-safe and is meant to be shared by every component in the process.
+    Pass max_retries=0 when a RateGovernor retries throttled calls instead of the SDK.
+    """
+    # The SDK (with httpx and pydantic) is the slowest import in the backend, so it is
+    # only loaded once a client is actually needed.
+    from cerebras.cloud.sdk import Cerebras, DefaultHttpxClient
+    import httpx
+
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return Cerebras(http_client=DefaultHttpxClient(limits=limits), max_retries=max_retries)
+
+class LazyClient:
+    """
+    Stands in for a client that is built on first use, so importing and constructing the
+    pipeline stays cheap and a missing key or unreachable host fails the calls that need
+    the client rather than startup. A failed build is retried on the next use. Attribute
+    access (client.chat.completions.create, ...) is forwarded to the built client.
+    """
+
+    def __init__(self, factory: Callable[[], Any], name: str = "client"):
+        self._factory = factory
+        self.name = name
+        self._client = None
+        self._building = False
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._building = True
+                    try:
+                        self._client = self._factory()
+                        self.error = None
+                    except Exception as e:
+                        self.error = f"{type(e).__name__}: {e}"
+                        raise
+                    finally:
+                        self._building = False
+        return self._client
+
+    @property
+    def built(self) -> bool:
+        return self._client is not None
+
+    def status(self) -> str:
+        """'ready', 'loading', 'idle' (not needed yet) or 'error: ...' from the last failed build."""
+        if self._client is not None:
+            return "ready"
+        if self._building:
+            return "loading"
+        return f"error: {self.error}" if self.error else "idle"
+
+    def __getattr__(self, name):
+        # Only reached for attributes LazyClient itself doesn't have.
+        return getattr(self.get(), name)
+
+def lazy_cerebras_client(pool_size: int = 100, max_retries: int = 2) -> LazyClient:
+    """A shared Cerebras client that is built (and the SDK imported) on the first completion."""
+    return LazyClient(lambda: build_cerebras_client(pool_size, max_retries=max_retries), name="cerebras")
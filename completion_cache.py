@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import contextlib
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, Optional
+
+from rate_governor import RateGovernor
+from telemetry import record_upstream
+
+if TYPE_CHECKING:
+    from cache_backend import CacheBackend
+
+class CompletionCache:
+    """
+    A persistent cache of LLM completions backed by SQLite.
+
+    Entries are keyed by model, whitespace-normalized prompt and call parameters, expire
+    after a per-stage TTL and are evicted least-recently-used once the cache holds more
+    than max_entries. Set bypass (or COMPLETION_CACHE_BYPASS=1) to always call the model.
+
+    With a shared CacheBackend, local misses are looked up there, new completions are
+    published to it with their TTL, and lock() makes one worker fleet-wide run each prompt.
+    """
+
+    DEFAULT_TTLS = {
+        "extraction": 7 * 24 * 3600,
+        "enrichment": 30 * 24 * 3600,
+        "explanation": 7 * 24 * 3600,
+        "exploration": 24 * 3600,
+        "entities": 7 * 24 * 3600,
+        "lesson_plan": 7 * 24 * 3600,
+    }
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 50000,
+        ttls: Optional[Dict[str, int]] = None,
+        bypass: Optional[bool] = None,
+        backend: Optional["CacheBackend"] = None,
+    ):
+        self.path = path
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        if bypass is None:
+            bypass = os.getenv("COMPLETION_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+        self.bypass = bypass
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY, stage TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Collapses the indentation and blank lines of the triple-quoted prompts."""
+        return " ".join(prompt.split())
+
+    @classmethod
+    def make_key(cls, model: str, prompt: str, params: Optional[Dict] = None) -> str:
+        raw = json.dumps([model, cls.normalize_prompt(prompt), params or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM completions WHERE key = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return row[0]
+            if row:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+        shared = self.backend.get(f"completion/{key}") if self.backend is not None else None
+        if shared is not None:
+            entry = json.loads(shared)
+            self.put(key, entry["stage"], entry["value"], publish=False)
+            with self._lock:
+                self.hits += 1
+                self.shared_hits += 1
+            return entry["value"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, stage: str, value: str, publish: bool = True):
+        now = time.time()
+        ttl = self.ttls.get(stage, 24 * 3600)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, stage, value, expires, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, value, now + ttl, now),
+            )
+            self._evict(now)
+        if publish and self.backend is not None:
+            self.backend.put(f"completion/{key}", json.dumps({"stage": stage, "value": value}).encode("utf-8"), ttl=ttl)
+
+    def lock(self, key: str):
+        """
+        Held while a completion is generated. Yields True when it is a fleet-wide lock (so
+        another worker may have cached the completion meanwhile), None without a backend.
+        """
+        if self.backend is None:
+            return contextlib.nullcontext()
+        return self.backend.lock(f"completion/{key}")
+
+    def _evict(self, now: float):
+        self._db.execute("DELETE FROM completions WHERE expires <= ?", (now,))
+        count = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN"
+                " (SELECT key FROM completions ORDER BY last_access LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "shared_hits": self.shared_hits,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+def create_completion(
+    client,
+    model: str,
+    prompt: str,
+    stage: str,
+    cache: Optional[CompletionCache] = None,
+    bypass: bool = False,
+    validate: Optional[Callable[[str], bool]] = None,
+    governor: Optional[RateGovernor] = None,
+    **params,
+) -> str:
+    """
+    Runs a single-message chat completion and returns its text, going through the
+    completion cache when one is given. Errors are raised and never cached, and
+    neither are completions rejected by the optional validate callback. With a
+    governor, the call waits for its turn under the Cerebras rate limits and is
+    queued again when throttled (raising RateLimited once attempts run out).
+    With a shared cache backend, only one worker fleet-wide runs a given prompt at a time.
+    """
+    use_cache = cache is not None and not cache.bypass and not bypass
+    if use_cache:
+        key = CompletionCache.make_key(model, prompt, params)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    def call():
+        start = time.perf_counter()
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=False,
+                **params
+            )
+        except Exception as e:
+            record_upstream("cerebras", time.perf_counter() - start, error=e)
+            raise
+        record_upstream("cerebras", time.perf_counter() - start)
+        return response
+
+    with (cache.lock(key) if use_cache else contextlib.nullcontext()) as shared:
+        if shared:
+            # Another worker may have finished the same completion while this one waited.
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
+        response = governor.call("cerebras", model, call) if governor else call()
+        content = response.choices[0].message.content
+
+        if use_cache and (validate is None or validate(content)):
+            cache.put(key, stage, content)
+    return content
+
+def stream_completion(
+    client,
+    model: str,
+    prompt: str,
+    stage: str,
+    cache: Optional[CompletionCache] = None,
+    bypass: bool = False,
+    governor: Optional[RateGovernor] = None,
+    **params,
+) -> Iterator[str]:
+    """
+    Streams a single-message chat completion piece by piece as the model produces it.
+    A cached completion is yielded in one piece; a finished stream is written to the cache.
+    With a governor, the stream holds one Cerebras slot until it ends.
+    """
+    use_cache = cache is not None and not cache.bypass and not bypass
+    if use_cache:
+        key = CompletionCache.make_key(model, prompt, params)
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    with (governor.slot("cerebras", model) if governor else contextlib.nullcontext()):
+        start = time.perf_counter()
+        try:
+            stream = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                **params
+            )
+        except Exception as e:
+            record_upstream("cerebras", time.perf_counter() - start, error=e)
+            raise
+        # Latency to the start of the stream; the tokens are timed by the caller's span.
+        record_upstream("cerebras", time.perf_counter() - start)
+        pieces = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            piece = chunk.choices[0].delta.content
+            if piece:
+                pieces.append(piece)
+                yield piece
+
+    if use_cache:
+        cache.put(key, stage, "".join(pieces))
@@ -0,0 +1,27 @@
+import time
+from typing import Optional
+
+class Deadline:
+    """
+    The point in time by which a request must be answered. Created from a latency budget
+    in seconds when the request arrives and handed to every stage, which waits at most
+    remaining() before falling back. A budget of None never expires.
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget
+        self.expires = time.monotonic() + budget if budget is not None else None
+
+    def remaining(self, share: float = 1.0) -> Optional[float]:
+        """Seconds left (times share), never negative; None when there is no deadline."""
+        if self.expires is None:
+            return None
+        return max(0.0, (self.expires - time.monotonic()) * share)
+
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def __repr__(self) -> str:
+        if self.expires is None:
+            return "Deadline(None)"
+        return f"Deadline({self.budget}s, {self.remaining():.3f}s left)"
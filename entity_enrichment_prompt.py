@@ -1,19 +1,38 @@
 import os
-from typing import Dict, List
-from dotenv import load_dotenv
-from cerebras.cloud.sdk import Cerebras
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-# Load environment variables for the standalone test block
-load_dotenv()
+from clients import lazy_cerebras_client
+from rate_governor import RateGovernor
+from completion_cache import CompletionCache
+from model_routing import ModelRouter
+from telemetry import span
+
+if TYPE_CHECKING:
+    from cerebras.cloud.sdk import Cerebras
+
+log = logging.getLogger(__name__)
 
 class PromptEnricher:
-    def __init__(self):
+    def __init__(
+        self,
+        client: Optional["Cerebras"] = None,
+        cache: Optional[CompletionCache] = None,
+        governor: Optional[RateGovernor] = None,
+        router: Optional[ModelRouter] = None,
+    ):
         """
         Initialize the PromptEnricher with the Cerebras client.
-        The client automatically finds the CEREBRAS_API_KEY in your .env file.
+        The default client is built on the first call and reads CEREBRAS_API_KEY from the environment.
+        Pass an existing client to share one connection pool between components,
+        and a CompletionCache to reuse completions across calls and restarts.
+        A shared RateGovernor keeps the calls under the Cerebras rate limits, and the
+        ModelRouter picks the model and max_tokens for each call.
         """
-        self.client = Cerebras()
-        self.model = "qwen-3-235b-a22b-instruct-2507" # The model you suggested
+        self.client = client or lazy_cerebras_client()
+        self.cache = cache
+        self.governor = governor
+        self.router = router or ModelRouter()
         self.default_templates = {
             "Earth": "a high-quality, realistic photograph of the planet Earth from space",
             "Sun": "a scientifically accurate photograph of the Sun, showing its fiery surface and solar flares",
@@ -27,10 +46,10 @@ class PromptEnricher:
         Converts a simple entity into a direct and clear image generation prompt using Cerebras.
         """
         if entity.title() in self.default_templates:
-            print(f"Found template for '{entity}'.")
-            return self.default_templates[entity.title()]
+            log.debug("Found template for '%s'.", entity)
+            return self.fallback_prompt(entity)
 
-        print(f"No template found for '{entity}'. Using Cerebras to enrich...")
+        log.debug("No template found for '%s'. Using Cerebras to enrich...", entity)
         
         # This prompt asks for a simple, clear photograph description.
         prompt = f"""
@@ -49,16 +68,30 @@ class PromptEnricher:
         Now, create a prompt for the following entity: {entity}
         """
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"❌ Cerebras API error enriching prompt: {e}")
-            return f"a high-quality photograph of {entity}"
+        with span("enrichment", entity=entity) as attrs:
+            try:
+                response_text = self.router.complete(
+                    self.client, "enrichment", prompt, cache=self.cache, governor=self.governor,
+                    validate=self.is_valid_prompt,
+                )
+                return response_text.strip()
+            except Exception as e:
+                log.error("❌ Cerebras API error enriching prompt: %s", e)
+                attrs["error"] = str(e)
+                return self.fallback_prompt(entity)
+
+    def fallback_prompt(self, entity: str) -> str:
+        """
+        The prompt used without calling Cerebras: the entity's template if it has one,
+        otherwise a generic photograph prompt.
+        """
+        return self.default_templates.get(entity.title(), f"a high-quality photograph of {entity}")
+
+    @staticmethod
+    def is_valid_prompt(text: str) -> bool:
+        """A usable answer is the one-line photograph prompt the instructions ask for, without commentary."""
+        text = text.strip().strip('"').strip()
+        return text.lower().startswith("a high-quality") and "\n" not in text
 
     def enrich_prompts(self, entities: List[str]) -> Dict[str, str]:
         enriched = {}
@@ -84,4 +117,7 @@ def test_prompt_enricher():
         print(f"❌ Test failed with an unexpected error: {str(e)}")
 
 if __name__ == "__main__":
+    # Load environment variables for the standalone test block
+    from dotenv import load_dotenv
+    load_dotenv()
     test_prompt_enricher()
\ No newline at end of file
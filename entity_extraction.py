@@ -1,19 +1,38 @@
 import os
-from cerebras.cloud.sdk import Cerebras
-from typing import List
-from dotenv import load_dotenv
+import logging
+from typing import TYPE_CHECKING, List, Optional
 
-# Load environment variables for the standalone test
-load_dotenv()
+from clients import lazy_cerebras_client
+from rate_governor import RateGovernor, RateLimited
+from completion_cache import CompletionCache
+from model_routing import ModelRouter
+from telemetry import span
+
+if TYPE_CHECKING:
+    from cerebras.cloud.sdk import Cerebras
+
+log = logging.getLogger(__name__)
 
 class EntityExtractor:
-    def __init__(self):
+    def __init__(
+        self,
+        client: Optional["Cerebras"] = None,
+        cache: Optional[CompletionCache] = None,
+        governor: Optional[RateGovernor] = None,
+        router: Optional[ModelRouter] = None,
+    ):
         """
         Initialize the EntityExtractor with the Cerebras client.
-        The client automatically finds the CEREBRAS_API_KEY in your .env file.
+        The default client is built on the first call and reads CEREBRAS_API_KEY from the environment.
+        Pass an existing client to share one connection pool between components,
+        and a CompletionCache to reuse completions across calls and restarts.
+        A shared RateGovernor keeps the calls under the Cerebras rate limits, and the
+        ModelRouter picks the model and max_tokens for each call.
         """
-        self.client = Cerebras()
-        self.model = "qwen-3-235b-a22b-instruct-2507" # The model you suggested
+        self.client = client or lazy_cerebras_client()
+        self.cache = cache
+        self.governor = governor
+        self.router = router or ModelRouter()
 
     def extract_concepts(self, text: str) -> List[str]:
         """
@@ -41,21 +60,31 @@ class EntityExtractor:
         "{text}"
         """
 
-        try:
-            print(f"Extracting main subject from '{text}' with Cerebras...")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=False
-            )
-            response_text = response.choices[0].message.content
-            # Cleanly parse the comma-separated string from the model
-            concepts = [concept.strip() for concept in response_text.split(',') if concept.strip()]
-            print(f"✅ Extracted subject: {concepts}")
-            return concepts
-        except Exception as e:
-            print(f"❌ Cerebras API error during entity extraction: {e}")
-            return [f"error: {str(e)}"]
+        with span("extraction") as attrs:
+            try:
+                log.debug("Extracting main subject from '%s' with Cerebras...", text)
+                response_text = self.router.complete(
+                    self.client, "extraction", prompt, cache=self.cache, governor=self.governor,
+                    validate=self.is_valid_subject,
+                )
+                # Cleanly parse the comma-separated string from the model
+                concepts = [concept.strip() for concept in response_text.split(',') if concept.strip()]
+                log.debug("✅ Extracted subject: %s", concepts)
+                return concepts
+            except RateLimited as e:
+                # Throttling is left to the caller, not returned as if it were a subject.
+                attrs["error"] = str(e)
+                raise
+            except Exception as e:
+                log.error("❌ Cerebras API error during entity extraction: %s", e)
+                attrs["error"] = str(e)
+                return [f"error: {str(e)}"]
+
+    @staticmethod
+    def is_valid_subject(text: str) -> bool:
+        """A usable answer is a short name on one line, not a sentence about it."""
+        text = text.strip()
+        return bool(text) and "\n" not in text and len(text.split()) <= 6
 
 def test_entity_extractor():
     """Test the updated EntityExtractor with Cerebras"""
@@ -85,4 +114,7 @@ def test_entity_extractor():
         print(f"Test failed with an unexpected error: {str(e)}")
 
 if __name__ == "__main__":
+    # Load environment variables for the standalone test
+    from dotenv import load_dotenv
+    load_dotenv()
     test_entity_extractor()
\ No newline at end of file
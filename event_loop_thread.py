@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+class EventLoopThread:
+    """
+    A long-lived asyncio event loop running in a daemon thread.
+    Sync code (like the Flask views) submits coroutines to it instead of calling
+    asyncio.run, so every request shares one loop and the state that lives on it.
+    """
+
+    def __init__(self, name: str = "pipeline-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedules a coroutine on the loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: float = None):
+        """Runs a coroutine on the loop and blocks the calling thread until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen):
+        """Drives an async generator on the loop and yields its items to the calling thread."""
+        async def step(awaitable):
+            return await awaitable
+
+        try:
+            while True:
+                try:
+                    yield self.run(step(agen.__anext__()))
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(step(agen.aclose()))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
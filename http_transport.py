@@ -0,0 +1,217 @@
+import time
+import random
+import asyncio
+import threading
+import email.utils
+import contextlib
+from typing import TYPE_CHECKING, Dict, Optional
+
+from rate_governor import RateGovernor
+from telemetry import record_upstream
+
+if TYPE_CHECKING:
+    import requests
+
+class HttpTransport:
+    """
+    A shared, pooled HTTP transport with timeouts and retries.
+
+    Connections are kept alive in a requests session sized by pool_size. Every call has a
+    connect and a read timeout. Connection errors, timeouts and retryable statuses
+    (429/5xx) are retried with jittered exponential backoff, honouring Retry-After when
+    the server sends it. With a RateGovernor, every attempt also waits for a slot under
+    the provider's limits and reports its status, so throttling shrinks the window for
+    every caller instead of each one retrying on its own.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        pool_size: int = 100,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 90.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        governor: Optional[RateGovernor] = None,
+        provider: str = "stability",
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.governor = governor
+        self.provider = provider
+        self.pool_size = pool_size
+
+        # Built on first use: importing requests is a noticeable share of the server's startup.
+        self._session: Optional["requests.Session"] = None
+        self._adapter = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            self.warm_up()
+        return self._session
+
+    def warm_up(self):
+        """Builds the pooled session (importing requests) ahead of the first call; a no-op once built."""
+        if self._session is not None:
+            return
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                # Retries are handled here rather than by urllib3, so they can be counted and can honour Retry-After.
+                self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount("https://", self._adapter)
+                session.mount("http://", self._adapter)
+                self._session = session
+
+    def post(self, url: str, model: str = "default", **kwargs) -> "requests.Response":
+        """
+        POSTs with retries. Returns the last response (which may still be an error status
+        once retries run out) or raises the last connection error. model selects the
+        governor's limit for this provider.
+        """
+        import requests
+
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            self._count("requests")
+            try:
+                with self._slot(model) as permit:
+                    # Timed from here, so the latency excludes the wait for a rate limit slot.
+                    start = time.perf_counter()
+                    response = self.session.post(url, **kwargs)
+                    if permit is not None:
+                        permit.observe(response.status_code, self._retry_after(response))
+                record_upstream(self.provider, time.perf_counter() - start, status=response.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                record_upstream(self.provider, time.perf_counter() - start, error=e)
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    return response
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    return response
+                delay = self._retry_after(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                response.close()
+
+            self._count("retries")
+            attempt += 1
+            time.sleep(delay)
+
+    async def apost(self, url: str, executor=None, **kwargs) -> "requests.Response":
+        """post() for async callers; the blocking call runs on the given (or default) executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, lambda: self.post(url, **kwargs))
+
+    def _slot(self, model: str):
+        if self.governor is None:
+            return contextlib.nullcontext()
+        return self.governor.slot(self.provider, model)
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": a uniform delay up to the exponential cap spreads retries out.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry_after(self, response: "requests.Response") -> Optional[float]:
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            delay = float(value)
+        except ValueError:
+            # Retry-After may also be an HTTP date.
+            try:
+                delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(self.backoff_max, max(0.0, delay))
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        """Request, retry and failure counters, plus how many requests reused a pooled connection."""
+        opened = 0
+        sent = 0
+        pools = self._adapter.poolmanager.pools if self._adapter is not None else {}
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "connections_opened": opened,
+            "connections_reused": max(0, sent - opened),
+        }
+
+def test_http_transport():
+    """Checks retries, Retry-After and connection reuse against a local stub server."""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    calls = {"count": 0}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            calls["count"] += 1
+            # Every third request is throttled, to exercise the retry path.
+            if calls["count"] % 3 == 1:
+                body, status = b'{"message": "slow down"}', 429
+            else:
+                body, status = json.dumps({"ok": True}).encode(), 200
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    print("\n--- Running HttpTransport Standalone Test (with a local stub server) ---")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        transport = HttpTransport(pool_size=4, backoff_base=0.01)
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1/generation/test/text-to-image"
+        statuses = [transport.post(url, json={"n": i}).status_code for i in range(5)]
+        stats = transport.stats()
+        print(f"Statuses: {statuses}")
+        print(f"Stats: {stats}")
+    finally:
+        server.shutdown()
+
+    if all(s == 200 for s in statuses) and stats["retries"] > 0 and stats["connections_reused"] > 0:
+        print("\n✅ Test successful!")
+    else:
+        print("\n❌ Test failed.")
+
+if __name__ == "__main__":
+    test_http_transport()
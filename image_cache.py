@@ -0,0 +1,358 @@
+import os
+import re
+import glob
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import contextlib
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from cache_backend import CacheBackend
+
+class ImageCache:
+    """
+    A content-addressed cache for generated images.
+
+    Images are keyed by a hash of every parameter that affects the render, stored in a
+    two-level sharded directory (ab/cd/<key>.png) and written atomically through a temp
+    file and rename. A small SQLite index records each file's size and last access so the
+    least recently used images can be evicted once the cache grows past its byte budget.
+
+    Compressed derivatives are written once, next to the original, when it is stored:
+    a full-size WebP (<key>.webp) and WebP thumbnails (<key>.w256.webp). They count
+    against the budget and are evicted together with the original.
+
+    Each image can carry a label (its entity and prompt), so find_similar() can stand in
+    an already cached image when a new one can't be generated in time.
+
+    With a shared CacheBackend, a local miss is looked up there (and copied in) before
+    anyone generates the image, stored originals are published to it, and key_lock()
+    also holds the backend's lock, so one worker fleet-wide generates each image. A backend
+    on the same file system only gets the original's path, not another copy of its bytes.
+    """
+
+    INDEX_NAME = "index.sqlite3"
+    # Base64 payloads are decoded in chunks of this many characters (a multiple of 4).
+    DECODE_CHUNK = 256 * 1024
+    # Prompt boilerplate that every label shares, so it says nothing about similarity.
+    LABEL_STOPWORDS = {
+        "a", "an", "the", "of", "and", "with", "in", "on", "its", "high", "quality", "detailed",
+        "photograph", "realistic", "photo", "image", "picture", "showing", "scientifically", "accurate",
+    }
+
+    def __init__(
+        self,
+        root_dir: str,
+        max_bytes: int = 2 * 1024 ** 3,
+        derivative_widths: Tuple[int, ...] = (256, 512),
+        webp_quality: int = 80,
+        backend: Optional["CacheBackend"] = None,
+    ):
+        self.root_dir = root_dir
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.derivative_widths = derivative_widths
+        self.webp_quality = webp_quality
+        os.makedirs(root_dir, exist_ok=True)
+
+        self._db = sqlite3.connect(
+            os.path.join(root_dir, self.INDEX_NAME), check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL, digest TEXT, label TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(images)")}
+        if "digest" not in columns:
+            # Indexes created before content digests were recorded.
+            self._db.execute("ALTER TABLE images ADD COLUMN digest TEXT")
+        if "label" not in columns:
+            self._db.execute("ALTER TABLE images ADD COLUMN label TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_access ON images (last_access)")
+        self._db_lock = threading.Lock()
+
+        # key -> [lock, holders and waiters]; an entry is dropped when its last user leaves,
+        # so the table only holds keys being worked on and unrelated keys never share a lock.
+        self._key_locks: Dict[str, list] = {}
+        self._key_locks_guard = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_hits = 0
+        # Called with the paths of every evicted file, so caches built on top can drop what used them.
+        self.eviction_listeners: List[Callable[[List[str]], None]] = []
+
+    @staticmethod
+    def make_key(
+        engine_id: str, prompt: str, seed: int, width: int, height: int, steps: int, cfg_scale: float
+    ) -> str:
+        """Hashes every parameter that changes the rendered image into a cache key."""
+        raw = "\x1f".join(str(part) for part in (engine_id, prompt, seed, width, height, steps, cfg_scale))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str, ext: str = ".png") -> str:
+        """Returns the sharded location of a key, e.g. <root>/ab/cd/<key>.png."""
+        return os.path.join(self.root_dir, key[:2], key[2:4], f"{key}{ext}")
+
+    @staticmethod
+    def split_name(filename: str) -> Optional[Tuple[str, str]]:
+        """
+        Splits a cache file name like '<key>.png' or '<key>.w256.webp' into (key, ext).
+        Returns None for names that are not cache keys.
+        """
+        key, dot, ext = filename.partition(".")
+        digest, _, sample = key.partition("_")
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            return None
+        if (sample and not sample.isdigit()) or not dot or not ext.replace(".", "").isalnum():
+            return None
+        return key, f".{ext}"
+
+    def resolve_name(self, filename: str) -> Optional[str]:
+        """
+        Maps a bare file name like '<key>.png' back to its sharded path.
+        Returns None for names that are not cache keys, so callers can't escape the cache root.
+        """
+        parts = self.split_name(filename)
+        return self.path_for(*parts) if parts else None
+
+    @contextlib.contextmanager
+    def key_lock(self, key: str) -> Iterator[None]:
+        """A lock shared by every caller working on the same key (fleet-wide with a backend)."""
+        with self._key_locks_guard:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if self.backend is None:
+                    yield
+                else:
+                    with self.backend.lock(f"image/{key}"):
+                        yield
+        finally:
+            with self._key_locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached path for a key and marks it as recently used, or None on a miss."""
+        with self._db_lock:
+            row = self._db.execute("SELECT path FROM images WHERE key = ?", (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                self._db.execute("UPDATE images SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return row[0]
+            if row:
+                # The file was removed behind our back; drop the stale index entry.
+                self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+        data = self.backend.get(f"image/{key}") if self.backend is not None else None
+        if data is not None and data[:1] == b"{":
+            data = self._read_published(json.loads(data)["path"])
+        if data is not None:
+            # Another worker generated it; keep a local copy so it is served from disk.
+            path = self._store(key, ".png", lambda f: f.write(data), publish=False)
+            with self._db_lock:
+                self.hits += 1
+                self.shared_hits += 1
+            return path
+        with self._db_lock:
+            self.misses += 1
+        return None
+
+    def digest(self, key: str) -> Optional[str]:
+        """The SHA-256 of the original image's bytes, recorded when it was written."""
+        with self._db_lock:
+            row = self._db.execute("SELECT digest FROM images WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, data: bytes, ext: str = ".png", label: Optional[str] = None) -> str:
+        """Atomically writes an image into the cache, indexes it and enforces the byte budget."""
+        return self._store(key, ext, lambda f: f.write(data), label)
+
+    def put_base64(self, key: str, encoded: str, ext: str = ".png", label: Optional[str] = None) -> str:
+        """
+        Like put(), but decodes a base64 payload chunk by chunk straight into the temp file,
+        so the whole decoded image is never held in memory.
+        """
+        def write(f):
+            for start in range(0, len(encoded), self.DECODE_CHUNK):
+                f.write(base64.b64decode(encoded[start:start + self.DECODE_CHUNK]))
+        return self._store(key, ext, write, label)
+
+    def _store(
+        self, key: str, ext: str, write: Callable, label: Optional[str] = None, publish: bool = True
+    ) -> str:
+        path = self.path_for(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = self._atomic_write(path, write)
+        size = os.path.getsize(path) + sum(os.path.getsize(p) for p in self._write_derivatives(key, path))
+
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO images (key, path, size, created, last_access, digest, label)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, path, size, now, now, digest, label),
+            )
+        self.evict()
+        if publish and self.backend is not None and ext == ".png":
+            if self.backend.shares_files:
+                self.backend.put(f"image/{key}", json.dumps({"path": os.path.abspath(path)}).encode("utf-8"))
+            else:
+                with open(path, "rb") as f:
+                    self.backend.put(f"image/{key}", f.read())
+        return path
+
+    @staticmethod
+    def _read_published(path: str) -> Optional[bytes]:
+        """The bytes of an original another worker published by path; None once it was evicted."""
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _atomic_write(path: str, write: Callable) -> str:
+        """Writes through a temp file in the same directory and renames it into place. Returns the SHA-256."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                hashing = _HashingWriter(f)
+                write(hashing)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return hashing.hexdigest()
+
+    def _write_derivatives(self, key: str, path: str) -> List[str]:
+        """Writes the WebP derivatives of an original. Skipped when Pillow isn't installed."""
+        try:
+            from PIL import Image
+        except ImportError:
+            return []
+
+        written = []
+        with Image.open(path) as original:
+            original.load()
+            variants = [("", original.width)] + [
+                (f".w{width}", width) for width in self.derivative_widths if width < original.width
+            ]
+            for suffix, width in variants:
+                image = original
+                if width != original.width:
+                    height = max(1, round(original.height * width / original.width))
+                    image = original.resize((width, height), Image.LANCZOS)
+                derivative = self.path_for(key, f"{suffix}.webp")
+                self._atomic_write(derivative, lambda f: image.save(f, "WEBP", quality=self.webp_quality))
+                written.append(derivative)
+        return written
+
+    @classmethod
+    def label_words(cls, text: str) -> set:
+        return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 1 and w not in cls.LABEL_STOPWORDS}
+
+    def find_similar(self, text: str, min_score: float = 0.34, candidates: int = 500) -> Optional[str]:
+        """
+        The cached image whose label shares the most words with text (Jaccard similarity of
+        at least min_score), or None. Only the most recently used labels that share a
+        word with text are scored, so the lookup stays cheap on a large cache.
+        """
+        words = self.label_words(text)
+        if not words:
+            return None
+        clause = " OR ".join("label LIKE ?" for _ in words)
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT key, path, label FROM images WHERE label IS NOT NULL AND ({clause})"
+                " ORDER BY last_access DESC LIMIT ?",
+                [f"%{word}%" for word in words] + [candidates],
+            ).fetchall()
+        best, best_score = None, min_score
+        for key, path, label in rows:
+            other = self.label_words(label)
+            score = len(words & other) / len(words | other) if other else 0.0
+            if score >= best_score and os.path.exists(path):
+                best, best_score = (key, path), score
+        if best is None:
+            return None
+        with self._db_lock:
+            self._db.execute("UPDATE images SET last_access = ? WHERE key = ?", (time.time(), best[0]))
+        return best[1]
+
+    def variants(self, key: str) -> List[str]:
+        """Every file stored for a key: the original and its derivatives."""
+        return glob.glob(self.path_for(key, ".*"))
+
+    def total_bytes(self) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+
+    def evict(self) -> int:
+        """Removes least recently used images until the cache fits its byte budget."""
+        evicted = 0
+        removed: List[str] = []
+        with self._db_lock:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            rows = self._db.execute("SELECT key, size FROM images ORDER BY last_access").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                for path in self.variants(key):
+                    try:
+                        os.remove(path)
+                        removed.append(path)
+                    except FileNotFoundError:
+                        pass
+                self._db.execute("DELETE FROM images WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+            self.evictions += evicted
+        for listener in self.eviction_listeners:
+            listener(removed)
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters plus the current size of the cache."""
+        with self._db_lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "shared_hits": self.shared_hits,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+class _HashingWriter:
+    """A file wrapper that hashes everything written through it."""
+
+    def __init__(self, f):
+        self._f = f
+        self._hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        return self._f.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        # Pillow also needs seek/tell/flush on the file it saves into.
+        return getattr(self._f, name)
@@ -0,0 +1,88 @@
+import os
+import zlib
+import struct
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from image_cache import ImageCache
+
+# Cache entries are content-addressed and never change in place, so clients may keep them forever.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CONTENT_TYPES = {".png": "image/png", ".webp": "image/webp"}
+
+# Stands in for an image that is still being generated; lives next to the cache shards.
+PLACEHOLDER_NAME = "placeholder.png"
+
+def select_variant(
+    cache: ImageCache, filename: str, accept: str = "", width: Optional[int] = None
+) -> Optional[Tuple[str, str, str]]:
+    """
+    Picks the file to serve for a requested cache image name.
+
+    Clients that accept WebP get the WebP derivative, and with ?w=<width> the smallest
+    thumbnail at least that wide. Other clients get the original PNG. Explicitly named
+    derivatives are served as-is. Returns (path, content_type, etag), or None when the
+    name isn't a cached image.
+    """
+    parts = cache.split_name(filename)
+    if not parts:
+        return None
+    key, ext = parts
+    requested = cache.path_for(key, ext)
+    if not os.path.isfile(requested):
+        return None
+
+    suffix = ext
+    if ext == ".png" and "image/webp" in (accept or ""):
+        suffix = ".webp"
+        if width:
+            fitting = sorted(w for w in cache.derivative_widths if w >= width)
+            for w in fitting[:1]:
+                if os.path.isfile(cache.path_for(key, f".w{w}.webp")):
+                    suffix = f".w{w}.webp"
+        if not os.path.isfile(cache.path_for(key, suffix)):
+            suffix = ext
+
+    path = cache.path_for(key, suffix)
+    content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+    # Strong ETag: the original's content digest plus the variant that was derived from it.
+    etag = f'"{cache.digest(key) or key}{suffix}"'
+    return path, content_type, etag
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluates an If-None-Match header against a strong ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == etag or tag == f"W/{etag}" for tag in candidates)
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        # The same URL serves PNG or WebP depending on Accept.
+        "Vary": "Accept",
+    }
+
+def placeholder_png(size: int = 64, shade: int = 224) -> bytes:
+    """A plain grey square PNG, encoded by hand so serving it never needs PIL."""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    # 8-bit greyscale; every scanline starts with filter type 0.
+    rows = (b"\x00" + bytes([shade]) * size) * size
+    header = struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+def ensure_placeholder(image_dir: str) -> str:
+    """Writes the placeholder image into image_dir once and returns its path."""
+    path = os.path.join(image_dir, PLACEHOLDER_NAME)
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=image_dir, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(placeholder_png())
+        os.replace(tmp_path, path)
+    return path
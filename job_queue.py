@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from admission import AdmissionController, Overloaded
+from telemetry import REGISTRY
+
+log = logging.getLogger(__name__)
+
+class JobQueueFull(Exception):
+    """Raised by JobQueue.submit when the queue already holds max_depth waiting jobs."""
+
+class JobQueue:
+    """
+    Runs pipeline topics as background jobs so web requests return straight away.
+
+    Jobs are recorded in SQLite (queued -> running -> done | failed) along with each
+    entity's result as it finishes, so clients can poll for partial results. A fixed
+    number of worker tasks on the pipeline's event loop take jobs off an in-memory
+    queue. Jobs that were queued or running when the process stopped are queued again
+    by start(), and finished jobs are pruned after retention_seconds.
+    """
+
+    def __init__(
+        self,
+        pipeline,
+        path: str,
+        workers: int = 4,
+        max_depth: int = 1000,
+        retention_seconds: int = 7 * 24 * 3600,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.pipeline = pipeline
+        # Jobs run as batch work: each waits for an admission slot behind interactive requests.
+        self.admission = admission
+        self.path = path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retention_seconds = retention_seconds
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, topic TEXT NOT NULL, status TEXT NOT NULL,"
+            " created REAL NOT NULL, started REAL, finished REAL,"
+            " partial TEXT NOT NULL DEFAULT '[]', results TEXT, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        self._lock = threading.Lock()
+
+        # Created by start() on the loop the workers run on.
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._finished: Dict[str, asyncio.Event] = {}
+
+    async def start(self):
+        """Prunes old jobs, re-queues the unfinished ones and starts the workers."""
+        self._queue = asyncio.Queue()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                (time.time() - self.retention_seconds,),
+            )
+            pending = self._db.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+            self._db.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'")
+        for (job_id,) in pending:
+            self._enqueue(job_id)
+        if pending:
+            log.info("🔁 Re-queued %d unfinished jobs.", len(pending))
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        REGISTRY.add_collector(self.collect_metrics)
+
+    async def stop(self):
+        """Cancels the workers. Jobs they were running stay 'running' and are re-queued on the next start."""
+        REGISTRY.remove_collector(self.collect_metrics)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, job_id: str):
+        self._finished[job_id] = asyncio.Event()
+        self._queue.put_nowait(job_id)
+
+    async def submit(self, topic: str) -> Dict:
+        """Records a new job and queues it. Raises JobQueueFull when max_depth jobs are already waiting."""
+        if self._queue.qsize() >= self.max_depth:
+            raise JobQueueFull(f"{self._queue.qsize()} jobs are already waiting")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, topic, status, created) VALUES (?, ?, 'queued', ?)",
+                (job_id, topic, time.time()),
+            )
+        self._enqueue(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Returns a job's status and its partial or final results, or None for an unknown id."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, topic, status, created, started, finished, partial, results, error"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "topic", "status", "created", "started", "finished"), row[:6]))
+        job["partial"] = json.loads(row[6])
+        job["results"] = json.loads(row[7]) if row[7] is not None else None
+        job["error"] = row[8]
+        if job["status"] == "queued" and self._queue is not None:
+            job["queue_depth"] = self._queue.qsize()
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """Long-polls a job: returns once it has finished or after timeout seconds, whichever comes first."""
+        finished = self._finished.get(job_id)
+        if finished is not None:
+            try:
+                await asyncio.wait_for(finished.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.get(job_id)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def collect_metrics(self):
+        yield "job_queue_depth", "gauge", "Jobs waiting for a worker.", [({}, self.depth())]
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                log.error("❌ Job %s failed: %s", job_id, e)
+                self._finish(job_id, "failed", None, str(e))
+            finally:
+                self._queue.task_done()
+
+    async def _admit(self) -> Optional[float]:
+        """Waits for a batch slot for as long as it takes; a job turned away tries again later."""
+        if self.admission is None:
+            return None
+        while True:
+            try:
+                return await self.admission.acquire("batch", timeout=None)
+            except Overloaded as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def _run(self, job_id: str):
+        with self._lock:
+            row = self._db.execute("SELECT topic FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        granted = await self._admit()
+        try:
+            await self._run_admitted(job_id, row[0])
+        finally:
+            if granted is not None:
+                self.admission.release(granted)
+
+    async def _run_admitted(self, job_id: str, topic: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', started = ?, partial = '[]' WHERE id = ?",
+                (time.time(), job_id),
+            )
+
+        partial: List[Dict] = []
+
+        def on_entity(result: Dict):
+            partial.append(result)
+            with self._lock:
+                self._db.execute("UPDATE jobs SET partial = ? WHERE id = ?", (json.dumps(partial), job_id))
+
+        log.info("--- ▶️ Running job %s: '%s' ---", job_id, topic)
+        results = await self.pipeline.run_pipeline(topic, on_entity=on_entity)
+        if results:
+            self._finish(job_id, "done", results, None)
+        else:
+            self._finish(job_id, "failed", results, "The pipeline produced no results.")
+
+    def _finish(self, job_id: str, status: str, results: Optional[List[Dict]], error: Optional[str]):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, results = ?, error = ? WHERE id = ?",
+                (status, time.time(), json.dumps(results) if results is not None else None, error, job_id),
+            )
+        finished = self._finished.pop(job_id, None)
+        if finished is not None:
+            finished.set()
+
+def test_job_queue():
+    """
+    Runs jobs through a stub pipeline and checks partial results, the depth limit and
+    that a job interrupted by a restart is picked up again.
+    """
+    import tempfile
+
+    class StubPipeline:
+        async def run_pipeline(self, topic, on_entity=None):
+            results = []
+            for entity in topic.split():
+                await asyncio.sleep(0.05)
+                result = {"entity": entity, "image_path": f"{entity}.png"}
+                results.append(result)
+                if on_entity:
+                    on_entity(dict(result))
+            return results
+
+    print("\n--- Running JobQueue Test (with a stub pipeline) ---")
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+
+    async def first_run():
+        queue = JobQueue(StubPipeline(), path, workers=1, max_depth=2)
+        await queue.start()
+        first = await queue.submit("sun moon earth")
+        await asyncio.sleep(0.01)  # The worker picks it up, so it no longer counts as waiting.
+        await queue.submit("volcano")
+        await queue.submit("ocean")
+        try:
+            await queue.submit("tides")
+            full = False
+        except JobQueueFull:
+            full = True
+        await asyncio.sleep(0.08)
+        running = queue.get(first["id"])
+        # Stop mid-run, as a restart would.
+        await queue.stop()
+        return first["id"], full, running
+
+    async def second_run(job_id):
+        queue = JobQueue(StubPipeline(), path, workers=2)
+        await queue.start()
+        job = await queue.wait(job_id, timeout=5)
+        await queue.stop()
+        return job
+
+    job_id, full, running = asyncio.run(first_run())
+    job = asyncio.run(second_run(job_id))
+    print(f"While running: {running['status']} with {len(running['partial'])} partial; after restart: {job['status']}")
+
+    ok = (
+        full
+        and running["status"] == "running" and len(running["partial"]) == 1
+        and job["status"] == "done" and [r["entity"] for r in job["results"]] == ["sun", "moon", "earth"]
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+
+if __name__ == "__main__":
+    test_job_queue()
@@ -0,0 +1,113 @@
+import json
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from clients import lazy_cerebras_client
+from rate_governor import RateGovernor
+from completion_cache import CompletionCache
+from model_routing import ModelRouter
+from telemetry import span
+
+if TYPE_CHECKING:
+    from cerebras.cloud.sdk import Cerebras
+
+log = logging.getLogger(__name__)
+
+class LessonPlanner:
+    """
+    Produces a whole lesson in one structured-JSON completion: the entities for a topic,
+    an image prompt for each and a child-level explanation for each. This replaces the
+    extract -> enrich -> explain round trips of the staged pipeline.
+    """
+
+    MAX_ENTITIES = 3
+
+    def __init__(
+        self,
+        client: Optional["Cerebras"] = None,
+        cache: Optional[CompletionCache] = None,
+        governor: Optional[RateGovernor] = None,
+        router: Optional[ModelRouter] = None,
+    ):
+        """
+        Initialize the LessonPlanner with the Cerebras client.
+        The default client is built on the first call and reads CEREBRAS_API_KEY from the environment.
+        """
+        self.client = client or lazy_cerebras_client()
+        self.cache = cache
+        self.governor = governor
+        self.router = router or ModelRouter()
+
+    def plan_lesson(self, topic: str) -> Optional[List[Dict[str, str]]]:
+        """
+        Returns a list of {"entity", "prompt", "explanation"} dicts, or None when the model's
+        output can't be parsed or doesn't match the schema (callers fall back to the staged path).
+        """
+        prompt = f"""
+        You are planning a short visual lesson for a child who asked the question below.
+
+        1. Identify the single most important physical subject (a character, object, or place).
+           Do NOT return abstract ideas like "information", "explanation", or "color".
+        2. Write an image prompt for it that starts with "a high-quality, detailed photograph of..."
+           and adds 1-2 key descriptive details. Do NOT use words like "dramatic", "8k", "hyperdetailed".
+        3. Write a simple, one-paragraph explanation of what it is, for a child.
+           Do not add any commentary about your own response.
+
+        Return ONLY a valid JSON object of this form:
+        {{"entities": [{{"name": "...", "image_prompt": "...", "explanation": "..."}}]}}
+
+        User's question or topic: "{topic}"
+        """
+        with span("lesson_plan") as attrs:
+            try:
+                response_text = self.router.complete(
+                    self.client, "lesson_plan", prompt, cache=self.cache, governor=self.governor,
+                    validate=lambda text: self.parse_plan(text) is not None,
+                )
+            except Exception as e:
+                log.error("❌ Cerebras API error planning lesson: %s", e)
+                attrs["error"] = str(e)
+                return None
+
+            plan = self.parse_plan(response_text)
+            if plan is None:
+                log.error("❌ Lesson plan did not match the expected schema: %r", response_text[:200])
+                attrs["error"] = "schema"
+            return plan
+
+    @classmethod
+    def parse_plan(cls, response_text: str) -> Optional[List[Dict[str, str]]]:
+        """Salvages the JSON object from the model output and validates it against the schema."""
+        json_match = response_text[response_text.find('{'):response_text.rfind('}')+1]
+        try:
+            content = json.loads(json_match)
+        except (json.JSONDecodeError, IndexError):
+            return None
+
+        entities = content.get("entities") if isinstance(content, dict) else None
+        if not isinstance(entities, list) or not 1 <= len(entities) <= cls.MAX_ENTITIES:
+            return None
+
+        plan = []
+        for item in entities:
+            if not isinstance(item, dict):
+                return None
+            fields = [item.get("name"), item.get("image_prompt"), item.get("explanation")]
+            if not all(isinstance(field, str) and field.strip() for field in fields):
+                return None
+            plan.append({
+                "entity": fields[0].strip(),
+                "prompt": fields[1].strip(),
+                "explanation": fields[2].strip(),
+            })
+        return plan
+
+if __name__ == "__main__":
+    # Load environment variables for the standalone test block
+    from dotenv import load_dotenv
+    load_dotenv()
+    print("\n--- Running LessonPlanner Standalone Test (with Cerebras) ---")
+    planner = LessonPlanner()
+    lesson = planner.plan_lesson("Which is the longest river in India?")
+    print(json.dumps(lesson, indent=2))
+    print("\n✅ Test successful!" if lesson else "\n❌ Test failed.")
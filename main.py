@@ -1,43 +1,168 @@
 import os 
-import asyncio
+import json
+import time
+import logging
+import threading
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
+from event_loop_thread import EventLoopThread
+from admission import AdmissionController, Overloaded
+from job_queue import JobQueue, JobQueueFull
+from prefetcher import Prefetcher
+from image_delivery import cache_headers, etag_matches, select_variant
+from response_cache import response_headers
+from telemetry import HTTP_IN_FLIGHT, HTTP_SECONDS, REGISTRY, configure_logging, trace
 
 # --- INITIAL SETUP ---
 load_dotenv()
+configure_logging()
+log = logging.getLogger(__name__)
 app = Flask(__name__)
 
 # This is the key fix for the connection error
 CORS(app)
 
 # --- CONFIGURE APIs and PIPELINE ---
+# The largest deck /generate/batch accepts in one request.
+MAX_BATCH_TOPICS = int(os.getenv("PIPELINE_MAX_BATCH_TOPICS", "500"))
+# Background workers for POST /jobs, and how many jobs may wait for one.
+JOB_WORKERS = int(os.getenv("PIPELINE_JOB_WORKERS", "8"))
+JOB_QUEUE_DEPTH = int(os.getenv("PIPELINE_JOB_QUEUE_DEPTH", "1000"))
+# The longest GET /jobs/<id>?wait= long-poll, in seconds.
+MAX_JOB_WAIT = 60
+# Related entities prepared at once in the background after /generate (0 turns prefetching off).
+PREFETCH_CONCURRENCY = int(os.getenv("PIPELINE_PREFETCH_CONCURRENCY", "2"))
+# Default latency budget for /generate in seconds (unset: none); a request's "budget" overrides it.
+LATENCY_BUDGET = float(os.getenv("PIPELINE_LATENCY_BUDGET", "0")) or None
+# Pipeline runs admitted at once, requests that may wait for one, and for how long (seconds);
+# beyond that requests are answered 503 with Retry-After straight away.
+MAX_CONCURRENT_RUNS = int(os.getenv("PIPELINE_MAX_CONCURRENT_RUNS", "32"))
+ADMISSION_QUEUE = int(os.getenv("PIPELINE_ADMISSION_QUEUE", "64"))
+ADMISSION_WAIT = float(os.getenv("PIPELINE_ADMISSION_WAIT", "10"))
+job_queue = None
+prefetcher = None
 pipeline = None
-try:
-    print("🚀 Initializing backend server...")
-    
-    # We now import the pipeline class and initialize it directly
-    from EducationalAnimationPipeline import EducationalAnimationPipeline
-    pipeline = EducationalAnimationPipeline()
-    
-    print("✅ Backend initialized successfully.")
-except Exception as e:
-    print(f"❌ CRITICAL ERROR during initialization: {e}")
+# Why the last initialization attempt failed; GET /ready retries it.
+init_error = None
+init_lock = threading.Lock()
+# One long-lived event loop shared by every request, instead of asyncio.run per request.
+loop_thread = EventLoopThread()
+# Interactive requests are admitted before batches and jobs, and those before prefetches.
+admission = AdmissionController(MAX_CONCURRENT_RUNS, ADMISSION_QUEUE, ADMISSION_WAIT)
+
+def init_backend():
+    """
+    Builds the pipeline and starts the job queue. Clients are built lazily, so this is
+    fast and rarely fails; when it does, GET /ready tries again instead of the process
+    staying broken. The Cerebras client and topic index are then warmed in the background.
+    """
+    global pipeline, job_queue, prefetcher, init_error
+    with init_lock:
+        if pipeline is not None:
+            return
+        new_pipeline = None
+        try:
+            log.info("🚀 Initializing backend server...")
+            from EducationalAnimationPipeline import EducationalAnimationPipeline
+            new_pipeline = EducationalAnimationPipeline(
+                fused=os.getenv("PIPELINE_FUSED", "").lower() in ("1", "true", "yes"),
+                llm_concurrency=int(os.getenv("PIPELINE_LLM_CONCURRENCY", "0")) or None,
+                image_concurrency=int(os.getenv("PIPELINE_IMAGE_CONCURRENCY", "0")) or None,
+            )
+            new_job_queue = JobQueue(
+                new_pipeline,
+                os.path.join(new_pipeline.output_base_dir, "jobs.sqlite3"),
+                workers=JOB_WORKERS,
+                max_depth=JOB_QUEUE_DEPTH,
+                admission=admission,
+            )
+            loop_thread.run(new_job_queue.start())
+            prefetcher = Prefetcher(
+                new_pipeline, job_queue=new_job_queue, concurrency=PREFETCH_CONCURRENCY, admission=admission
+            )
+            pipeline, job_queue, init_error = new_pipeline, new_job_queue, None
+            log.info("✅ Backend initialized successfully.")
+        except Exception as e:
+            if new_pipeline is not None:
+                new_pipeline.close()
+            init_error = f"{type(e).__name__}: {e}"
+            log.critical("❌ CRITICAL ERROR during initialization: %s", e)
+            return
+    threading.Thread(target=pipeline.warm_up, name="pipeline-warm-up", daemon=True).start()
+
+init_backend()
+
+# --- REQUEST METRICS ---
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request(response):
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe(
+            time.perf_counter() - g.request_start, route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    if g.pop("request_start", None) is not None:
+        HTTP_IN_FLIGHT.dec()
 
 # --- API ENDPOINTS ---
 @app.route('/pipeline_outputs/generated_images/<path:filename>')
 def serve_image(filename):
-    """Serves generated images to the frontend."""
-    # This line now works because 'os' is imported
+    """
+    Serves generated images to the frontend, as WebP (or a ?w= thumbnail) when the client
+    accepts it, with immutable caching headers and If-None-Match revalidation.
+    """
+    # Cached images are sharded into subdirectories; the frontend only knows the file name.
+    variant = None
+    if pipeline is not None:
+        variant = select_variant(
+            pipeline.image_cache, filename, request.headers.get("Accept", ""), request.args.get("w", type=int)
+        )
+    if variant:
+        path, content_type, etag = variant
+        headers = cache_headers(etag)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status=304, headers=headers)
+        response = send_file(os.path.abspath(path), mimetype=content_type, etag=False, conditional=False)
+        response.headers.update(headers)
+        return response
+    # Images written before the content-addressed cache still live in the flat directory.
+    if not filename.endswith('.png'):
+        return jsonify({"error": "Not found"}), 404
     return send_from_directory(os.path.join('pipeline_outputs', 'generated_images'), filename)
 
+def overloaded_response(error: Overloaded):
+    """503 with Retry-After for a request turned away by admission control."""
+    return jsonify({"error": f"Server is busy: {error}"}), 503, error.headers()
+
+def admitted_stream(body, granted: float) -> Response:
+    """An NDJSON response that holds its admission slot until it is closed, even if never read."""
+    response = Response(body, mimetype="application/x-ndjson")
+    response.call_on_close(lambda: loop_thread.loop.call_soon_threadsafe(admission.release, granted))
+    return response
+
+def cached_json_response(body: bytes, etag: str):
+    """A JSON body with its ETag, or 304 when the client already has it (If-None-Match)."""
+    headers = response_headers(etag)
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
 @app.route("/generate", methods=["POST", "OPTIONS"])
 def generate_animation_endpoint():
     """Main endpoint that the frontend calls to start the pipeline."""
     if request.method == "OPTIONS":
         return jsonify(success=True)
 
-    print("\n--- ✅ POST Request received from frontend ---")
+    log.debug("--- ✅ POST Request received from frontend ---")
     if pipeline is None:
         return jsonify({"error": "Pipeline not initialized due to a server startup error."}), 500
         
@@ -45,17 +170,152 @@ def generate_animation_endpoint():
     topic = data.get("topic")
     if not topic:
         return jsonify({"error": "No topic provided"}), 400
+    budget = data.get("budget", LATENCY_BUDGET)
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget <= 0):
+        return jsonify({"error": "budget must be a positive number of seconds"}), 400
+
+    # Repeated topics are answered from the response cache without running the pipeline.
+    cached = pipeline.response_cache.get(topic)
+    if cached:
+        log.info("✅ Response cache hit for '%s'", topic)
+        return cached_json_response(*cached)
 
-    print(f"Processing topic: '{topic}'")
+    log.info("Processing topic: '%s'", topic)
     try:
-        results = asyncio.run(pipeline.run_pipeline(topic))
-        print("✅ Pipeline finished. Sending results back.")
-        return jsonify(results)
+        # ?trace=1 logs this request's spans; TRACE_REQUESTS=1 logs them for every request.
+        with trace("generate", enabled=True if request.args.get("trace") else None, topic=topic):
+            results = loop_thread.run(
+                admission.run("interactive", lambda: pipeline.run_pipeline(topic, budget=budget))
+            )
+        # Follow-up entities are prepared in the background while the response goes out.
+        loop_thread.loop.call_soon_threadsafe(prefetcher.served, topic, results)
+        log.info("✅ Pipeline finished. Sending results back.")
+        return cached_json_response(*pipeline.response_cache.put(topic, results))
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
-        print(f"❌ Error in pipeline: {e}")
+        log.error("❌ Error in pipeline: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/generate/stream", methods=["POST"])
+def generate_stream_endpoint():
+    """
+    Streaming variant of /generate. Responds with newline-delimited JSON events:
+    the entities, explanation tokens, each image as it lands and a final "result" event.
+    """
+    if pipeline is None:
+        return jsonify({"error": "Pipeline not initialized due to a server startup error."}), 500
+
+    data = request.get_json()
+    topic = data.get("topic")
+    if not topic:
+        return jsonify({"error": "No topic provided"}), 400
+
+    try:
+        granted = loop_thread.run(admission.acquire("interactive"))
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    def ndjson():
+        for event in loop_thread.iterate(pipeline.stream_pipeline(topic)):
+            yield json.dumps(event) + "\n"
+
+    return admitted_stream(ndjson(), granted)
+
+@app.route("/generate/batch", methods=["POST"])
+def generate_batch_endpoint():
+    """
+    Runs a whole deck of topics in one request. Body: {"topics": [...], "stream": false}.
+    Returns {topic: results} once everything is done, or with "stream": true, one
+    newline-delimited JSON {"event": "topic", "topic", "results"} line per topic as it completes.
+    """
+    if pipeline is None:
+        return jsonify({"error": "Pipeline not initialized due to a server startup error."}), 500
+
+    data = request.get_json()
+    topics = data.get("topics")
+    if not isinstance(topics, list) or not topics or not all(isinstance(t, str) and t.strip() for t in topics):
+        return jsonify({"error": "No topics provided"}), 400
+    if len(topics) > MAX_BATCH_TOPICS:
+        return jsonify({"error": f"At most {MAX_BATCH_TOPICS} topics per batch"}), 400
+
+    try:
+        if not data.get("stream"):
+            return jsonify(loop_thread.run(admission.run("batch", lambda: pipeline.run_batch(topics))))
+        granted = loop_thread.run(admission.acquire("batch"))
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    def ndjson():
+        for item in loop_thread.iterate(pipeline.stream_batch(topics)):
+            yield json.dumps({"event": "topic", **item}) + "\n"
+
+    return admitted_stream(ndjson(), granted)
+
+@app.route("/jobs", methods=["POST"])
+def submit_job_endpoint():
+    """
+    Enqueues a topic as a background job and returns its id straight away (202).
+    Responds 503 with Retry-After when the job queue is full.
+    """
+    if job_queue is None:
+        return jsonify({"error": "Pipeline not initialized due to a server startup error."}), 500
+
+    data = request.get_json()
+    topic = data.get("topic")
+    if not topic:
+        return jsonify({"error": "No topic provided"}), 400
+
+    try:
+        job = loop_thread.run(job_queue.submit(topic))
+    except JobQueueFull as e:
+        return jsonify({"error": f"Job queue is full: {e}"}), 503, {"Retry-After": "5"}
+    return jsonify(job), 202, {"Location": f"/jobs/{job['id']}"}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status_endpoint(job_id):
+    """
+    Returns a job's status with its partial per-entity results, or its final results once done.
+    With ?wait=<seconds> (at most MAX_JOB_WAIT), waits for the job to finish before answering.
+    """
+    if job_queue is None:
+        return jsonify({"error": "Pipeline not initialized due to a server startup error."}), 500
+
+    wait = min(request.args.get("wait", 0, type=float), MAX_JOB_WAIT)
+    job = loop_thread.run(job_queue.wait(job_id, wait)) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route("/stats", methods=["GET"])
+def stats_endpoint():
+    """Cache, transport, rate governor and admission counters (queue depth, wait time, current window)."""
+    if pipeline is None:
+        return jsonify({"error": "Pipeline not initialized due to a server startup error."}), 500
+    stats = pipeline.stats()
+    if job_queue is not None:
+        stats["job_queue"] = {"queued": job_queue.depth()}
+    if prefetcher is not None:
+        stats["prefetch"] = prefetcher.stats()
+    stats["admission"] = admission.stats()
+    return jsonify(stats)
+
+@app.route("/ready", methods=["GET"])
+def ready_endpoint():
+    """Readiness probe: 200 once every component is usable, 503 (with per-component status) until then."""
+    if pipeline is None:
+        init_backend()
+    if pipeline is None:
+        return jsonify({"ready": False, "components": {"pipeline": f"error: {init_error}"}}), 503
+    readiness = pipeline.readiness()
+    return jsonify(readiness), 200 if readiness["ready"] else 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Stage latencies, cache hit ratios, upstream outcomes and in-flight gauges in Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 # --- RUN THE SERVER ---
 if __name__ == "__main__":
-    print("🚀 Starting Flask server on http://localhost:5000")
+    log.info("🚀 Starting Flask server on http://localhost:5000")
     app.run(host="0.0.0.0", port=5000)
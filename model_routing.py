@@ -0,0 +1,213 @@
+import os
+import json
+import math
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from rate_governor import RateLimited
+from completion_cache import CompletionCache, create_completion
+from telemetry import REGISTRY, Counter
+
+log = logging.getLogger(__name__)
+
+LARGE_MODEL = "qwen-3-235b-a22b-instruct-2507"
+SMALL_MODEL = "llama3.1-8b"
+
+MODEL_FALLBACKS = REGISTRY.register(Counter(
+    "model_fallbacks_total", "Completions retried on the fallback model, by stage and reason."))
+
+class ModelRouter:
+    """
+    Picks the Cerebras model and max_tokens for each completion stage (extraction,
+    enrichment, explanation, exploration, entities, lesson_plan).
+
+    Lightweight stages (a one-word subject, a one-line image prompt, three JSON entities)
+    go to a small, low-latency model with a fallback to the large one: when the small
+    model's answer fails the stage's validation, or its call fails, the same prompt is
+    asked of the fallback model. Long-form stages stay on the large model.
+
+    Routes come from a named profile ("routed" by default; "large" for every stage on the
+    large model with the same caps; "baseline" for the large model without caps, as every
+    stage ran before routing), overridden per stage by the routes argument or the MODEL_ROUTES
+    environment variable (a JSON object, e.g. {"explanation": {"model": "llama3.1-8b",
+    "max_tokens": 300}}). A route has a model, max_tokens (None: no cap), an optional
+    fallback model and, for stages sized by a word count, tokens_per_word.
+    """
+
+    PROFILES = {
+        "routed": {
+            "extraction": {"model": SMALL_MODEL, "max_tokens": 16, "fallback": LARGE_MODEL},
+            "enrichment": {"model": SMALL_MODEL, "max_tokens": 80, "fallback": LARGE_MODEL},
+            "entities": {"model": SMALL_MODEL, "max_tokens": 400, "fallback": LARGE_MODEL},
+            "explanation": {"model": LARGE_MODEL, "max_tokens": 400},
+            "exploration": {"model": LARGE_MODEL, "max_tokens": 2000, "tokens_per_word": 2.0},
+            "lesson_plan": {"model": LARGE_MODEL, "max_tokens": 1500},
+        },
+        "large": {
+            "extraction": {"model": LARGE_MODEL, "max_tokens": 16},
+            "enrichment": {"model": LARGE_MODEL, "max_tokens": 80},
+            "entities": {"model": LARGE_MODEL, "max_tokens": 400},
+            "explanation": {"model": LARGE_MODEL, "max_tokens": 400},
+            "exploration": {"model": LARGE_MODEL, "max_tokens": 2000, "tokens_per_word": 2.0},
+            "lesson_plan": {"model": LARGE_MODEL, "max_tokens": 1500},
+        },
+        # Every stage falls through to DEFAULT_ROUTE.
+        "baseline": {},
+    }
+    # Stages missing from a profile and its overrides.
+    DEFAULT_ROUTE = {"model": LARGE_MODEL, "max_tokens": None}
+
+    def __init__(self, routes: Optional[Dict[str, Dict]] = None, profile: Optional[str] = None):
+        self.profile = profile or os.getenv("MODEL_ROUTING_PROFILE", "routed")
+        if self.profile not in self.PROFILES:
+            raise ValueError(f"Unknown model routing profile '{self.profile}' (expected one of {', '.join(self.PROFILES)})")
+        if routes is None:
+            routes = json.loads(os.getenv("MODEL_ROUTES", "{}") or "{}")
+        self.routes = {stage: dict(route) for stage, route in self.PROFILES[self.profile].items()}
+        for stage, route in routes.items():
+            self.routes[stage] = dict(self.routes.get(stage, self.DEFAULT_ROUTE), **route)
+        self._lock = threading.Lock()
+        # stage -> {"calls", "fallbacks"}
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def route(self, stage: str) -> Dict:
+        return self.routes.get(stage, self.DEFAULT_ROUTE)
+
+    def model(self, stage: str) -> str:
+        return self.route(stage)["model"]
+
+    def params(self, stage: str, words: Optional[int] = None) -> Dict:
+        """
+        The completion parameters for a stage: its max_tokens cap, or for a stage sized by
+        a word count, enough tokens for that many words (never more than max_tokens).
+        """
+        route = self.route(stage)
+        max_tokens = route.get("max_tokens")
+        if words is not None and route.get("tokens_per_word"):
+            sized = math.ceil(words * route["tokens_per_word"])
+            max_tokens = min(sized, max_tokens) if max_tokens else sized
+        return {"max_tokens": max_tokens} if max_tokens else {}
+
+    def complete(
+        self,
+        client,
+        stage: str,
+        prompt: str,
+        cache: Optional[CompletionCache] = None,
+        governor=None,
+        validate: Optional[Callable[[str], bool]] = None,
+        words: Optional[int] = None,
+    ) -> str:
+        """
+        Runs create_completion on the stage's model. With a fallback model, an answer that
+        fails validate (or a failed call) is asked again of the fallback, whose answer is
+        returned either way. Throttling is raised as is: the large model has no spare capacity.
+        A valid fallback answer is also cached under the stage model's key, so a repeat of the
+        prompt is a cache hit rather than another failed attempt on the stage model.
+        """
+        route = self.route(stage)
+        params = self.params(stage, words)
+        fallback = route.get("fallback")
+        self._count(stage, "calls")
+        try:
+            text = create_completion(
+                client, route["model"], prompt, stage=stage, cache=cache, governor=governor, validate=validate, **params
+            )
+            if fallback is None or validate is None or validate(text):
+                return text
+            reason = "invalid"
+            log.debug("%s on %s failed validation: %r; asking %s.", stage, route["model"], text[:80], fallback)
+        except RateLimited:
+            raise
+        except Exception as e:
+            if fallback is None:
+                raise
+            reason = "error"
+            log.warning("⚠️ %s on %s failed (%s); asking %s.", stage, route["model"], e, fallback)
+
+        self._count(stage, "fallbacks")
+        MODEL_FALLBACKS.inc(stage=stage, reason=reason)
+        text = create_completion(
+            client, fallback, prompt, stage=stage, cache=cache, governor=governor, validate=validate, **params
+        )
+        if cache is not None and not cache.bypass and (validate is None or validate(text)):
+            cache.put(CompletionCache.make_key(route["model"], prompt, params), stage, text)
+        return text
+
+    def _count(self, stage: str, name: str):
+        with self._lock:
+            counts = self._counts.setdefault(stage, {"calls": 0, "fallbacks": 0})
+            counts[name] += 1
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per routed or called stage: the model, max_tokens, and how many calls fell back."""
+        with self._lock:
+            counts = {stage: dict(c) for stage, c in self._counts.items()}
+        return {
+            stage: dict(
+                counts.get(stage, {"calls": 0, "fallbacks": 0}),
+                model=self.route(stage)["model"],
+                max_tokens=self.route(stage).get("max_tokens"),
+                fallback=self.route(stage).get("fallback"),
+            )
+            for stage in sorted(set(self.routes) | set(counts))
+        }
+
+def test_model_router():
+    """
+    Checks profile and override resolution, max_tokens sizing from a word count, that an
+    answer failing validation on the small model is retried on the large one, and that a
+    repeat of that prompt is answered from the cache without asking the small model again.
+    """
+    import tempfile
+    print("\n--- Running ModelRouter Test (with a local stub client) ---")
+
+    class StubClient:
+        """Answers like the stages' models would; the small model rambles on extraction."""
+
+        def __init__(self):
+            self.calls = []
+            self.chat = self
+            self.completions = self
+
+        def create(self, model, messages, stream=False, **params):
+            self.calls.append((model, params.get("max_tokens")))
+            text = "Well, the main subject here is probably the Eiffel Tower" if model == SMALL_MODEL else "Eiffel Tower"
+            message = type("Message", (), {"content": text})
+            return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+    failures = []
+    router = ModelRouter(routes={"explanation": {"max_tokens": 300}, "quiz": {"max_tokens": 50}}, profile="routed")
+    if router.params("explanation") != {"max_tokens": 300} or router.model("explanation") != LARGE_MODEL:
+        failures.append(f"override: {router.route('explanation')}")
+    if router.route("quiz") != {"model": LARGE_MODEL, "max_tokens": 50}:
+        failures.append(f"new stage: {router.route('quiz')}")
+    if router.params("exploration", words=250) != {"max_tokens": 500} or router.params("exploration", words=5000) != {"max_tokens": 2000}:
+        failures.append(f"word sizing: {router.params('exploration', words=250)}, {router.params('exploration', words=5000)}")
+
+    client = StubClient()
+    text = router.complete(client, "extraction", "Tell me about the Eiffel Tower.", validate=lambda t: len(t.split()) <= 6)
+    if text != "Eiffel Tower" or client.calls != [(SMALL_MODEL, 16), (LARGE_MODEL, 16)]:
+        failures.append(f"fallback: {text!r}, calls {client.calls}")
+    if router.stats()["extraction"]["fallbacks"] != 1:
+        failures.append(f"stats: {router.stats()['extraction']}")
+
+    client = StubClient()
+    cache = CompletionCache(os.path.join(tempfile.mkdtemp(prefix="routing-"), "completions.sqlite3"))
+    for _ in range(3):
+        text = router.complete(client, "extraction", "Tell me about Paris.", cache=cache, validate=lambda t: len(t.split()) <= 6)
+    if text != "Eiffel Tower" or client.calls != [(SMALL_MODEL, 16), (LARGE_MODEL, 16)]:
+        failures.append(f"repeats paid for the fallback again: {text!r}, calls {client.calls}")
+
+    large = ModelRouter(routes={}, profile="large")
+    if any(route["model"] != LARGE_MODEL or route.get("fallback") for route in large.routes.values()):
+        failures.append("the large profile routes a stage elsewhere")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("\n✅ Test successful!" if not failures else "\n❌ Test failed.")
+    return not failures
+
+if __name__ == "__main__":
+    test_model_router()
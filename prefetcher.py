@@ -0,0 +1,305 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from admission import AdmissionController, Overloaded
+from telemetry import REGISTRY
+
+log = logging.getLogger(__name__)
+
+class Prefetcher:
+    """
+    Speculatively prepares the entities a student is likely to ask about next.
+
+    After a topic is served, served() asks the pipeline for related entities and runs
+    them through the pipeline in the background, so their prompts, explanations and
+    images are already cached when the follow-up question arrives. Prefetching is low
+    priority: at most `concurrency` entities are prepared at once, no more than
+    max_pending wait, and everything is dropped or cancelled while the rate governor
+    has calls queued or throttled, or while jobs or requests are waiting (in the job queue
+    or for admission). With an admission controller, each prefetch also needs a free
+    slot at the lowest priority, or it is dropped.
+
+    A served entity that had been prefetched counts as a hit, so hits over prefetched
+    entities shows whether the speculation pays off.
+    """
+
+    def __init__(
+        self,
+        pipeline,
+        job_queue=None,
+        concurrency: int = 2,
+        max_pending: int = 32,
+        check_interval: float = 0.1,
+        remember: int = 10000,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.pipeline = pipeline
+        self.job_queue = job_queue
+        self.admission = admission
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.check_interval = check_interval
+        self.remember = remember
+
+        # Created on first use so they belong to the loop the pipeline runs on.
+        self._limit: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._watcher: Optional[asyncio.Task] = None
+        # Entities prefetched (or being prefetched), oldest first, so hits can be counted.
+        self._prefetched: "OrderedDict[str, float]" = OrderedDict()
+        self._throttled = self._governor_throttled()
+
+        self.counts = {"scheduled": 0, "done": 0, "failed": 0, "cancelled": 0, "skipped": 0}
+        self.hits = 0
+        self.lookups = 0
+        REGISTRY.add_collector(self.collect_metrics)
+
+    @staticmethod
+    def _key(entity: str) -> str:
+        return " ".join(entity.lower().split())
+
+    def served(self, user_topic: str, results: List[Dict]):
+        """
+        Records which served entities were prefetched and starts prefetching the topic's
+        related entities. Must be called on the pipeline's event loop; returns at once.
+        """
+        for result in results:
+            if "entity" not in result:
+                continue
+            self.lookups += 1
+            if self._prefetched.pop(self._key(result["entity"]), None) is not None:
+                self.hits += 1
+        if self.concurrency <= 0 or not results or all("error" in result for result in results):
+            return
+        reason = self.under_pressure()
+        if reason or len(self._tasks) >= self.max_pending:
+            log.debug("Not prefetching for '%s': %s", user_topic, reason or "too much pending")
+            self.counts["skipped"] += 1
+            return
+        self._start(self._prefetch_topic(user_topic, [dict(result) for result in results]))
+
+    def under_pressure(self) -> Optional[str]:
+        """Why foreground work needs the capacity right now, or None when prefetching may run."""
+        if self.job_queue is not None and self.job_queue.depth() > 0:
+            return f"{self.job_queue.depth()} jobs waiting"
+        if self.admission is not None and self.admission.queued() > 0:
+            return f"{self.admission.queued()} requests waiting for admission"
+        stats = self.pipeline.rate_governor.stats()
+        for name, limit in list(stats.items()) + list(self.pipeline.rate_governor.provider_stats().items()):
+            if limit["queued"] > 0:
+                return f"{name} has {limit['queued']} calls queued"
+        throttled = self._governor_throttled(stats)
+        if throttled > self._throttled:
+            self._throttled = throttled
+            return "upstream throttling"
+        return None
+
+    def _governor_throttled(self, stats: Optional[Dict] = None) -> int:
+        stats = stats if stats is not None else self.pipeline.rate_governor.stats()
+        return sum(limit["throttled"] for limit in stats.values())
+
+    def _start(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.ensure_future(self._watch())
+        return task
+
+    async def _watch(self):
+        """Cancels every prefetch as soon as there is pressure; ends when nothing is pending."""
+        while self._tasks:
+            await asyncio.sleep(self.check_interval)
+            reason = self.under_pressure()
+            if reason and self._tasks:
+                log.info("⏸️ Cancelling %d prefetches: %s", len(self._tasks), reason)
+                self.cancel()
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def close(self):
+        """Stops exporting metrics. Call cancel() on the loop first to drop pending prefetches."""
+        REGISTRY.remove_collector(self.collect_metrics)
+
+    async def _prefetch_topic(self, user_topic: str, results: List[Dict]):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._limit:
+                entities = await self.pipeline.related_entities(user_topic, results)
+            entities = [entity for entity in entities if self._key(entity) not in self._prefetched]
+            log.debug("Prefetching %s after '%s'", entities, user_topic)
+            await asyncio.gather(*[self._prefetch_entity(entity) for entity in entities])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("⚠️ Finding related entities for '%s' failed: %s", user_topic, e)
+
+    async def _prefetch_entity(self, entity: str):
+        key = self._key(entity)
+        self._prefetched[key] = time.time()
+        self._prefetched.move_to_end(key)
+        while len(self._prefetched) > self.remember:
+            self._prefetched.popitem(last=False)
+        self.counts["scheduled"] += 1
+        try:
+            async with self._limit:
+                if self.admission is None:
+                    result = await self.pipeline.prefetch_entity(entity)
+                else:
+                    async with self.admission.slot("prefetch", wait=False):
+                        result = await self.pipeline.prefetch_entity(entity)
+        except asyncio.CancelledError:
+            self._prefetched.pop(key, None)
+            self.counts["cancelled"] += 1
+            raise
+        except Overloaded as e:
+            log.debug("Not prefetching '%s': %s", entity, e)
+            self._prefetched.pop(key, None)
+            self.counts["cancelled"] += 1
+            return
+        if "error" in result:
+            self._prefetched.pop(key, None)
+            self.counts["failed"] += 1
+        else:
+            self.counts["done"] += 1
+
+    def stats(self) -> Dict:
+        return dict(
+            self.counts,
+            in_flight=len(self._tasks),
+            hits=self.hits,
+            lookups=self.lookups,
+            # Share of prefetched entities that were asked for afterwards.
+            hit_rate=round(self.hits / self.counts["done"], 3) if self.counts["done"] else 0.0,
+        )
+
+    def collect_metrics(self):
+        stats = self.stats()
+        yield "prefetch_entities_total", "counter", "Prefetched entities, by outcome.", [
+            ({"outcome": outcome}, stats[outcome]) for outcome in ("scheduled", "done", "failed", "cancelled")
+        ]
+        yield "prefetch_skipped_total", "counter", "Served topics whose prefetch was skipped under pressure.", [
+            ({}, stats["skipped"])
+        ]
+        yield "prefetch_hits_total", "counter", "Served entities that had been prefetched.", [({}, stats["hits"])]
+        yield "prefetch_lookups_total", "counter", "Served entities checked against the prefetched ones.", [
+            ({}, stats["lookups"])
+        ]
+        yield "prefetch_hit_ratio", "gauge", "Prefetched entities that were asked for afterwards.", [
+            ({}, stats["hit_rate"])
+        ]
+        yield "prefetch_in_flight", "gauge", "Topics whose related entities are being prefetched.", [
+            ({}, stats["in_flight"])
+        ]
+
+def test_prefetcher():
+    """
+    Serves a topic through a pipeline with local stubs and checks that its related entities
+    are prefetched, that a follow-up about one of them is a fast hit, and that prefetching
+    is skipped while jobs are waiting. The pipeline's real RateGovernor has already admitted
+    calls to both providers, so served() runs against per-model and provider-wide limits.
+    """
+    import os
+    import tempfile
+    from EducationalAnimationPipeline import EducationalAnimationPipeline
+    delay = 0.3
+    related = {"volcanoes": ["Magma", "Lava", "Crater"]}
+
+    class StubExtractor:
+        def extract_concepts(self, text):
+            time.sleep(0.01)
+            return [text.split()[-1].title()]
+
+    # Each stub is slow the first time it sees an entity, like a call that isn't cached yet.
+    class StubEnricher:
+        def __init__(self):
+            self.enriched = set()
+
+        def enrich_prompt(self, entity):
+            if entity not in self.enriched:
+                time.sleep(delay)
+                self.enriched.add(entity)
+            return f"a high-quality photograph of {entity}"
+
+    class StubExplorer:
+        def __init__(self):
+            self.explained = set()
+
+        def generate_with_focus(self, interest, focus_aspect):
+            if interest not in self.explained:
+                time.sleep(delay)
+                self.explained.add(interest)
+            return f"{interest} is fascinating."
+
+        def potential_entities(self, text, interest):
+            return [{"name": name} for name in related.get(interest, [])]
+
+    class StubImageGenerator:
+        def __init__(self):
+            self.drawn = set()
+
+        def generate_images(self, entity, prompt, seed, num_images, output_dir):
+            if prompt not in self.drawn:
+                time.sleep(delay)
+                self.drawn.add(prompt)
+            return [os.path.join(output_dir, f"{entity.lower()}.png")]
+
+    class StubJobQueue:
+        waiting = 0
+
+        def depth(self):
+            return self.waiting
+
+    print("\n--- Running Prefetcher Test (with local stubs) ---")
+    pipeline = EducationalAnimationPipeline(
+        output_base_dir=tempfile.mkdtemp(prefix="prefetch-"),
+        use_topic_index=False,
+        interest_explorer=StubExplorer(),
+        entity_extractor=StubExtractor(),
+        prompt_enricher=StubEnricher(),
+        image_generator=StubImageGenerator(),
+    )
+    jobs = StubJobQueue()
+    prefetcher = Prefetcher(pipeline, job_queue=jobs, concurrency=2)
+
+    async def serve(topic: str):
+        start = time.perf_counter()
+        results = await pipeline.run_pipeline(topic)
+        prefetcher.served(topic, results)
+        return results, time.perf_counter() - start
+
+    async def run():
+        # The stubs never call out, so take one slot per provider the way the clients would.
+        for provider, model in (("cerebras", "llama-4-scout-17b-16e-instruct"), ("stability", "sd3.5-large")):
+            pipeline.rate_governor.call(provider, model, lambda: None)
+        await serve("volcanoes")
+        while prefetcher.stats()["in_flight"]:
+            await asyncio.sleep(0.05)
+        _, follow_up = await serve("what is magma")
+        jobs.waiting = 3
+        await serve("more about lava")
+        return follow_up
+
+    try:
+        follow_up = asyncio.run(run())
+    finally:
+        prefetcher.close()
+        pipeline.close()
+
+    stats = prefetcher.stats()
+    print(f"Follow-up took {follow_up:.2f}s (cold entity {2 * delay:.2f}s), stats: {stats}")
+    ok = (
+        stats["done"] == 3 and stats["hits"] == 2 and stats["skipped"] == 1
+        and follow_up < delay
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+    return ok
+
+if __name__ == "__main__":
+    test_prefetcher()
@@ -0,0 +1,413 @@
+import os
+import json
+import time
+import random
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+class RateLimited(Exception):
+    """
+    Raised when a provider keeps throttling a call (429/5xx) after every attempt,
+    or when a caller waited longer than max_wait for its turn.
+    """
+
+class _Permit:
+    """A granted slot. The caller reports how the call went through observe()."""
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+
+    def observe(self, status: Optional[int], retry_after: Optional[float] = None):
+        self.status = status
+        self.retry_after = retry_after
+
+class ProviderLimit:
+    """
+    Limits calls to one provider model with a token bucket (rate, burst) and an AIMD
+    concurrency window. The window grows by about one slot per window's worth of
+    successes and halves on a 429/5xx (at most once per decrease_interval, so one
+    burst of errors counts once). Waiting callers are admitted strictly in arrival order.
+    """
+
+    THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        initial_window: int = 4,
+        min_window: int = 1,
+        max_window: int = 64,
+        decrease_interval: float = 1.0,
+        max_wait: float = 120.0,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease_interval = decrease_interval
+        self.max_wait = max_wait
+
+        self.window = float(initial_window)
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._in_flight = 0
+        self._waiters = collections.deque()
+        self._cond = threading.Condition()
+
+        self.admitted = 0
+        self.succeeded = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self):
+        """Blocks until this caller is first in line, a window slot is free and a token is available."""
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now - start > self.max_wait:
+                        self.timeouts += 1
+                        raise RateLimited(f"Waited more than {self.max_wait:.0f}s for a rate limit slot")
+                    delay = None
+                    if self._waiters[0] is ticket and self._in_flight < max(self.min_window, int(self.window)):
+                        self._refill(now)
+                        if now < self._paused_until:
+                            delay = self._paused_until - now
+                        elif self._tokens >= 1:
+                            self._tokens -= 1
+                            self._waiters.popleft()
+                            self._in_flight += 1
+                            self.admitted += 1
+                            waited = now - start
+                            self._wait_total += waited
+                            self._wait_max = max(self._wait_max, waited)
+                            # The next caller in line may be admissible too.
+                            self._cond.notify_all()
+                            return
+                        else:
+                            delay = (1 - self._tokens) / self.rate
+                    self._cond.wait(min(delay, self.max_wait) if delay is not None else self.max_wait)
+            except BaseException:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    self._cond.notify_all()
+                raise
+
+    def release(self, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """Frees the slot and adapts the window to the outcome (status None means no signal)."""
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if status in self.THROTTLE_STATUSES:
+                self.throttled += 1
+                if now - self._last_decrease >= self.decrease_interval:
+                    self.window = max(self.min_window, self.window / 2)
+                    self._last_decrease = now
+                if retry_after:
+                    # Everyone waits out the provider's Retry-After instead of retrying into it.
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif status is not None and status < 400:
+                self.succeeded += 1
+                self.window = min(self.max_window, self.window + 1 / self.window)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "queued": len(self._waiters),
+                "in_flight": self._in_flight,
+                "window": round(self.window, 2),
+                "rate": self.rate,
+                "tokens": round(self._tokens, 2),
+                "admitted": self.admitted,
+                "succeeded": self.succeeded,
+                "throttled": self.throttled,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(1000 * self._wait_total / self.admitted, 1) if self.admitted else 0.0,
+                "wait_max_ms": round(1000 * self._wait_max, 1),
+            }
+
+class TokenBucket:
+    """
+    A provider-wide token bucket (rate, burst) shared by all of a provider's models, so
+    models with their own ProviderLimit cannot together exceed the provider's rate.
+    Waiting callers are admitted strictly in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: int, max_wait: float = 120.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self._waiters = collections.deque()
+        self._cond = threading.Condition()
+
+        self.admitted = 0
+        self.timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self):
+        """Blocks until this caller is first in line and a token is available."""
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now - start > self.max_wait:
+                        self.timeouts += 1
+                        raise RateLimited(f"Waited more than {self.max_wait:.0f}s for a provider token")
+                    delay = self.max_wait
+                    if self._waiters[0] is ticket:
+                        self._refill(now)
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            self._waiters.popleft()
+                            self.admitted += 1
+                            waited = now - start
+                            self._wait_total += waited
+                            self._wait_max = max(self._wait_max, waited)
+                            self._cond.notify_all()
+                            return
+                        delay = (1 - self._tokens) / self.rate
+                    self._cond.wait(min(delay, self.max_wait))
+            except BaseException:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    self._cond.notify_all()
+                raise
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "queued": len(self._waiters),
+                "rate": self.rate,
+                "tokens": round(self._tokens, 2),
+                "admitted": self.admitted,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(1000 * self._wait_total / self.admitted, 1) if self.admitted else 0.0,
+                "wait_max_ms": round(1000 * self._wait_max, 1),
+            }
+
+class RateGovernor:
+    """
+    One ProviderLimit per provider and model, shared by every component that calls out,
+    plus one TokenBucket per provider that every model of that provider also draws from.
+
+    Limits come from DEFAULT_LIMITS, overridden per provider (or "provider:model") by the
+    limits argument or the RATE_GOVERNOR_LIMITS environment variable (a JSON object, e.g.
+    {"cerebras": {"rate": 5, "burst": 10}}). The provider entry's rate and burst also
+    size the provider-wide bucket.
+    """
+
+    # Stability documents 150 requests per 10 seconds; Cerebras limits depend on the account tier.
+    DEFAULT_LIMITS = {
+        "cerebras": {"rate": 8.0, "burst": 16, "initial_window": 8, "max_window": 64},
+        "stability": {"rate": 15.0, "burst": 15, "initial_window": 4, "max_window": 32},
+    }
+
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None, max_attempts: int = 4):
+        if limits is None:
+            limits = json.loads(os.getenv("RATE_GOVERNOR_LIMITS", "{}") or "{}")
+        self.limits = {name: dict(config) for name, config in self.DEFAULT_LIMITS.items()}
+        for name, config in limits.items():
+            self.limits[name] = dict(self.limits.get(name.split(":")[0], {}), **config)
+        self.max_attempts = max_attempts
+        self._providers: Dict[str, ProviderLimit] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def limit(self, provider: str, model: str = "default") -> ProviderLimit:
+        key = f"{provider}:{model}"
+        with self._lock:
+            if key not in self._providers:
+                config = self.limits.get(key) or self.limits.get(provider) or {"rate": 10.0, "burst": 10}
+                self._providers[key] = ProviderLimit(**config)
+            return self._providers[key]
+
+    def bucket(self, provider: str) -> TokenBucket:
+        with self._lock:
+            if provider not in self._buckets:
+                config = self.limits.get(provider) or {"rate": 10.0, "burst": 10}
+                self._buckets[provider] = TokenBucket(
+                    **{name: config[name] for name in ("rate", "burst", "max_wait") if name in config}
+                )
+            return self._buckets[provider]
+
+    @contextmanager
+    def slot(self, provider: str, model: str = "default") -> Iterator[_Permit]:
+        """
+        Holds one slot for the duration of a call. Report the HTTP status through
+        permit.observe(); an exception carrying a status_code is classified automatically.
+        """
+        limit = self.limit(provider, model)
+        limit.acquire()
+        try:
+            self.bucket(provider).acquire()
+        except BaseException:
+            limit.release()
+            raise
+        permit = _Permit()
+        try:
+            yield permit
+        except BaseException as e:
+            status = throttle_status(e)
+            limit.release(status, retry_after_of(e) if status else None)
+            raise
+        else:
+            limit.release(permit.status if permit.status is not None else 200, permit.retry_after)
+
+    def call(self, provider: str, model: str, func: Callable):
+        """
+        Runs func() inside a slot and, when the provider throttles it, queues it again
+        (behind everyone already waiting) up to max_attempts times before raising RateLimited.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                with self.slot(provider, model):
+                    return func()
+            except Exception as e:
+                if throttle_status(e) is None:
+                    raise
+                if attempt == self.max_attempts - 1:
+                    raise RateLimited(f"{provider} kept throttling {model}: {e}") from e
+                # A little jitter keeps callers that failed together from lining up together.
+                time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            providers = dict(self._providers)
+        return {key: limit.stats() for key, limit in providers.items()}
+
+    def provider_stats(self) -> Dict[str, Dict[str, float]]:
+        """Counters of the provider-wide buckets, keyed by provider."""
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {provider: bucket.stats() for provider, bucket in buckets.items()}
+
+def throttle_status(error: BaseException) -> Optional[int]:
+    """The status of an SDK/HTTP error if it means the provider is throttling or overloaded."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if status in ProviderLimit.THROTTLE_STATUSES else None
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After") or 0) or None
+    except (TypeError, ValueError):
+        return None
+
+def test_rate_governor():
+    """
+    Drives a simulated provider that throttles above 6 concurrent calls and checks that
+    the window settles near that ceiling, nothing is lost and callers are served in order.
+    """
+    ceiling = 6
+    state = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Throttled(Exception):
+        status_code = 429
+
+    def provider_call():
+        with lock:
+            state["active"] += 1
+            over = state["active"] > ceiling
+        try:
+            time.sleep(0.02)
+            if over:
+                raise Throttled("too many requests")
+            with lock:
+                state["peak"] = max(state["peak"], state["active"])
+            return True
+        finally:
+            with lock:
+                state["active"] -= 1
+
+    print("\n--- Running RateGovernor Test (with a simulated provider) ---")
+    governor = RateGovernor(
+        {"sim": {"rate": 500.0, "burst": 50, "initial_window": 2, "max_window": 32, "decrease_interval": 0.1}},
+        max_attempts=8,
+    )
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(governor.call("sim", "m", provider_call)))
+        for _ in range(40)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    stats = governor.stats()["sim:m"]
+    print(f"Wall time: {elapsed:.2f}s, stats: {stats}")
+
+    order = []
+    limit = ProviderLimit(rate=1000.0, burst=1, initial_window=1)
+    limit.acquire()
+    waiters = []
+    for i in range(5):
+        waiter = threading.Thread(target=lambda i=i: (limit.acquire(), order.append(i), limit.release(200)))
+        waiter.start()
+        waiters.append(waiter)
+        time.sleep(0.01)  # Make the arrival order deterministic.
+    limit.release(200)
+    for waiter in waiters:
+        waiter.join()
+    print(f"Admission order: {order}")
+
+    # Two models of one provider each get the provider's rate, but together stay within it.
+    shared = RateGovernor({"shared": {"rate": 50.0, "burst": 5, "initial_window": 32}})
+    calls = []
+    callers = [
+        threading.Thread(target=lambda model=model: calls.append(shared.call("shared", model, time.monotonic)))
+        for model in ("preview", "full") for _ in range(15)
+    ]
+    start = time.monotonic()
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    # 30 calls, 5 from the burst, the other 25 at 50/s: at least 0.5s however the models split them.
+    spread = max(calls) - start
+    print(f"Two models, 30 calls: {spread:.2f}s, provider bucket: {shared.provider_stats()['shared']}")
+
+    if (
+        len(results) == 40 and all(results) and stats["window"] <= 2 * ceiling and order == list(range(5))
+        and len(calls) == 30 and spread >= 0.45
+    ):
+        print("\n✅ Test successful!")
+    else:
+        print("\n❌ Test failed.")
+
+if __name__ == "__main__":
+    test_rate_governor()
@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from InterestExplorer import InterestExplorer
+
+# Cached responses can change (a topic is regenerated after its images were evicted),
+# so clients revalidate every time; a matching If-None-Match costs a 304 and no body.
+RESPONSE_CACHE_CONTROL = "no-cache"
+
+def response_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": RESPONSE_CACHE_CONTROL}
+
+class ResponseCache:
+    """
+    Caches whole /generate responses by normalized topic, so a repeated topic is answered
+    without running the pipeline (which would still call Cerebras for extraction, prompts
+    and explanations even when every image is on disk).
+
+    Responses are stored as the exact JSON body sent to the client, with a strong ETag
+    for If-None-Match revalidation, in SQLite (so they survive restarts) and in a small
+    in-memory LRU for the hottest topics. Entries expire after ttl seconds, the least
+    recently used are evicted past max_entries, and an entry is dropped as soon as one
+    of its images is evicted from the image cache (see invalidate_paths) or is found
+    missing on disk. Only final responses are cached: no errors (including an upstream
+    error served as the explanation), no degraded parts, and no preview images still
+    waiting for their full-quality render.
+    """
+
+    # Result fields that mark a response as not final.
+    PROVISIONAL_FIELDS = ("error", "degraded", "full_image_path")
+
+    # Words that don't change which lesson a topic asks for.
+    STOPWORDS = {
+        "a", "an", "the", "please", "tell", "me", "us", "about", "explain", "describe", "show",
+        "what", "whats", "is", "are", "can", "you", "i", "want", "to", "learn", "know", "more",
+    }
+
+    def __init__(self, path: str, ttl: float = 24 * 3600, max_entries: int = 10000, hot_entries: int = 256):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hot_entries = hot_entries
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT NOT NULL, images TEXT NOT NULL,"
+            " expires REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        # Which responses show which image, so evicting an image drops them.
+        self._db.execute("CREATE TABLE IF NOT EXISTS response_images (path TEXT NOT NULL, key TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS response_images_path ON response_images (path)")
+        self._lock = threading.Lock()
+        # key -> (body, etag, images, expires), most recently used last.
+        self._hot: "OrderedDict[str, Tuple[bytes, str, List[str], float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @classmethod
+    def normalize_topic(cls, topic: str) -> str:
+        """Lowercases the topic and drops punctuation, extra whitespace and stopwords."""
+        words = re.findall(r"[a-z0-9]+", topic.lower().replace("'", ""))
+        kept = [word for word in words if word not in cls.STOPWORDS]
+        return " ".join(kept or words)
+
+    @staticmethod
+    def make_etag(body: bytes) -> str:
+        return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    @staticmethod
+    def encode(results: List[Dict]) -> bytes:
+        """The JSON body for a list of results, byte-for-byte stable so ETags are too."""
+        return json.dumps(results, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def is_final(cls, result: Dict) -> bool:
+        """True when a result may be cached: nothing in it is provisional or an error."""
+        if any(field in result for field in cls.PROVISIONAL_FIELDS):
+            return False
+        return not InterestExplorer.is_error(result.get("explanation") or "")
+
+    @staticmethod
+    def _image_paths(results: List[Dict]) -> List[str]:
+        return [os.path.abspath(result["image_path"]) for result in results if result.get("image_path")]
+
+    def get(self, topic: str) -> Optional[Tuple[bytes, str]]:
+        """Returns (body, etag) for a cached topic, or None on a miss."""
+        key = self.normalize_topic(topic)
+        now = time.time()
+        with self._lock:
+            entry = self._hot.get(key)
+            if entry is None:
+                row = self._db.execute(
+                    "SELECT body, etag, images, expires FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = (row[0], row[1], json.loads(row[2]), row[3])
+            if entry is not None and (entry[3] <= now or not all(os.path.exists(p) for p in entry[2])):
+                # Expired, or an image was removed by another process or by hand.
+                self._remove([key])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember_hot(key, entry)
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, topic: str, results: List[Dict]) -> Tuple[bytes, str]:
+        """
+        Encodes results and caches them when they are final. Returns (body, etag) either
+        way, so the first response carries the same ETag later hits will.
+        """
+        body = self.encode(results)
+        etag = self.make_etag(body)
+        if not results or not all(self.is_final(result) for result in results):
+            return body, etag
+        key = self.normalize_topic(topic)
+        images = self._image_paths(results)
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM response_images WHERE key = ?", (key,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, body, etag, images, expires, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, body, etag, json.dumps(images), now + self.ttl, now),
+            )
+            self._db.executemany("INSERT INTO response_images (path, key) VALUES (?, ?)", [(p, key) for p in images])
+            self._remember_hot(key, (body, etag, images, now + self.ttl))
+            self._evict()
+        return body, etag
+
+    def invalidate_paths(self, paths: Iterable[str]) -> int:
+        """Drops every response showing one of these image files. Returns how many were dropped."""
+        paths = [os.path.abspath(path) for path in paths]
+        if not paths:
+            return 0
+        with self._lock:
+            keys = set()
+            for path in paths:
+                keys.update(row[0] for row in self._db.execute("SELECT key FROM response_images WHERE path = ?", (path,)))
+            self._remove(keys)
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def _remember_hot(self, key: str, entry: Tuple[bytes, str, List[str], float]):
+        self._hot[key] = entry
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def _remove(self, keys: Iterable[str]):
+        for key in keys:
+            self._hot.pop(key, None)
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.execute("DELETE FROM response_images WHERE key = ?", (key,))
+
+    def _evict(self):
+        self._db.execute("DELETE FROM response_images WHERE key IN (SELECT key FROM responses WHERE expires <= ?)", (time.time(),))
+        self._db.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            keys = [row[0] for row in self._db.execute(
+                "SELECT key FROM responses ORDER BY last_access LIMIT ?", (excess,)
+            )]
+            self._remove(keys)
+            self.evictions += len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+def test_response_cache():
+    """
+    Checks topic normalization, complete-only caching, invalidation when an image is
+    evicted from a real ImageCache, and that hot topics are served in well under 10 ms.
+    """
+    import tempfile
+    from image_cache import ImageCache
+    from image_delivery import placeholder_png
+
+    print("\n--- Running ResponseCache Test ---")
+    root = tempfile.mkdtemp(prefix="response-cache-")
+    images = ImageCache(os.path.join(root, "images"), max_bytes=10 ** 9, derivative_widths=())
+    cache = ResponseCache(os.path.join(root, "responses.sqlite3"))
+    images.eviction_listeners.append(cache.invalidate_paths)
+    failures = []
+
+    same = ["Tell me about Volcanoes!", "volcanoes", "  What are   VOLCANOES? "]
+    if len({ResponseCache.normalize_topic(topic) for topic in same}) != 1:
+        failures.append(f"normalization: {[ResponseCache.normalize_topic(t) for t in same]}")
+
+    topics = [f"topic {i}" for i in range(100)]
+    for i, topic in enumerate(topics):
+        path = images.put(f"{i:064x}", placeholder_png())
+        cache.put(topic, [{"entity": topic, "prompt": "p", "image_path": path, "explanation": "e"}])
+    cache.put("degraded topic", [{"entity": "x", "image_path": path, "degraded": {"image": "placeholder"}}])
+    cache.put("preview topic", [{"entity": "x", "image_path": path, "full_image_path": path + ".full"}])
+    failed = f"{InterestExplorer.ERROR_PREFIX}upstream 400: bad request"
+    cache.put("failed topic", [{"entity": "x", "prompt": "p", "image_path": path, "explanation": failed}])
+
+    start = time.perf_counter()
+    for _ in range(10):
+        for topic in topics:
+            body, etag = cache.get(topic)
+    per_hit_ms = (time.perf_counter() - start) * 1000 / (10 * len(topics))
+    if per_hit_ms >= 10:
+        failures.append(f"hits took {per_hit_ms:.2f} ms")
+    if cache.get("Degraded topic") is not None:
+        failures.append("a degraded response was cached")
+    if cache.get("preview topic") is not None:
+        failures.append("a response with a preview image was cached")
+    if cache.get("failed topic") is not None:
+        failures.append("a response with an upstream error as its explanation was cached")
+    if cache.get("TOPIC 7?")[1] != ResponseCache.make_etag(cache.get("topic 7")[0]):
+        failures.append("ETag doesn't match the body")
+
+    images.max_bytes = 0
+    images.evict()
+    if cache.get("topic 7") is not None or cache.stats()["invalidations"] != len(topics):
+        failures.append(f"evicting the images left responses behind: {cache.stats()}")
+
+    print(f"Hit latency: {per_hit_ms:.3f} ms, stats: {cache.stats()}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("\n✅ Test successful!" if not failures else "\n❌ Test failed.")
+    return not failures
+
+if __name__ == "__main__":
+    test_response_cache()
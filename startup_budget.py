@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from typing import Dict, List
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules that must not be imported until a stage that needs them runs (or warm_up() loads them).
+HEAVY_MODULES = ("cerebras.cloud.sdk", "numpy", "requests", "PIL.Image", "torch", "diffusers", "transformers")
+
+# (name, code timed in a fresh interpreter, budget in seconds). Scaled by STARTUP_BUDGET_SCALE
+# on slower machines. The code after the import must not trigger the heavy imports either.
+CHECKS = [
+    ("import pipeline", "import EducationalAnimationPipeline", 0.3),
+    (
+        "construct pipeline",
+        "import EducationalAnimationPipeline as m; m.EducationalAnimationPipeline(output_base_dir=OUTPUT_DIR)",
+        0.4,
+    ),
+    ("import asgi app", "import asgi", 0.5),
+]
+
+PROBE = """
+import sys, time, json
+OUTPUT_DIR = {output_dir!r}
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def measure(code: str, runs: int = 3) -> Dict:
+    """
+    Times code in fresh interpreters (so nothing is already imported) and keeps the
+    fastest run, which is the least disturbed by other load on the machine.
+    """
+    best = None
+    for _ in range(runs):
+        workdir = tempfile.mkdtemp(prefix="startup-")
+        probe = PROBE.format(output_dir=os.path.join(workdir, "pipeline_outputs"), code=code, heavy=HEAVY_MODULES)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.getenv("PYTHONPATH")])))
+        # No keys or .env: startup must not depend on them.
+        for name in ("CEREBRAS_API_KEY", "STABILITY_API_KEY"):
+            env.pop(name, None)
+        output = subprocess.run(
+            [sys.executable, "-c", probe], cwd=workdir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+def test_startup_budget(scale: float = None) -> bool:
+    """Checks import and construction times against their budgets, and that heavy stacks stay unloaded."""
+    print("\n--- Running Startup Budget Test ---")
+    scale = scale or float(os.getenv("STARTUP_BUDGET_SCALE", "1"))
+    failures: List[str] = []
+    print(f"{'check':<22}{'time (s)':>10}{'budget (s)':>12}  heavy imports")
+    for name, code, budget in CHECKS:
+        result = measure(code)
+        print(f"{name:<22}{result['seconds']:>10.3f}{budget * scale:>12.2f}  {', '.join(result['heavy']) or '-'}")
+        if result["seconds"] > budget * scale:
+            failures.append(f"{name} took {result['seconds']:.3f}s (budget {budget * scale:.2f}s)")
+        if result["heavy"]:
+            failures.append(f"{name} imported {', '.join(result['heavy'])}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("\n✅ Test successful!" if not failures else "\n❌ Test failed.")
+    return not failures
+
+if __name__ == "__main__":
+    sys.exit(0 if test_startup_budget(float(sys.argv[1]) if len(sys.argv) > 1 else None) else 1)
@@ -0,0 +1,466 @@
+import io
+import os
+import base64
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import requests
+from PIL import Image
+
+# --- LATENCY ---
+class Latency:
+    """
+    A latency distribution parsed from a spec string:
+    "fixed:0.05", "uniform:0.02,0.2", "normal:0.3,0.05" (mean, stdev) or
+    "lognormal:0.4,0.5" (median seconds, sigma). Samples are never negative.
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}' (expected one of {', '.join(self.KINDS)})")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p.strip()]
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0] if p else 0.0
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        else:
+            value = p[0] * rng.lognormvariate(0, p[1])
+        return max(0.0, value)
+
+class StubProfile:
+    """How one stubbed service behaves: its latency, how often it fails, and how big its answers are."""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0.05",
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_concurrency: int = 0,
+        retry_after: float = 0.0,
+        completion_words: int = 120,
+        image_size: int = 512,
+        model_latency: Optional[Dict[str, str]] = None,
+    ):
+        self.latency = Latency(latency)
+        # Per-model latency specs, for models that answer faster or slower than the rest.
+        self.model_latency = {model: Latency(spec) for model, spec in (model_latency or {}).items()}
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        # Above this many concurrent requests the stub answers 429, like a provider at its limit (0: no limit).
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.completion_words = completion_words
+        self.image_size = image_size
+
+    def latency_for(self, model: Optional[str]) -> Latency:
+        return self.model_latency.get(model, self.latency)
+
+# --- RECORD / REPLAY ---
+def request_key(path: str, body: bytes) -> str:
+    """Identifies a request by path and canonical JSON body, so recordings match regardless of key order."""
+    try:
+        canonical = json.dumps(json.loads(body or b"{}"), sort_keys=True)
+    except ValueError:
+        canonical = body.decode("utf-8", "replace")
+    return hashlib.sha256(f"{path}\n{canonical}".encode("utf-8")).hexdigest()
+
+class Recording:
+    """
+    Upstream responses stored as JSON lines ({"key", "path", "status", "content_type",
+    "body", "latency"}). In record mode every proxied response is appended as it
+    arrives; in replay mode responses are looked up by request key.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry["key"]] = entry
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.entries.get(key)
+
+    def add(self, entry: Dict):
+        with self._lock:
+            self.entries[entry["key"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+# --- SYNTHETIC RESPONSES ---
+FILLER = (
+    "light water energy plants animals earth sun moon river mountain ocean forest "
+    "cells heat air rock ice wind rain soil seed leaf root star planet gravity"
+).split()
+
+def _quoted_after(prompt: str, marker: str) -> str:
+    rest = prompt.split(marker, 1)[1]
+    start = rest.find('"')
+    end = rest.find('"', start + 1)
+    return rest[start + 1:end] if start != -1 and end != -1 else rest.strip()
+
+def synthetic_completion(prompt: str, profile: StubProfile, rng: random.Random) -> str:
+    """
+    An answer in the shape each pipeline stage expects, recognised from its prompt.
+    Entities are derived from the topic so distinct topics never share cache entries.
+    """
+    if "User's question or topic to analyze" in prompt:
+        topic = _quoted_after(prompt, "User's question or topic to analyze")
+        return " ".join(topic.split()[:4]).title().replace(",", "")
+    if "Now, create a prompt for the following entity:" in prompt:
+        entity = prompt.split("Now, create a prompt for the following entity:", 1)[1].strip()
+        return f"a high-quality, detailed photograph of {entity}, in soft morning light"
+    explanation = " ".join(rng.choice(FILLER) for _ in range(profile.completion_words)).capitalize() + "."
+    if "User's question or topic:" in prompt:
+        topic = _quoted_after(prompt, "User's question or topic:")
+        entity = " ".join(topic.split()[:4]).title().replace(",", "")
+        return json.dumps({"entities": [{
+            "name": entity,
+            "image_prompt": f"a high-quality, detailed photograph of {entity}",
+            "explanation": explanation,
+        }]})
+    if "'entities' array" in prompt:
+        return json.dumps({"entities": [
+            {"name": f"{word.title()} specimen", "description": f"A clear view of {word}.", "relevance": explanation[:80]}
+            for word in rng.sample(FILLER, 3)
+        ]})
+    return explanation
+
+_png_cache: Dict[int, str] = {}
+_png_lock = threading.Lock()
+
+def synthetic_png(size: int) -> str:
+    """A base64 PNG of random noise, so its size is close to a real generated image's."""
+    with _png_lock:
+        if size not in _png_cache:
+            buffer = io.BytesIO()
+            Image.frombytes("RGB", (size, size), os.urandom(size * size * 3)).save(buffer, "PNG")
+            _png_cache[size] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return _png_cache[size]
+
+def _completion_body(model: str, text: str) -> Dict:
+    words = len(text.split())
+    return {
+        "id": f"chatcmpl-{random.getrandbits(48):012x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": words, "total_tokens": words},
+        "time_info": {},
+    }
+
+def _completion_stream(model: str, text: str) -> bytes:
+    """The completion as server-sent events, a few words per chunk, as the chat API streams it."""
+    words = text.split(" ")
+    events = []
+    for i in range(0, len(words), 8):
+        piece = " ".join(words[i:i + 8]) + (" " if i + 8 < len(words) else "")
+        chunk = {
+            "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}],
+        }
+        events.append(f"data: {json.dumps(chunk)}\n\n")
+    final = {
+        "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    events.append(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n")
+    return "".join(events).encode("utf-8")
+
+def _model_of(body: bytes) -> Optional[str]:
+    try:
+        return json.loads(body or b"{}").get("model")
+    except (ValueError, AttributeError):
+        return None
+
+# --- SERVER ---
+class StubServer:
+    """
+    A local stand-in for the Cerebras chat-completions API and the Stability
+    text-to-image endpoint, on one port. Point the pipeline at it with
+    CEREBRAS_BASE_URL and STABILITY_API_HOST (see env()).
+
+    By default it answers with synthetic responses shaped by the per-service
+    StubProfile. With record set, it proxies every request to the real upstream
+    and appends the response to the recording; with replay set, it serves recorded
+    responses (at their recorded latency) and falls back to synthetic ones for
+    requests it has not seen.
+    """
+
+    SERVICES = ("cerebras", "stability")
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        profiles: Optional[Dict[str, StubProfile]] = None,
+        record: Optional[str] = None,
+        replay: Optional[str] = None,
+        upstreams: Optional[Dict[str, str]] = None,
+        seed: Optional[int] = None,
+    ):
+        if record and replay:
+            raise ValueError("A stub server can record or replay, not both")
+        self.profiles = {service: StubProfile() for service in self.SERVICES}
+        self.profiles.update(profiles or {})
+        self.mode = "record" if record else "replay" if replay else "synthetic"
+        self.recording = Recording(record or replay) if (record or replay) else None
+        self.upstreams = dict(
+            {"cerebras": "https://api.cerebras.ai", "stability": "https://api.stability.ai"}, **(upstreams or {})
+        )
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._active = {service: 0 for service in self.SERVICES}
+        self.counters = {
+            service: {"requests": 0, "ok": 0, "throttled": 0, "errors": 0, "replayed": 0, "replay_misses": 0, "peak_active": 0}
+            for service in self.SERVICES
+        }
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point the pipeline's clients at this stub."""
+        return {
+            "CEREBRAS_BASE_URL": self.url,
+            "STABILITY_API_HOST": self.url,
+            "CEREBRAS_API_KEY": os.getenv("CEREBRAS_API_KEY") or "stub",
+            "STABILITY_API_KEY": os.getenv("STABILITY_API_KEY") or "stub",
+        }
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {service: dict(counters) for service, counters in self.counters.items()}
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def respond(self, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, str, bytes, Dict[str, str]]:
+        """Returns (status, content_type, body, extra_headers) for one API request."""
+        service = "cerebras" if "/chat/completions" in path else "stability"
+        profile = self.profiles[service]
+        counters = self.counters[service]
+        with self._lock:
+            counters["requests"] += 1
+            self._active[service] += 1
+            counters["peak_active"] = max(counters["peak_active"], self._active[service])
+            over = profile.max_concurrency and self._active[service] > profile.max_concurrency
+        try:
+            if self.mode == "record":
+                return self._proxy(service, path, body, headers)
+            if self.mode == "replay":
+                entry = self.recording.get(request_key(path, body))
+                if entry is not None:
+                    time.sleep(entry.get("latency", 0))
+                    with self._lock:
+                        counters["replayed"] += 1
+                    return entry["status"], entry["content_type"], entry["body"].encode("utf-8"), {}
+                with self._lock:
+                    counters["replay_misses"] += 1
+
+            with self._lock:
+                delay = profile.latency_for(_model_of(body)).sample(self._rng)
+            roll = self._random()
+            if over or roll < profile.throttle_rate:
+                # Providers turn excess requests away quickly rather than after the full latency.
+                time.sleep(min(delay, 0.01))
+                with self._lock:
+                    counters["throttled"] += 1
+                extra = {"Retry-After": f"{profile.retry_after:g}"} if profile.retry_after else {}
+                return 429, "application/json", b'{"message": "Too many requests"}', extra
+            time.sleep(delay)
+            if roll < profile.throttle_rate + profile.error_rate:
+                with self._lock:
+                    counters["errors"] += 1
+                return 500, "application/json", b'{"message": "Internal server error"}', {}
+            with self._lock:
+                counters["ok"] += 1
+            return self._synthesize(service, path, body, profile)
+        finally:
+            with self._lock:
+                self._active[service] -= 1
+
+    def _synthesize(self, service: str, path: str, body: bytes, profile: StubProfile):
+        payload = json.loads(body or b"{}")
+        if service == "stability":
+            artifact = {"base64": synthetic_png(profile.image_size), "seed": payload.get("seed", 0), "finishReason": "SUCCESS"}
+            return 200, "application/json", json.dumps({"artifacts": [artifact]}).encode("utf-8"), {}
+        prompt = " ".join(m.get("content", "") for m in payload.get("messages", []))
+        with self._lock:
+            text = synthetic_completion(prompt, profile, self._rng)
+        model = payload.get("model", "stub")
+        if payload.get("stream"):
+            return 200, "text/event-stream", _completion_stream(model, text), {}
+        return 200, "application/json", json.dumps(_completion_body(model, text)).encode("utf-8"), {}
+
+    def _proxy(self, service: str, path: str, body: bytes, headers: Dict[str, str]):
+        forwarded = {k: v for k, v in headers.items() if k.lower() in ("authorization", "content-type", "accept")}
+        start = time.perf_counter()
+        response = requests.post(self.upstreams[service] + path, data=body, headers=forwarded, timeout=300)
+        latency = time.perf_counter() - start
+        content_type = response.headers.get("Content-Type", "application/json")
+        self.recording.add({
+            "key": request_key(path, body), "path": path, "status": response.status_code,
+            "content_type": content_type, "body": response.text, "latency": round(latency, 4),
+        })
+        counter = "ok" if response.status_code < 400 else "throttled" if response.status_code == 429 else "errors"
+        with self._lock:
+            self.counters[service][counter] += 1
+        return response.status_code, content_type, response.content, {}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, content_type: str, body: bytes, extra: Optional[Dict[str, str]] = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (extra or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/__stats":
+                    self._send(200, "application/json", json.dumps(stub.stats()).encode("utf-8"))
+                else:
+                    # The Cerebras SDK warms its connection with a GET when the client is built.
+                    self._send(200, "application/json", b"{}")
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    status, content_type, out, extra = stub.respond(self.path, body, dict(self.headers.items()))
+                except Exception as e:
+                    status, content_type, out, extra = 502, "application/json", json.dumps({"message": str(e)}).encode(), {}
+                self._send(status, content_type, out, extra)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def test_stub_server():
+    """Checks the synthetic answers, the concurrency ceiling and a record/replay round trip."""
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("\n--- Running StubServer Test ---")
+    slow = StubProfile(latency="fixed:0.05", max_concurrency=2, image_size=32)
+    stub = StubServer(profiles={"cerebras": slow, "stability": slow}, seed=1).start()
+    chat = f"{stub.url}/v1/chat/completions"
+    extraction = {"model": "m", "messages": [{"role": "user", "content": 'User\'s question or topic to analyze:\n"How do volcanoes erupt?"'}]}
+    answer = requests.post(chat, json=extraction).json()["choices"][0]["message"]["content"]
+    image = requests.post(f"{stub.url}/v1/generation/e/text-to-image", json={"seed": 3}).json()
+    with ThreadPoolExecutor(8) as pool:
+        statuses = list(pool.map(lambda _: requests.post(chat, json=extraction).status_code, range(8)))
+    stub.stop()
+    print(f"Extraction: {answer!r}, statuses under load: {sorted(statuses)}, stats: {stub.stats()['cerebras']}")
+
+    path = os.path.join(tempfile.mkdtemp(), "recording.jsonl")
+    recorded = {"key": request_key("/v1/chat/completions", json.dumps(extraction).encode()), "path": "/v1/chat/completions",
+                "status": 200, "content_type": "application/json", "latency": 0,
+                "body": json.dumps(_completion_body("m", "Recorded Volcano"))}
+    Recording(path).add(recorded)
+    replayer = StubServer(replay=path).start()
+    replayed = requests.post(f"{replayer.url}/v1/chat/completions", json=extraction).json()["choices"][0]["message"]["content"]
+    replayer.stop()
+    print(f"Replayed: {replayed!r}")
+
+    ok = (
+        answer == "How Do Volcanoes Erupt?"
+        and image["artifacts"][0]["seed"] == 3
+        and 200 in statuses and 429 in statuses
+        and replayed == "Recorded Volcano"
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+
+def profile_args(parser: argparse.ArgumentParser):
+    """Adds the stub profile options shared by this CLI and the benchmark."""
+    parser.add_argument("--llm-latency", default="lognormal:0.3,0.4", help="Chat completion latency distribution.")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SPEC",
+                        help="Chat completion latency for one model (repeatable), e.g. llama3.1-8b=lognormal:0.1,0.3.")
+    parser.add_argument("--image-latency", default="lognormal:2.0,0.3", help="Text-to-image latency distribution.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with a 429.")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="Concurrent chat requests before 429s (0: no limit).")
+    parser.add_argument("--image-max-concurrency", type=int, default=0, help="Concurrent image requests before 429s (0: no limit).")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--completion-words", type=int, default=120, help="Words per synthetic explanation.")
+    parser.add_argument("--image-size", type=int, default=512, help="Width and height of synthetic images.")
+    parser.add_argument("--record", default=None, help="Proxy to the real APIs and append responses to this file.")
+    parser.add_argument("--replay", default=None, help="Serve the responses recorded in this file.")
+    parser.add_argument("--seed", type=int, default=None)
+
+def profiles_from_args(args) -> Dict[str, StubProfile]:
+    shared = dict(error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                  completion_words=args.completion_words, image_size=args.image_size)
+    return {
+        "cerebras": StubProfile(
+            latency=args.llm_latency, max_concurrency=args.llm_max_concurrency,
+            model_latency=dict(spec.split("=", 1) for spec in args.model_latency), **shared
+        ),
+        "stability": StubProfile(latency=args.image_latency, max_concurrency=args.image_max_concurrency, **shared),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the Cerebras and Stability APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--test", action="store_true", help="Run the standalone test instead of serving.")
+    profile_args(parser)
+    args = parser.parse_args()
+    if args.test:
+        return test_stub_server()
+
+    stub = StubServer(args.host, args.port, profiles_from_args(args), record=args.record, replay=args.replay, seed=args.seed)
+    print(f"🧪 Stub APIs ({stub.mode}) listening on {stub.url}")
+    print(f"   export CEREBRAS_BASE_URL={stub.url} STABILITY_API_HOST={stub.url}", flush=True)
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import contextlib
+import contextvars
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from rate_governor import throttle_status
+
+log = logging.getLogger(__name__)
+
+# --- LOGGING ---
+def configure_logging(level: Optional[str] = None):
+    """
+    Sets up leveled logging for the servers and CLIs. LOG_LEVEL picks the level (INFO by
+    default); per-entity chatter on the hot path is logged at DEBUG, so it costs nothing
+    unless asked for.
+    """
+    logging.basicConfig(
+        level=(level or os.getenv("LOG_LEVEL", "INFO")).upper(),
+        format="%(asctime)s %(levelname)-7s %(name)s: %(message)s",
+    )
+    # The HTTP clients log every request at INFO; upstream calls are already counted on /metrics.
+    for noisy in ("httpx", "urllib3"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+# --- METRICS ---
+Labels = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A named family of samples, one per label set, rendered in the Prometheus text format."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, amount: float, labels: Dict[str, str]):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        self._add(amount, labels)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1, **labels):
+        self._add(-amount, labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            # Per-bucket counts, then the sum and the count.
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        with self._lock:
+            series_items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", labels, series[-2]))
+            samples.append((f"{self.name}_count", labels, series[-1]))
+        return samples
+
+# A collector returns (name, kind, documentation, [(labels, value), ...]) families at scrape time.
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]
+
+class Registry:
+    """The metrics a process exports, plus collectors that turn existing stats() into samples on scrape."""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector: Collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        parts = [metric.render() for metric in metrics]
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                log.warning("⚠️ Metrics collector failed: %s", e)
+                continue
+            for name, kind, documentation, samples in families:
+                lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+                parts.append("\n".join(lines))
+        return "\n".join(parts) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pipeline_stage_duration_seconds", "Time spent in each pipeline stage."))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "pipeline_stage_in_flight", "Pipeline stages currently running."))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "pipeline_stage_errors_total", "Pipeline stages that failed or fell back."))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    "upstream_requests_total", "Calls to Cerebras and Stability, by outcome (ok, throttled, error)."))
+UPSTREAM_SECONDS = REGISTRY.register(Histogram(
+    "upstream_request_duration_seconds", "Latency of each upstream call attempt."))
+DEGRADED = REGISTRY.register(Counter(
+    "pipeline_degraded_total", "Entity parts served with a fallback, by part and fallback."))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Latency of the server's HTTP requests."))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served."))
+
+def record_upstream(
+    provider: str, seconds: float, error: Optional[BaseException] = None, status: Optional[int] = None
+):
+    """Counts one upstream call attempt and its latency. Pass the error it raised or the HTTP status it returned."""
+    if (error is not None and throttle_status(error)) or status in (429, 500, 502, 503, 504):
+        outcome = "throttled"
+    elif error is not None or (status is not None and status >= 400):
+        outcome = "error"
+    else:
+        outcome = "ok"
+    UPSTREAM_REQUESTS.inc(provider=provider, outcome=outcome)
+    UPSTREAM_SECONDS.observe(seconds, provider=provider)
+
+# --- TRACING ---
+class Trace:
+    """The spans recorded while serving one request, with offsets relative to its start."""
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        # (start, seq, stage, seconds, attrs); seq orders spans that start at the same instant.
+        self.spans: List[Tuple[float, int, str, float, Dict]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, seconds: float, attrs: Dict, seq: int = 0):
+        with self._lock:
+            self.spans.append((start, seq, stage, seconds, dict(attrs)))
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s[:2])
+        # Rounded only here, so the order above comes from the exact start times.
+        return dict(
+            self.attrs, trace=self.name,
+            duration_ms=round(1000 * (time.perf_counter() - self.start), 2),
+            spans=[
+                dict(
+                    attrs, stage=stage,
+                    start_ms=round(1000 * (start - self.start), 2), duration_ms=round(1000 * seconds, 2),
+                )
+                for start, _, stage, seconds, attrs in spans
+            ],
+        )
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+# Numbers spans in the order they start.
+_span_seq = itertools.count()
+
+def tracing_enabled() -> bool:
+    return os.getenv("TRACE_REQUESTS", "").lower() in ("1", "true", "yes")
+
+@contextlib.contextmanager
+def trace(name: str, enabled: Optional[bool] = None, **attrs):
+    """
+    Collects every span recorded while the block runs (including in tasks and executor
+    calls it starts) and logs the trace as one JSON line when it ends. Enabled by
+    TRACE_REQUESTS=1 or per call; yields None when disabled.
+    """
+    if not (tracing_enabled() if enabled is None else enabled):
+        yield None
+        return
+    current = Trace(name, **attrs)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        log.info("trace %s", json.dumps(current.to_dict()))
+
+@contextlib.contextmanager
+def span(stage: str, **attrs):
+    """
+    Times one stage: feeds the stage histogram and in-flight gauge and adds a span to the
+    current trace. The yielded dict can be updated with attributes; setting "error" (for
+    calls that fall back instead of raising) counts the stage as failed.
+    """
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    seq = next(_span_seq)
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs.setdefault("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if "error" in attrs:
+            STAGE_ERRORS.inc(stage=stage)
+        current = _current_trace.get()
+        if current is not None:
+            current.add(stage, start, seconds, attrs, seq)
+
+def test_telemetry():
+    """Checks histogram rendering, span bookkeeping and that traces follow work into threads."""
+    print("\n--- Running Telemetry Standalone Test ---")
+    registry = Registry()
+    latency = registry.register(Histogram("test_seconds", "Test latency.", buckets=(0.1, 1)))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, stage="x")
+    registry.add_collector(lambda: [("test_ratio", "gauge", "A ratio.", [({"cache": "image"}, 0.5)])])
+    text = registry.render()
+    print(text)
+
+    with trace("test", enabled=True) as current:
+        with span("outer", entity="Sun"):
+            with span("inner") as inner:
+                inner["cache"] = "hit"
+
+            def in_thread():
+                with span("threaded"):
+                    pass
+            # Executor calls are run the same way, in a copy of the caller's context.
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(in_thread,))
+            worker.start()
+            worker.join()
+    stages = [s["stage"] for s in current.to_dict()["spans"]]
+    print(f"Spans: {stages}")
+
+    ok = (
+        'test_seconds_bucket{stage="x",le="0.1"} 1' in text
+        and 'test_seconds_bucket{stage="x",le="+Inf"} 3' in text
+        and 'test_seconds_count{stage="x"} 3' in text
+        and 'test_ratio{cache="image"} 0.5' in text
+        and stages == ["outer", "inner", "threaded"]
+    )
+    print("\n✅ Test successful!" if ok else "\n❌ Test failed.")
+
+if __name__ == "__main__":
+    test_telemetry()
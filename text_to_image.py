@@ -92,86 +92,158 @@
 
 
 import os
-import base64
-import requests
-from typing import List
-from dotenv import load_dotenv
+import json
+import logging
+from typing import Dict, List, Optional
 
-load_dotenv()
+from image_cache import ImageCache
+from http_transport import HttpTransport
+from rate_governor import RateLimited
+from telemetry import span
+
+log = logging.getLogger(__name__)
 
 class StabilityImageGenerator:
-    def __init__(self):
+    # Render parameters per preset; all of them are part of the image cache key, so each
+    # preset's images are cached separately. "preview" is the cheap first image of
+    # progressive delivery: SDXL only accepts ~1 megapixel sizes, so it uses the 512px engine.
+    DEFAULT_PRESETS = {
+        "full": {"engine_id": "stable-diffusion-xl-1024-v1-0", "width": 1024, "height": 1024, "steps": 30, "cfg_scale": 7},
+        "preview": {"engine_id": "stable-diffusion-v1-6", "width": 512, "height": 512, "steps": 12, "cfg_scale": 7},
+    }
+
+    def __init__(
+        self,
+        transport: Optional[HttpTransport] = None,
+        cache: Optional[ImageCache] = None,
+        cache_max_bytes: Optional[int] = None,
+        presets: Optional[Dict[str, Dict]] = None,
+    ):
         """
         Initialize the Stability AI Image Generator.
+        Pass a shared HttpTransport to reuse pooled keep-alive connections (with timeouts
+        and retries) across calls,
+        and a shared ImageCache to reuse generated images across calls.
+        Presets override DEFAULT_PRESETS per name, from the presets argument or the
+        IMAGE_PRESETS environment variable (a JSON object, e.g. {"preview": {"steps": 8}}).
         """
+        # A missing key fails image generation (and readiness), not construction: cached images can still be served.
         self.api_key = os.getenv("STABILITY_API_KEY")
-        if not self.api_key:
-            raise ValueError("STABILITY_API_KEY not found in .env file")
-        
-        self.api_host = "https://api.stability.ai"
-        self.engine_id = "stable-diffusion-xl-1024-v1-0" 
+
+        self.api_host = os.getenv("STABILITY_API_HOST", "https://api.stability.ai")
+        self.transport = transport or HttpTransport()
+
+        if presets is None:
+            presets = json.loads(os.getenv("IMAGE_PRESETS", "{}") or "{}")
+        self.presets = {name: dict(config) for name, config in self.DEFAULT_PRESETS.items()}
+        for name, config in presets.items():
+            self.presets[name] = dict(self.presets.get(name, self.DEFAULT_PRESETS["full"]), **config)
+
+        self.cache_max_bytes = cache_max_bytes or int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+        self._caches = {}
+        if cache is not None:
+            self._caches[os.path.abspath(cache.root_dir)] = cache
 
     # --- THIS IS THE KEY CHANGE: The function now accepts 'entity' ---
     def generate_images(
-        self, entity: str, prompt: str, seed: int, num_images: int, output_dir: str
+        self, entity: str, prompt: str, seed: int, num_images: int, output_dir: str, preset: str = "full"
     ) -> List[str]:
         """
         Generates an image if it doesn't already exist in the cache.
+        The cache is keyed by every render parameter, not by the entity name.
         """
-        # 1. Create a safe, unique filename from the entity
-        safe_entity_name = "".join(c for c in entity if c.isalnum() or c in " -_").rstrip().replace(" ", "_").lower()
-        filename = f"{safe_entity_name}.png"
-        output_path = os.path.join(output_dir, filename)
-
-        # 2. Implement the caching logic
-        if os.path.exists(output_path):
-            print(f"\n--- ✅ Cache Hit! Found existing image for '{entity}' ---")
-            print(f"Returning cached image: {output_path}")
-            return [output_path]
-
-        # 3. If image does not exist, proceed with API call
-        print(f"\n--- ❌ Cache Miss. Generating new image with Stability API for: '{prompt}' ---")
-        
-        try:
-            response = requests.post(
-                f"{self.api_host}/v1/generation/{self.engine_id}/text-to-image",
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json={
-                    "text_prompts": [{"text": prompt}],
-                    "cfg_scale": 7,
-                    "height": 1024,
-                    "width": 1024,
-                    "samples": num_images,
-                    "steps": 30,
-                    "seed": seed,
-                },
-            )
-
-            if response.status_code != 200:
-                raise Exception(f"Non-200 response from API: {response.text}")
-
-            data = response.json()
-            image_paths = []
-
-            for i, image in enumerate(data["artifacts"]):
-                # Save the image using the new entity-based filename
-                with open(output_path, "wb") as f:
-                    f.write(base64.b64decode(image["base64"]))
-                
-                print(f"✅ Image ({i+1}/{num_images}) saved successfully to {output_path}")
-                image_paths.append(output_path)
-            
-            return image_paths
+        cache = self._cache_for(output_dir)
+        params = self.presets[preset]
+        engine_id = params["engine_id"]
+        key = self.image_key(prompt, seed, preset)
+        # Sample 0 uses the bare key; extra samples get a suffix so each has its own file.
+        sample_keys = [key if i == 0 else f"{key}_{i}" for i in range(num_images)]
+
+        with span("image", entity=entity, preset=preset) as attrs:
+            # Concurrent calls for the same key wait here, so only one of them hits the API.
+            with cache.key_lock(key):
+                cached_paths = [cache.get(sample_key) for sample_key in sample_keys]
+                if all(cached_paths):
+                    log.debug("--- ✅ Cache Hit! Found existing image for '%s': %s ---", entity, cached_paths[0])
+                    attrs["cache"] = "hit"
+                    return cached_paths
+
+                log.info("--- ❌ Cache Miss. Generating new %s image with Stability API for: '%s' ---", preset, prompt)
+                attrs["cache"] = "miss"
+
+                try:
+                    if not self.api_key:
+                        raise ValueError("STABILITY_API_KEY not found in the environment or .env file")
+                    response = self.transport.post(
+                        f"{self.api_host}/v1/generation/{engine_id}/text-to-image",
+                        model=engine_id,
+                        headers={
+                            "Content-Type": "application/json",
+                            "Accept": "application/json",
+                            "Authorization": f"Bearer {self.api_key}"
+                        },
+                        json={
+                            "text_prompts": [{"text": prompt}],
+                            "cfg_scale": params["cfg_scale"],
+                            "height": params["height"],
+                            "width": params["width"],
+                            "samples": num_images,
+                            "steps": params["steps"],
+                            "seed": seed,
+                        },
+                    )
+
+                    if response.status_code == 429:
+                        raise RateLimited(f"Stability kept throttling {engine_id}: {response.text}")
+                    if response.status_code != 200:
+                        raise Exception(f"Non-200 response from API: {response.text}")
+
+                    data = response.json()
+                    image_paths = []
+
+                    for i, image in enumerate(data["artifacts"]):
+                        with span("disk", entity=entity):
+                            output_path = cache.put_base64(sample_keys[i], image["base64"], label=f"{entity} {prompt}")
+
+                        log.debug("✅ Image (%d/%d) saved successfully to %s", i + 1, num_images, output_path)
+                        image_paths.append(output_path)
+
+                    return image_paths
+
+                except RateLimited as e:
+                    # Throttling surfaces as its own error instead of a generic generation failure.
+                    log.error("❌ Stability API throttled image generation: %s", e)
+                    raise
+                except Exception as e:
+                    log.error("❌ Error during Stability API image generation: %s", e)
+                    attrs["error"] = str(e)
+                    return []
+
+    def image_key(self, prompt: str, seed: int, preset: str = "full") -> str:
+        params = self.presets[preset]
+        return ImageCache.make_key(
+            params["engine_id"], prompt, seed, params["width"], params["height"], params["steps"], params["cfg_scale"]
+        )
+
+    def expected_path(self, prompt: str, seed: int, output_dir: str, preset: str = "full") -> str:
+        """Where the first sample for prompt and seed is (or will be) stored, before it exists."""
+        return self._cache_for(output_dir).path_for(self.image_key(prompt, seed, preset))
+
+    def status(self) -> str:
+        """'ready', or 'error: ...' when new images can't be generated."""
+        return "ready" if self.api_key else "error: STABILITY_API_KEY is not set"
 
-        except Exception as e:
-            print(f"❌ Error during Stability API image generation: {e}")
-            return []
+    def _cache_for(self, output_dir: str) -> ImageCache:
+        """Returns the image cache rooted at output_dir, creating it on first use."""
+        root = os.path.abspath(output_dir)
+        if root not in self._caches:
+            self._caches[root] = ImageCache(output_dir, max_bytes=self.cache_max_bytes)
+        return self._caches[root]
 
 if __name__ == '__main__':
+    # Load environment variables for the standalone test
+    from dotenv import load_dotenv
+    load_dotenv()
     print("\n--- Running StabilityImageGenerator Standalone Test ---")
     test_output_dir = "pipeline_outputs/generated_images"
     os.makedirs(test_output_dir, exist_ok=True)
@@ -0,0 +1,416 @@
+import os
+import re
+import json
+import time
+import zlib
+import shutil
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+# Question words and filler that don't help tell topics apart.
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "to", "for", "and", "or", "is", "are", "was", "were",
+    "what", "which", "who", "whom", "whose", "why", "how", "when", "where", "do", "does", "did",
+    "tell", "me", "about", "explain", "show", "describe", "please", "can", "could", "you",
+    "our", "my", "your", "its", "it", "this", "that", "there", "some", "i", "we", "want", "know",
+}
+
+def normalize_text(text: str) -> str:
+    """Lowercases, strips punctuation and stopwords, and collapses whitespace."""
+    words = re.sub(r"[^a-z0-9\s]", " ", text.lower()).split()
+    kept = [word for word in words if word not in STOPWORDS]
+    return " ".join(kept or words)
+
+class _Postings(NamedTuple):
+    """Compacted postings: documents for feature f are doc_ids[indptr[f]:indptr[f+1]]."""
+    indptr: np.ndarray
+    doc_ids: np.ndarray
+    weights: np.ndarray
+    idf: np.ndarray
+    count: int
+    # Every document's features and tf, flattened, with each document's length: the next
+    # compaction only tokenizes new entries. None after a load.
+    terms: Optional[tuple]
+
+class _Delta(NamedTuple):
+    """
+    Entries inserted since the last compaction: an inverted map from feature to a
+    (doc_ids, weights, n) posting, and each entry's (features, tf) by document id.
+    Both are only added to. A posting's arrays grow by doubling and slots past n are
+    never read, so lookups can read them while an insert writes.
+    """
+    postings: Dict[int, tuple]
+    terms: Dict[int, tuple]
+
+class TopicIndex:
+    """
+    An in-memory similarity index from past queries to the entities (and image prompts)
+    they resolved to, so repeat phrasings can skip entity extraction and prompt enrichment.
+
+    Queries are normalized and split into hashed character n-grams weighted by TF-IDF.
+    The index is a CSR matrix of postings (feature -> documents) held in NumPy arrays, so a
+    lookup only touches the postings of the query's rarer n-grams; the best candidates are
+    then rescored with their exact cosine similarity. New entries go into a small
+    delta that is folded into the CSR matrix every compact_every inserts. On disk the arrays
+    are stored as .npy files that are memory-mapped at load.
+
+    Lookups take no lock: the postings and the delta are immutable views swapped in whole.
+    Compaction rebuilds the postings on a background thread and only holds the lock to swap
+    them in, so neither lookups nor inserts wait on a rebuild.
+    """
+
+    N_FEATURES = 1 << 18
+    NGRAM = 3
+
+    def __init__(self, threshold: float = 0.8, compact_every: int = 1000, postings_budget: int = 10000):
+        self.threshold = threshold
+        self.compact_every = compact_every
+        self.postings_budget = postings_budget
+        self._lock = threading.Lock()
+        # One rebuild at a time; inserts start one in the background past compact_every.
+        self._compact_lock = threading.Lock()
+        self._compacting = False
+        self.entries: List[Dict] = []
+        self._exact: Dict[str, int] = {}
+
+        # (postings, delta), replaced as a whole by compaction so a lookup always sees a consistent pair.
+        self._view = (
+            _Postings(
+                np.zeros(self.N_FEATURES + 1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                np.zeros(0, dtype=np.float32), np.ones(self.N_FEATURES, dtype=np.float32), 0, None,
+            ),
+            _Delta({}, {}),
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+    # --- Vectorizing ---
+    def _features(self, text: str) -> Dict[int, float]:
+        padded = f" {normalize_text(text)} "
+        counts: Dict[int, float] = {}
+        for i in range(max(1, len(padded) - self.NGRAM + 1)):
+            feature = zlib.crc32(padded[i:i + self.NGRAM].encode("utf-8")) % self.N_FEATURES
+            counts[feature] = counts.get(feature, 0.0) + 1.0
+        return counts
+
+    def _tf(self, text: str):
+        """Hashed n-gram features and their sublinear term frequencies."""
+        counts = self._features(text)
+        features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        return features, tf
+
+    @staticmethod
+    def _weigh(features, tf, idf):
+        weights = tf * idf[features]
+        norm = float(np.linalg.norm(weights)) or 1.0
+        return (weights / norm).astype(np.float32)
+
+    def _vector(self, text: str, idf):
+        """TF-IDF weights, L2-normalized, as parallel (features, weights) arrays."""
+        features, tf = self._tf(text)
+        return features, self._weigh(features, tf, idf)
+
+    def _add_to_delta(self, delta: _Delta, doc_id: int, features, tf, idf):
+        delta.terms[doc_id] = (features, tf)
+        for feature, weight in zip(features.tolist(), self._weigh(features, tf, idf).tolist()):
+            doc_ids, weights, n = delta.postings.get(feature, (None, None, 0))
+            if doc_ids is None or n == len(doc_ids):
+                # A posting that's full is copied, so readers of the old one are unaffected.
+                capacity = max(4, 2 * n)
+                grown_ids, grown_weights = np.zeros(capacity, dtype=np.int32), np.zeros(capacity, dtype=np.float32)
+                if n:
+                    grown_ids[:n], grown_weights[:n] = doc_ids, weights
+                doc_ids, weights = grown_ids, grown_weights
+            doc_ids[n], weights[n] = doc_id, weight
+            delta.postings[feature] = (doc_ids, weights, n + 1)
+
+    # --- Building ---
+    def insert(self, query: str, entities: List[Dict[str, str]]):
+        """Adds (or replaces) the entities a query resolved to."""
+        key = normalize_text(query)
+        if not key or not entities:
+            return
+        entry = {"query": query, "entities": entities}
+        features, tf = self._tf(query)
+        with self._lock:
+            if key in self._exact:
+                # Same normalized text: the vector is unchanged, only the answer is updated.
+                self.entries[self._exact[key]] = entry
+                return
+            postings, delta = self._view
+            self._exact[key] = len(self.entries)
+            self.entries.append(entry)
+            self._add_to_delta(delta, len(self.entries) - 1, features, tf, postings.idf)
+            if len(delta.terms) < self.compact_every or self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="topic-index-compact", daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """
+        Recomputes IDF over every entry and rebuilds the CSR postings. The rebuild runs
+        without the lock; entries inserted meanwhile stay in (a re-weighted) delta.
+        """
+        with self._compact_lock:
+            with self._lock:
+                postings, delta = self._view
+                queries = [entry["query"] for entry in self.entries]
+                pending = dict(delta.terms)
+            features, tf, lengths = postings.terms or (
+                np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+            )
+            new = [pending.get(doc_id) or self._tf(query) for doc_id, query in enumerate(queries) if doc_id >= len(lengths)]
+            compacted = self._build(
+                np.concatenate([features] + [f for f, _ in new]),
+                np.concatenate([tf] + [t for _, t in new]),
+                np.concatenate([lengths, np.array([len(f) for f, _ in new], dtype=np.int64)]),
+            )
+            with self._lock:
+                _, delta = self._view
+                fresh = _Delta({}, {})
+                for doc_id in range(compacted.count, len(self.entries)):
+                    features, tf = delta.terms.get(doc_id) or self._tf(self.entries[doc_id]["query"])
+                    self._add_to_delta(fresh, doc_id, features, tf, compacted.idf)
+                self._view = (compacted, fresh)
+
+    def _build(self, features, tf, lengths) -> _Postings:
+        """CSR postings and IDF for every document's flattened features and tf, without a per-document loop."""
+        n_docs = len(lengths)
+        doc_ids = np.repeat(np.arange(n_docs, dtype=np.int32), lengths)
+
+        df = np.bincount(features, minlength=self.N_FEATURES)
+        idf = (np.log((n_docs + 1) / (df + 1)) + 1).astype(np.float32)
+
+        weights = tf * idf[features]
+        norms = np.sqrt(np.bincount(doc_ids, weights=weights.astype(np.float64) ** 2, minlength=n_docs))
+        norms[norms == 0] = 1.0
+        weights = (weights / norms[doc_ids]).astype(np.float32)
+
+        order = np.argsort(features, kind="stable")
+        indptr = np.zeros(self.N_FEATURES + 1, dtype=np.int64)
+        np.cumsum(np.bincount(features, minlength=self.N_FEATURES), out=indptr[1:])
+        return _Postings(indptr, doc_ids[order], weights[order], idf, n_docs, (features, tf, lengths))
+
+    # --- Querying ---
+    def lookup(self, query: str) -> Optional[Dict]:
+        """
+        Returns {"query", "entities", "score"} for the most similar known query when its
+        cosine similarity clears the threshold, otherwise None.
+        """
+        postings, delta = self._view
+        if not self.entries:
+            self.misses += 1
+            return None
+
+        exact = self._exact.get(normalize_text(query))
+        if exact is not None:
+            self.hits += 1
+            return dict(self.entries[exact], score=1.0)
+
+        features, weights = self._vector(query, postings.idf)
+        best_id, best_score = -1, 0.0
+
+        for doc_id in self._candidates(postings, features, weights) + self._delta_candidates(delta, features, weights):
+            score = self._similarity(features, weights, self.entries[doc_id]["query"], postings.idf)
+            if score > best_score:
+                best_id, best_score = doc_id, score
+
+        if best_id < 0 or best_score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(self.entries[best_id], score=best_score)
+
+    def _delta_candidates(self, delta: _Delta, features, weights, top_k: int = 3) -> List[int]:
+        """Like _candidates, for the delta: scores its documents through the query's rarest n-grams' postings."""
+        spans = []
+        for feature, weight in zip(features.tolist(), weights.tolist()):
+            posting = delta.postings.get(feature)
+            if posting:
+                spans.append((posting, weight))
+        spans.sort(key=lambda span: span[0][2])
+        doc_ids, partial, total = [], [], 0
+        for (ids, doc_weights, n), weight in spans:
+            if doc_ids and total + n > self.postings_budget:
+                break
+            doc_ids.append(ids[:n])
+            partial.append(doc_weights[:n] * weight)
+            total += n
+        if not doc_ids:
+            return []
+        doc_ids = np.concatenate(doc_ids)
+        # Delta documents have consecutive ids, so a bincount from the lowest replaces a sort.
+        base = int(doc_ids.min())
+        scores = np.bincount(doc_ids - base, weights=np.concatenate(partial))
+        best = np.argpartition(scores, -top_k)[-top_k:] if len(scores) > top_k else np.arange(len(scores))
+        return [base + int(i) for i in best if scores[i] > 0]
+
+    def _candidates(self, postings: _Postings, features, weights, top_k: int = 3) -> List[int]:
+        """
+        Scores compacted documents through the postings of the query's rarest n-grams and
+        returns the best few. The most common n-grams carry little IDF weight but have the
+        longest postings, so they are skipped once postings_budget would be exceeded.
+        """
+        if not postings.count:
+            return []
+        starts = np.asarray(postings.indptr[features])
+        lengths = np.asarray(postings.indptr[features + 1]) - starts
+        order = np.argsort(lengths, kind="stable")
+        keep = order[np.cumsum(lengths[order]) <= self.postings_budget]
+        if not len(keep):
+            keep = order[:1]
+        starts, lengths, query_weights = starts[keep], lengths[keep], weights[keep]
+        total = int(lengths.sum())
+        if not total:
+            return []
+
+        # Flattened positions of every kept posting, without a Python loop over spans.
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        positions = np.arange(total, dtype=np.int64) + offsets
+        doc_ids, inverse = np.unique(np.asarray(postings.doc_ids[positions]), return_inverse=True)
+        partial = np.bincount(
+            inverse, weights=np.asarray(postings.weights[positions]) * np.repeat(query_weights, lengths)
+        )
+        if len(doc_ids) > top_k:
+            best = np.argpartition(partial, -top_k)[-top_k:]
+            return [int(doc_ids[i]) for i in best]
+        return [int(doc_id) for doc_id in doc_ids]
+
+    def _similarity(self, features, weights, text: str, idf) -> float:
+        """Exact cosine similarity between a query vector and a stored query's text."""
+        doc_features, doc_weights = self._vector(text, idf)
+        return self._dot(features, weights, doc_features, doc_weights)
+
+    @staticmethod
+    def _dot(features, weights, doc_features, doc_weights) -> float:
+        _, q_idx, d_idx = np.intersect1d(features, doc_features, assume_unique=True, return_indices=True)
+        return float(np.dot(weights[q_idx], doc_weights[d_idx]))
+
+    # --- Persistence ---
+    def save(self, directory: str):
+        """Compacts and writes the index atomically (to a temp directory that is then swapped in)."""
+        postings, delta = self._view
+        if delta.terms or not postings.count:
+            self.compact()
+            postings, _ = self._view
+        tmp_dir = f"{directory}.tmp-{os.getpid()}-{int(time.time() * 1000)}"
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "indptr.npy"), postings.indptr)
+        np.save(os.path.join(tmp_dir, "doc_ids.npy"), postings.doc_ids)
+        np.save(os.path.join(tmp_dir, "weights.npy"), postings.weights)
+        np.save(os.path.join(tmp_dir, "idf.npy"), postings.idf)
+        with open(os.path.join(tmp_dir, "entries.jsonl"), "w", encoding="utf-8") as f:
+            # Only the entries the saved postings cover; one inserted since stays for the next save.
+            for entry in self.entries[:postings.count]:
+                f.write(json.dumps(entry) + "\n")
+
+        old_dir = f"{tmp_dir}.old"
+        if os.path.exists(directory):
+            os.replace(directory, old_dir)
+        os.replace(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, threshold: float = 0.8, compact_every: int = 1000) -> "TopicIndex":
+        """Loads a saved index; the postings arrays are memory-mapped rather than read."""
+        index = cls(threshold=threshold, compact_every=compact_every)
+        with open(os.path.join(directory, "entries.jsonl"), encoding="utf-8") as f:
+            index.entries = [json.loads(line) for line in f if line.strip()]
+        index._exact = {normalize_text(entry["query"]): i for i, entry in enumerate(index.entries)}
+        postings = _Postings(
+            np.load(os.path.join(directory, "indptr.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "doc_ids.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "weights.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, "idf.npy"), mmap_mode="r"),
+            len(index.entries),
+            None,
+        )
+        index._view = (postings, _Delta({}, {}))
+        return index
+
+    @classmethod
+    def from_seed_file(cls, path: str, threshold: float = 0.8, compact_every: int = 1000) -> "TopicIndex":
+        """Builds an index from a curated JSON list of {"query", "entities"} records."""
+        index = cls(threshold=threshold, compact_every=compact_every)
+        with open(path, encoding="utf-8") as f:
+            for record in json.load(f):
+                index.entries.append({"query": record["query"], "entities": record["entities"]})
+                index._exact.setdefault(normalize_text(record["query"]), len(index.entries) - 1)
+        index.compact()
+        return index
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "pending": len(self._view[1].terms),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+def test_topic_index(n_entries: int = 100_000):
+    """
+    Checks that paraphrases resolve, that lookups stay sub-millisecond at scale with a full
+    delta, and that the insert triggering a compaction neither blocks nor stalls lookups.
+    """
+    print("\n--- Running TopicIndex Standalone Test ---")
+    index = TopicIndex()
+    for i in range(n_entries):
+        index.entries.append({"query": f"synthetic topic {i} item", "entities": [{"entity": f"Item {i}"}]})
+        index._exact[normalize_text(index.entries[-1]["query"])] = i
+    index.insert("the sun", [{"entity": "Sun", "prompt": "a photograph of the Sun"}])
+    index.compact()
+
+    match = index.lookup("What is the Sun?")
+    print(f"'What is the Sun?' -> {match and match['entities'][0]['entity']}")
+
+    queries = [f"tell me about synthetic topics {i} items" for i in range(0, n_entries, n_entries // 200)]
+    start = time.perf_counter()
+    for query in queries:
+        index.lookup(query)
+    per_lookup_ms = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"{len(queries)} fuzzy lookups over {n_entries} entries: {per_lookup_ms:.3f} ms each")
+
+    # Fill the delta to one short of a compaction, then look up entries only it holds.
+    for i in range(index.compact_every - 1):
+        index.insert(f"new delta subject {i} thing", [{"entity": f"Thing {i}"}])
+    start = time.perf_counter()
+    delta_queries = range(0, index.compact_every - 1, 5)
+    delta_matches = [index.lookup(f"new delta subjects {i} things") for i in delta_queries]
+    delta_ms = (time.perf_counter() - start) / len(delta_queries) * 1000
+    print(f"Lookups with {index.stats()['pending']} pending entries: {delta_ms:.3f} ms each")
+
+    # This insert starts a compaction; lookups keep going while it rebuilds.
+    start = time.perf_counter()
+    index.insert("the moon", [{"entity": "Moon"}])
+    insert_ms = (time.perf_counter() - start) * 1000
+    slowest_ms = 0.0
+    while index._compacting:
+        start = time.perf_counter()
+        index.lookup("tell me about synthetic topics 500 items")
+        slowest_ms = max(slowest_ms, (time.perf_counter() - start) * 1000)
+    moon = index.lookup("What is the Moon?")
+    print(f"Compacting insert: {insert_ms:.1f} ms; slowest lookup during the rebuild: {slowest_ms:.3f} ms")
+
+    ok = (
+        match and match["entities"][0]["entity"] == "Sun" and per_lookup_ms < 1.0
+        and all(m and m["entities"][0]["entity"] == f"Thing {i}" for m, i in zip(delta_matches, delta_queries))
+        and delta_ms < 1.0 and insert_ms < 50 and slowest_ms < 50
+        and moon and moon["entities"][0]["entity"] == "Moon" and index.stats()["pending"] == 0
+    )
+    if ok:
+        print("\n✅ Test successful!")
+    else:
+        print("\n❌ Test failed.")
+
+if __name__ == "__main__":
+    test_topic_index()
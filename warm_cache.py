@@ -0,0 +1,193 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import threading
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+
+from EducationalAnimationPipeline import EducationalAnimationPipeline
+from telemetry import configure_logging
+
+class StageTimer:
+    """Wraps one method of a pipeline component and records how long every call takes."""
+
+    def __init__(self, component, method: str, stage: str, timings: Dict[str, List[float]]):
+        self._component = component
+        self._method = method
+        self._stage = stage
+        self._timings = timings
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._component, name)
+        if name != self._method:
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._timings.setdefault(self._stage, []).append(time.perf_counter() - start)
+        return timed
+
+def read_curriculum(path: str, kind: str) -> List[Tuple[str, str]]:
+    """
+    Reads (kind, text) items from a curriculum file. Plain text files have one topic (or,
+    with --kind entity, one entity) per line; '#' starts a comment. CSV files need a
+    header with a "topic" and/or an "entity" column, and every non-empty cell is an item.
+    """
+    items = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                for column in ("topic", "entity"):
+                    value = (row.get(column) or "").strip()
+                    if value:
+                        items.append((column, value))
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    items.append((kind, line))
+    # Keep the first occurrence of each item, in file order.
+    return list(dict.fromkeys(items))
+
+def load_progress(path: str) -> Dict[Tuple[str, str], Dict]:
+    """Items a previous run already warmed, from its progress file (one JSON line each)."""
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by an interrupted run.
+                done[(record["kind"], record["text"])] = record
+    return done
+
+async def warm(pipeline, items: List[Tuple[str, str]], progress_path: str) -> Dict[str, int]:
+    """Warms every item, appending each fully successful one to the progress file as it finishes."""
+    counts = {"warmed": 0, "failed": 0}
+    with open(progress_path, "a", encoding="utf-8") as progress:
+        def record(kind: str, text: str, results: List[Dict]):
+            if results and not any("error" in result for result in results):
+                counts["warmed"] += 1
+                progress.write(json.dumps({
+                    "kind": kind, "text": text, "entities": [r["entity"] for r in results], "at": time.time(),
+                }) + "\n")
+                progress.flush()
+            else:
+                counts["failed"] += 1
+                errors = [r.get("error") for r in results if "error" in r] or ["no results"]
+                print(f"❌ Could not warm {kind} '{text}': {errors[0]}")
+
+        topics = [text for kind, text in items if kind == "topic"]
+        if topics:
+            async for item in pipeline.stream_batch(topics):
+                record("topic", item["topic"], item["results"])
+
+        async def warm_entity(entity: str):
+            record("entity", entity, [await pipeline.process_entity(entity)])
+
+        entities = [text for kind, text in items if kind == "entity"]
+        await asyncio.gather(*[warm_entity(entity) for entity in entities])
+    return counts
+
+def summarize(timings: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    report = {}
+    for stage, samples in timings.items():
+        ordered = sorted(samples)
+        report[stage] = {
+            "calls": len(ordered),
+            "total_s": sum(ordered),
+            "p50_s": statistics.median(ordered),
+            "p95_s": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+            "max_s": ordered[-1],
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Warm the completion and image caches for a curriculum ahead of class time."
+    )
+    parser.add_argument("curriculum", help="A text file (one item per line) or a CSV with topic/entity columns.")
+    parser.add_argument("--kind", choices=("topic", "entity"), default="topic",
+                        help="What the lines of a plain text curriculum are (default: topic).")
+    parser.add_argument("--output-dir", default="pipeline_outputs", help="The pipeline output directory to warm.")
+    parser.add_argument("--progress", default=None,
+                        help="Progress file used to resume (default: <output-dir>/warm_progress.jsonl).")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress of earlier runs.")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--image-concurrency", type=int, default=4)
+    parser.add_argument("--report", default=None, help="Also write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    items = read_curriculum(args.curriculum, args.kind)
+    progress_path = args.progress or os.path.join(args.output_dir, "warm_progress.jsonl")
+    os.makedirs(os.path.dirname(progress_path) or ".", exist_ok=True)
+    if args.restart and os.path.exists(progress_path):
+        os.remove(progress_path)
+    done = load_progress(progress_path)
+    pending = [item for item in items if item not in done]
+    print(f"📚 {len(items)} curriculum items, {len(items) - len(pending)} already warmed, {len(pending)} to go.")
+
+    timings: Dict[str, List[float]] = {}
+    pipeline = EducationalAnimationPipeline(
+        output_base_dir=args.output_dir,
+        max_workers=max(args.llm_concurrency, args.image_concurrency) * 2,
+        llm_concurrency=args.llm_concurrency,
+        image_concurrency=args.image_concurrency,
+        # Warming renders the full images outright: in progressive mode they would be left
+        # rendering in the background, behind the previews, when the run ends.
+        progressive=False,
+    )
+    pipeline.entity_extractor = StageTimer(pipeline.entity_extractor, "extract_concepts", "extraction", timings)
+    pipeline.prompt_enricher = StageTimer(pipeline.prompt_enricher, "enrich_prompt", "enrichment", timings)
+    pipeline.interest_explorer = StageTimer(pipeline.interest_explorer, "generate_with_focus", "explanation", timings)
+    pipeline.image_generator = StageTimer(pipeline.image_generator, "generate_images", "image", timings)
+    if pipeline.lesson_planner is not None:
+        pipeline.lesson_planner = StageTimer(pipeline.lesson_planner, "plan_lesson", "lesson_plan", timings)
+
+    start = time.perf_counter()
+    try:
+        counts = asyncio.run(warm(pipeline, pending, progress_path))
+        stats = pipeline.stats()
+    finally:
+        pipeline.close()
+    elapsed = time.perf_counter() - start
+
+    warmed = len(items) - len(pending) + counts["warmed"]
+    report = {
+        "items": len(items),
+        "warmed": warmed,
+        "failed": counts["failed"],
+        "coverage": warmed / len(items) if items else 1.0,
+        "elapsed_s": elapsed,
+        "stages": summarize(timings),
+        "image_cache": stats["image_cache"],
+        "completion_cache": stats["completion_cache"],
+    }
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(f"\n{'stage':<14}{'calls':>7}{'total (s)':>11}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for stage, r in report["stages"].items():
+        print(f"{stage:<14}{r['calls']:>7}{r['total_s']:>11.2f}{r['p50_s']:>10.3f}{r['p95_s']:>10.3f}{r['max_s']:>10.3f}")
+    print(f"\nImage cache: {stats['image_cache']['entries']} images, {stats['image_cache']['bytes'] / 1024 ** 2:.1f} MB "
+          f"({stats['image_cache']['hits']} hits, {stats['image_cache']['misses']} misses this run)")
+    print(f"Completion cache: {stats['completion_cache']['entries']} entries "
+          f"({stats['completion_cache']['hits']} hits, {stats['completion_cache']['misses']} misses this run)")
+    print(f"\n{'✅' if not counts['failed'] else '⚠️'} Coverage: {warmed}/{len(items)} items "
+          f"({report['coverage']:.0%}) in {elapsed:.1f}s; {counts['failed']} failed (re-run to retry them).")
+
+if __name__ == "__main__":
+    main()